@@ -1,5 +1,6 @@
 
 import string
+import logging
 import datetime
 
 import numpy as np
@@ -9,15 +10,23 @@ from matplotlib.patches import Rectangle
 
 import saltefficiency.util.blockvisitstats as bvs
 import saltefficiency.util.sdb_utils as su
+import saltefficiency.util.tracing as tracing
+from saltefficiency.util.event_log import EventLog
+from saltefficiency.util.night_data import fetch_night
 
+from timeline import Timeline
 
-def create_night_table(obsdate, sdb, els):
+logger = logging.getLogger(__name__)
+
+
+@tracing.traced('create_night_table')
+def create_night_table(obsdate, sdb, els, night_data=None):
     """Create a table that shows a break down for the night and what happened in each block
 
     Parameters
     ----------
-    nid: int
-        NightInfo_Id
+    obsdate: str
+       Observing date in YYYYMMDD format
 
     sdb: ~mysql.mysql
        A connection to the sdb database
@@ -25,69 +34,97 @@ def create_night_table(obsdate, sdb, els):
     els: ~mysql.mysql
        A connection to the els database
 
+    night_data: ~saltefficiency.util.night_data.NightData
+       Prefetched records of the night. If not given, they are fetched with
+       concurrent queries of the sdb and els.
+
     """
 
+    # fetch the twilight times, event log, weather, blocks and faults
+    if night_data is None:
+        night_data = fetch_night(sdb, els, obsdate)
+
+    block_list=bvs.blockvisitstats(sdb, obsdate, update=False, night_data=night_data)
+    night, night_dict = build_night(els, night_data, block_list)
+    return night_table(sdb, obsdate, night, night_dict)
+
+def build_night(els, night_data, block_list):
+    """Create the timeline of a night and a dictionary of its blocks,
+    faults and mirror alignments keyed by their start time
+
+    Parameters
+    ----------
+    els: ~mysql.mysql
+       A connection to the els database, used if the weather of the night
+       has not been fetched
+
+    night_data: ~saltefficiency.util.night_data.NightData
+       Records of the night
+
+    block_list: list
+       Blocks of the night as returned by blockvisitstats
+
+    Returns
+    -------
+    night: Night
+       the status of the telescope during the night
+
+    night_dict: dict
+       the events of the night keyed by their start time
+
+    """
     # create a dictionary to break down the events of the night
     night_dict = {}
-    nid = su.getnightinfo(sdb, obsdate)
-
-    #get the times for the night
-    record=sdb.select('EveningTwilightEnd, MorningTwilightStart', 'NightInfo', 'NightInfo_Id=%i' % nid)
-    stime=record[0][0]
-    etime=record[0][1]
-    totaltime=(etime-stime).seconds
-    night = Night(nid, stime, etime)
-
-    #get the SO event log
-    record=sdb.select('EventType_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%i' % nid)
-
-    #set it up wtih the correct time
-    event_list=[]
-    for i in range(len(record)):
-        t=record[i][1].seconds
-        #convert to times from the observing day
-        if t < 12*3600:
-           t+=12*3600
-        else:
-           t-=12*3600
-        event_list.append([record[i][0],t])
+    stime = night_data.stime
+    etime = night_data.etime
+    night = Night(night_data.nid, stime, etime)
+
+    #decode the event log with times in seconds from noon of the observing day
+    events = EventLog.from_records(night_data.events, night_data.obsdate)
 
     # add weather down time to night_dict
-    time_list,wea_arr = create_weather(els, stime, etime)
-    night.add_weather(time_list, wea_arr)
+    with tracing.span('create_night_table.weather'):
+        time_list,wea_arr = create_weather(els, stime, etime, night_data.weather)
+        night.add_weather(time_list, wea_arr)
 
     # add the accepted blocks to night_dict
-    block_list=bvs.blockvisitstats(sdb, obsdate, update=False)
     for b in block_list:
-        print b
+        logger.debug('Block %s', b)
         night_dict[b[1]] = ['Science', b]
     night.add_blocks(block_list)
 
     # add fault down time to the night_dict
-    faults = create_faults(sdb, nid)
-    problem_list=[]
-    for f in faults:
-        t1 = (f[1]-night.day_start).seconds
-        t2 = (f[2]-night.day_start).seconds
-        problem_list.append([t1, t2])
-        print f
-        night_dict[f[1]] = ['Fault', f]
-    night.add_problems(problem_list)
+    with tracing.span('create_night_table.faults'):
+        faults = night_data.faults
+        problem_list=[]
+        for f in faults:
+            t1 = (f[1]-night.day_start).seconds
+            t2 = (f[2]-night.day_start).seconds
+            problem_list.append([t1, t2])
+            logger.debug('Fault %s', f)
+            night_dict[f[1]] = ['Fault', f]
+        night.add_problems(problem_list)
 
 
 
     # add mirror alignment to the night_dict
-    mirror_alignment=create_mirror_alignment(event_list)
-    night.add_mirroralignment(mirror_alignment)
-    for m in mirror_alignment:
-        t1 = convert_decimal_hours(obsdate, m[0]/3600.0)
-        night_dict[t1] = ['Mirror', m]
+    with tracing.span('create_night_table.mirror_alignment'):
+        mirror_alignment=create_mirror_alignment(events)
+        night.add_mirroralignment(mirror_alignment)
+        for m in mirror_alignment:
+            t1 = night.day_start + datetime.timedelta(seconds=m[0])
+            night_dict[t1] = ['Mirror', m]
 
 
     # use the dict to populate the table to display what did happen
     night.calc_engineering()
     night.calc_weather()
+    return night, night_dict
 
+def night_table(sdb, obsdate, night, night_dict):
+    """Return the html of the statistics and the table of segments of a
+    night created with build_night
+    """
     #night.plot()
     info_txt="""
     Total Time: {5:0.2f} <br>
@@ -99,53 +136,44 @@ def create_night_table(obsdate, sdb, els):
     Mirror Alignment Time: {2:0.2f} <br>\n
 """.format(night.sciencetime, night.weathertime, night.mirroralignmenttime, night.problemtime, night.engineertime, night.totaltime/3600.0)
 
-    table_txt ='<p><table>'
-    table_txt +='<tr><th>Time</th><th>Type</th><th>Length</th><th>Comment</th></tr>\n'
-    status = 0
-    start = None
-    for i in range(len(night.status_arr)):
-        if start is not None and night.status_arr[i]!=status:
-           table_txt += create_row(sdb, start, i, night_dict, night, obsdate)
-           start=None
-        if night.status_arr[i]>0 and start is None:
-           status = night.status_arr[i]
-           start = i
+    with tracing.span('create_night_table.rows'):
+        table_txt ='<p><table>'
+        table_txt +='<tr><th>Time</th><th>Type</th><th>Length</th><th>Comment</th></tr>\n'
+        for segment in night.segments():
+            table_txt += create_row(sdb, segment, night_dict, night, obsdate)
 
     table_txt +='</table></p>\n'
     return  info_txt + table_txt
 
-def create_row(sdb, sid, eid, night_dict, night, obsdate):
-    """Create a row with all the information for that block
+def create_row(sdb, segment, night_dict, night, obsdate):
+    """Create a row with all the information for a segment of the night
     """
-    status = night.status_arr[sid]
+    start, end, status = segment
 
-    t1 = convert_decimal_hours(obsdate, night.time_arr[sid])
-    t2 = convert_decimal_hours(obsdate, night.time_arr[eid])
+    t1 = night.day_start + datetime.timedelta(seconds=int(round(start)))
+    t2 = night.day_start + datetime.timedelta(seconds=int(round(end)))
 
 
-    l=(t2-t1).seconds/3600.0
+    l=(end-start)/3600.0
     length='{0}:{1}'.format(int(l), string.zfill(int(60.0*(l-int(l))),2))
 
     #find the key
     min_time = 600
     block_time = None
-    t0 = convert_decimal_hours(obsdate, 1.0)
     for k in night_dict.keys():
-        t = (t1 - t0).seconds - (k-t0).seconds
+        t = (t1 - k).total_seconds()
         if abs(t) < min_time:
            block_time = k
            min_time = abs(t)
 
-    keys = night_dict.keys()
-
     #create the row
     fgcolor='#000000'
     if status==1: fgcolor='#FFFFFF'
     row_str='<tr height={5}><td>{0}<br>{1}</td><td bgcolor="{2}"><font color="{4}">{3}</font></td>'.format(t1, t2, night.color_list[status], night.statusname_list[status], fgcolor, 50*l)
     row_str+='<td>{0}</td>'.format(length)
-    if status==1:
+    if status==1 and block_time is not None and night_dict[block_time][0]=='Science':
        b = night_dict[block_time][1]
-       print b
+       logger.debug('Row of block %s', b)
        row_str+='<td>{0}</td>'.format(b[4])
     row_str+='</tr>\n'
     return row_str
@@ -169,45 +197,50 @@ def create_faults(sdb, nid):
     """
     select = 'Fault_id, FaultStart, FaultEnd, TimeLost, SaltSubsystem'
     tables = 'Fault join SaltSubsystem using (SaltSubsystem_Id)'
-    logic = 'NightInfo_Id={} and TimeLost > 0'.format(nid)
-    return sdb.select(select, tables, logic)
+    logic = 'NightInfo_Id=%s and TimeLost > 0'
+    return sdb.select(select, tables, logic, (nid,))
 
-def create_weather(els, stime, etime):
+def create_weather(els, stime, etime, weather=None):
     """Return an array of times that the weather was bad
+
+    The weather records are fetched from the els unless they are given.
     """
-    weather_info = su.get_weather_info(els, stime, etime)
-    time_list, air_arr, dew_arr, hum_arr, w30_arr, w30d_arr, w10_arr, \
-    w10d_arr, rain_list, t02_arr, t05_arr, t10_arr, t15_arr, t20_arr, \
-    t25_arr, t30_arr = weather_info
+    if weather is None:
+        weather = su.get_weather_info(els, stime, etime)
 
     #need to include other/better limits
-    wea_arr = (hum_arr>85.0)
-    return time_list, wea_arr
+    wea_arr = (weather['rel_humidity']>85.0)
+    return weather['time'], wea_arr
 
-def create_mirror_alignment(event_list):
+def create_mirror_alignment(events):
     """Determine the mirror alignment time
+
+    Returns a list of [start, end] pairs in seconds from noon of the
+    observing day for an ~saltefficiency.util.event_log.EventLog.
     """
-    mirror_list=[]
-    mirror_start=False
-    for r in event_list:
-        if r[0]==10 and mirror_start==False:
-           t=r[1]
-           #use the time from the
-           if old_event[0] in [4, 6, 13, 14]: t=old_event[1]
-           mirror_start=[t]
-        if mirror_start:
-           if r[0] in [3,5]:
-              t=r[1]
-              mirror_start.append(t)
-              mirror_list.append(mirror_start)
-              mirror_start=False
-        old_event = r
-    return mirror_list
+    return events.mirror_alignments().tolist()
 
 
 
 
 class Night:
+   """The status of the telescope during a night
+
+      The status is kept as an exact timeline of intervals in seconds since
+      noon of the observing date. Intervals added later take precedence
+      over earlier ones. All accumulated times are in hours.
+
+      Parameters
+      ----------
+      nid: int
+          NightInfo_Id
+      night_start: datetime
+          start of the night (evening twilight end)
+      night_end: datetime
+          end of the night (morning twilight start)
+
+   """
+
    def __init__(self, nid, night_start, night_end):
        self.nid=nid
        self.night_start = night_start
@@ -219,32 +252,46 @@ class Night:
        self.problemtime=0
        self.shuttertime=0
        self.mirroralignmenttime=0
-       self.dt=0.1
 
-       #set up arrays to represent different events
-       self.time_arr =  np.arange(0,24,self.dt) #array representing time since noon that day
+       #set up the timeline of the night
+       self.timeline = Timeline()
        self.day_start = datetime.datetime(self.night_start.year, self.night_start.month, self.night_start.day, 12,0,0)
-       self.night_time = (self.time_arr > (self.night_start-self.day_start).seconds/3600.0) * ( self.time_arr < (self.night_end-self.day_start).seconds/3600.0)
-       self.status_arr = np.zeros(len(self.time_arr), dtype=int)
-       self.stime = (self.night_start-self.day_start).seconds/3600.0
-       self.etime = (self.night_end-self.day_start).seconds/3600.0
+       self.stime = self.seconds(self.night_start)/3600.0
+       self.etime = self.seconds(self.night_end)/3600.0
 
        #set color and name list
        self.statusname_list=['none', 'Science', 'Engineer', 'Weather', 'Problem', 'Rejected']
        self.color_list=['none', 'blue', 'green', 'purple', 'red','yellow'] #none, science, engineer, weather, problem, rejected
 
-   def add_weather(self, time_list, wea_arr):
+   def seconds(self, t):
+       """Convert a date time to seconds since noon of the observing date"""
+       dt = t - self.day_start
+       return dt.days*86400 + dt.seconds + dt.microseconds/1e6
+
+   def add_weather(self, time_list, wea_arr, max_sample_gap=600):
        """Add the weather to the status array and weather
           the telescope is closed for weather or not
 
-          time_list is in seconds since the start of the night
+          time_list is in seconds since the start of the night. A weather
+          sample is taken to hold until the next sample, but for at most
+          max_sample_gap seconds.
        """
-       nstart = (self.night_start-self.day_start).seconds
-
-       for i in range(len(time_list)):
-           if wea_arr[i]:
-              t = int((nstart + time_list[i])/3600.0/self.dt)
-              self.status_arr[t]=3
+       if len(time_list)==0: return
+       nstart = self.seconds(self.night_start)
+
+       t = nstart + np.asarray(time_list, dtype=float)
+       bad = np.asarray(wea_arr, dtype=bool)
+       ends = np.append(t[1:], t[-1]+max_sample_gap)
+       ends = np.minimum(ends, t+max_sample_gap)
+
+       #join consecutive bad samples into intervals
+       starts = t[bad]
+       stops = ends[bad]
+       if len(starts)==0: return
+       first = np.concatenate([[True], starts[1:] > stops[:-1]])
+       last = np.concatenate([first[1:], [True]])
+       for t1, t2 in zip(starts[first], stops[last]):
+           self.timeline.add(t1, t2, 3)
        return
 
    def add_mirroralignment(self, mirror_list):
@@ -252,61 +299,52 @@ class Night:
        """
 
        for t1,t2 in mirror_list:
-           t1=t1/3600.0
-           t2=t2/3600.0
-           if t1 > self.stime and t1 < self.etime:
-              self.mirroralignmenttime += t2-t1
-              print t1, t2, self.stime, self.etime, self.mirroralignmenttime
-              mask = (self.time_arr>t1)*(self.time_arr<t2)
-              mid = np.where(mask)[0]
-              self.status_arr[mid] = 2
+           if t1/3600.0 > self.stime and t1/3600.0 < self.etime:
+              self.mirroralignmenttime += (t2-t1)/3600.0
+              self.timeline.add(t1, t2, 2)
 
    def add_problems(self, problems_list):
        """Add the problems to the status array
        """
 
        for t1,t2 in problems_list:
-           t1=t1/3600.0
-           t2=t2/3600.0
-           if t1 > self.stime and t1 < self.etime:
-              et2 = min(t2, self.etime)
-              self.problemtime += et2-t1
-              mask = (self.time_arr>t1)*(self.time_arr<t2)
-              mid = np.where(mask)[0]
-              self.status_arr[mid] = 4
+           if t1/3600.0 > self.stime and t1/3600.0 < self.etime:
+              et2 = min(t2/3600.0, self.etime)
+              self.problemtime += et2-t1/3600.0
+              self.timeline.add(t1, t2, 4)
 
    def add_blocks(self, block_list):
        """Add science time blocks to the status array
        """
        for bvid, t1,t2,stat, propcode in block_list:
-           t1 =  (t1- self.day_start).seconds/3600.0
-           t2 =  (t2- self.day_start).seconds/3600.0
-           et1 = max(self.stime, t1)
-           if t1 < self.etime:
-              et2 = min(t2, self.etime)
-              mask = (self.time_arr>t1)*(self.time_arr<t2)
-              mid = np.where(mask)[0]
+           t1 = self.seconds(t1)
+           t2 = self.seconds(t2)
+           et1 = max(self.stime, t1/3600.0)
+           if t1/3600.0 < self.etime:
+              et2 = min(t2/3600.0, self.etime)
               if stat==0:
                   self.sciencetime += et2-et1
-                  self.status_arr[mid] = 1
+                  self.timeline.add(t1, t2, 1)
               else:
-                  self.status_arr[mid] = 5
+                  self.timeline.add(t1, t2, 5)
                   if stat==3: self.weathertime += et2-et1
-                  if stat<3:
-                     pass #self.problemtime += et2-et1
-                     #print 'reject', self.problemtime, et2,et1
 
    def calc_engineering(self):
-       for i in range(len(self.time_arr)):
-           if self.time_arr[i]>self.stime and self.time_arr[i]<self.etime:
-              if self.status_arr[i]==2 or self.status_arr[i]==0:
-                 self.engineertime += self.dt
+       """Add the time without science, weather, problems or rejected
+          blocks during the night to the engineering time
+       """
+       nstart, nend = self.stime*3600.0, self.etime*3600.0
+       self.engineertime += self.timeline.total([None, 2], nstart, nend)/3600.0
 
    def calc_weather(self):
-       for i in range(len(self.time_arr)):
-           if self.time_arr[i]>self.stime and self.time_arr[i]<self.etime:
-              if self.status_arr[i]==3:
-                 self.weathertime += self.dt
+       """Add the time lost to weather during the night to the weather time
+       """
+       nstart, nend = self.stime*3600.0, self.etime*3600.0
+       self.weathertime += self.timeline.total([3], nstart, nend)/3600.0
+
+   def segments(self):
+       """Return the merged (start, end, status) segments of the night"""
+       return self.timeline.segments()
 
    def plot(self):
 
@@ -317,11 +355,9 @@ class Night:
        ax.add_patch(Rectangle((self.stime,0),self.totaltime/3600.0,4, alpha=0.3))
 
        #add status patches
-       for i in range(len(self.status_arr)):
-          if self.status_arr[i]>0:
-             color=color_list[self.status_arr[i]]
-             ax.add_patch(Rectangle((self.time_arr[i],1),self.dt,0.5, alpha=1.0, facecolor=color, edgecolor=color)) #color_list[self.status_arr[i]]))
+       for start, end, status in self.segments():
+           color=color_list[status]
+           ax.add_patch(Rectangle((start/3600.0,1),(end-start)/3600.0,0.5, alpha=1.0, facecolor=color, edgecolor=color))
 
        ax.axis([7,17,1,1.5])
        pl.show()
-
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Live mode of the night summary page.
+
+LiveNight keeps the records of the current night in memory and polls the sdb
+and els for the records added since the previous poll, using the largest
+SoLogEvent_Id, PointEvent_Id and FileData_Id and the latest weather
+timestamp seen as cursors. Only the pointings affected by the new records
+are matched to block visits again, and the page is rewritten (atomically)
+if anything changed, so that the page can be refreshed every minute:
+
+    live = LiveNight('20160331', sdb, els)
+    live.run(interval=60)
+
+The block visits and faults of the night are edited in place during the
+night (the SA accepts or rejects a block after its visit, and the end of a
+fault is filled in later), so that they are read again by every poll; both
+are small lookups by NightInfo_Id.
+"""
+
+import os
+import sys
+import time
+import bisect
+import logging
+import datetime
+
+import numpy as np
+
+import saltefficiency.util.mysql as mysql
+import saltefficiency.util.blockvisitstats as bvs
+import saltefficiency.util.sdb_utils as su
+import saltefficiency.util.tracing as tracing
+from saltefficiency.util.blockmatching import BlockIndex, EventIndex, ImageIndex, PointEventIndex, \
+     UT_OFFSET, UTSTART, OBSMODE, DETMODE, BLOCK_ID
+from saltefficiency.util.event_log import EventLog, day_start
+from saltefficiency.util.file_index import file_night
+from saltefficiency.util.night_data import fetch_night_info
+
+from create_night_table import build_night, night_table
+from night_summary_page import write_night_page
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SELECT = 'FileData_Id, FileName, Proposal_Code, Target_Name, ExposureTime, UTSTART, h.INSTRUME, h.OBSMODE, h.DETMODE, h.CCDTYPE, NExposures, Block_Id'
+IMAGE_TABLE = 'FileData join ProposalCode using (ProposalCode_Id) join FitsHeaderImage as h using (FileData_Id)'
+FILE_SELECT = 'FileData_Id, FileName, Proposal_Code, INSTRUME, Target_Name'
+FILE_TABLE = 'FileData join ProposalCode using (ProposalCode_Id)'
+BLOCK_SELECT = 'BlockVisit_Id, Accepted, Proposal_Code, Block_Id, BlockRejectedReason_Id'
+BLOCK_TABLE = 'Block join BlockVisit using (Block_Id) join Proposal using (Proposal_Id) join ProposalCode using (ProposalCode_Id)'
+FAULT_SELECT = 'Fault_id, FaultStart, FaultEnd, TimeLost, SaltSubsystem'
+FAULT_TABLE = 'Fault join SaltSubsystem using (SaltSubsystem_Id)'
+
+# number of polls for which the FITS header of a new data file is looked for
+HEADER_POLLS = 5
+
+
+class LiveNight:
+   """The records of a night, updated with the records added to the
+      databases during the night
+
+      Parameters
+      ----------
+      obsdate: str
+           observing date in YYYYMMDD format
+      sdb: ~mysql.mysql
+           A connection to the sdb database
+      els: ~mysql.mysql
+           A connection to the els database
+      dirname: str
+           directory of the night page
+
+   """
+
+   def __init__(self, obsdate, sdb, els, dirname='./logs/'):
+       self.obsdate = obsdate
+       self.sdb = sdb
+       self.els = els
+       self.dirname = dirname
+       self.night_data = None #~saltefficiency.util.night_data.NightData
+
+       #largest ids and weather timestamp read so far
+       self.event_cursor = 0
+       self.pointevent_cursor = 0
+       self.file_cursor = 0
+       self.weather_cursor = None
+
+       self._file_ids = set()
+       self._headers = {} #remaining polls of the data files without a FITS header, by FileData_Id
+       self._pointevents = [] #(datetime, Proposal_Code, BlockVisit_Id)
+
+       #the pointings as [start time, end time, block index state before
+       #the pointing, ~blockvisitstats.PointingMatch (None if the pointing
+       #event has not been written yet)], and the block index state after
+       #the last pointing
+       self._pointings = []
+       self._state = {}
+
+       self._event_index = None
+       self._image_index = None
+       self._block_index = None
+       self._pointevent_index = None
+       self._reasons = None
+
+   def block_list(self):
+       """Return the blocks of the pointings as returned by blockvisitstats"""
+       return [p[3].block for p in self._pointings if p[3] is not None and p[3].block is not None]
+
+   @tracing.traced('live_night.load')
+   def load(self):
+       """Read the night information and the records of the night written so
+          far
+       """
+       nights = fetch_night_info(self.sdb, self.obsdate, self.obsdate)
+       if self.obsdate not in nights:
+          raise ValueError('There is no night information for {0}'.format(self.obsdate))
+       night_data = nights[self.obsdate]
+       night_data.weather = su.decodeweather([], 0)
+       self.night_data = night_data
+       self.weather_cursor = int(su.els_time(night_data.stime))
+
+       #the files written after the largest FileData_Id are read by the
+       #polls; files written in between are read twice but added once
+       self.file_cursor = self.sdb.select('MAX(FileData_Id)', 'FileData', '')[0][0] or 0
+       logic, params = su.night_files_logic(self.sdb, [self.obsdate])
+       self._add_files(self.sdb.select(FILE_SELECT, FILE_TABLE, logic, params))
+
+       #all other records are read from the start of the night
+       self.poll()
+
+   @tracing.traced('live_night.poll')
+   def poll(self):
+       """Read the records added since the previous poll and match the
+          pointings affected by them again
+
+          Returns
+          -------
+          changed: boolean
+              whether the page of the night has changed
+
+       """
+       night_data = self.night_data
+       info = fetch_night_info(self.sdb, self.obsdate, self.obsdate)[self.obsdate]
+       changed = (info.staff, info.night_times) != (night_data.staff, night_data.night_times)
+       night_data.staff = info.staff
+       night_data.night_times = info.night_times
+
+       events = self._poll_events()
+       pointevents = self._poll_pointevents()
+       files, images = self._poll_files()
+       codes = self._poll_blocks()
+       faults = self._poll_faults()
+       weather = self._poll_weather()
+
+       if events or self._event_index is None:
+          self._event_index = EventIndex(EventLog.from_records(night_data.events, self.obsdate))
+       if images or self._image_index is None: self._image_index = ImageIndex(night_data.images)
+       if pointevents: self._pointevent_index = PointEventIndex(self._pointevents)
+       if codes or self._block_index is None:
+          self._block_index = BlockIndex(night_data.blocks)
+          self._reasons = dict((b[0], b[4]) for b in night_data.blocks)
+       if self._pointevent_index is None: self._pointevent_index = PointEventIndex(self._pointevents)
+
+       first = self._first_affected(events, pointevents, images, codes)
+       if first is not None:
+          self._match(first)
+       logger.debug('Poll of %s: %d events, %d pointings, %d files, %d images, %d changed proposals, '
+                    '%d weather records; matched from pointing %s', self.obsdate, len(events),
+                    len(pointevents), files, len(images), len(codes), weather, first)
+       return bool(changed or events or pointevents or files or codes or faults or weather)
+
+   def _poll_events(self):
+       """Add the new SO events and return them"""
+       record = self.sdb.select('SoLogEvent_Id, EventType_Id, EventTime', 'SoLogEvent',
+                                'NightInfo_Id=%s and SoLogEvent_Id>%s order by SoLogEvent_Id',
+                                (self.night_data.nid, self.event_cursor))
+       events = []
+       for r in record:
+           self.night_data.events.append(r[1:])
+           events.append([r[1], bvs.converteventtime(self.obsdate, r[2])])
+           self.event_cursor = max(self.event_cursor, r[0])
+       return events
+
+   def _poll_pointevents(self):
+       """Add the new pointing events and return them"""
+       table = 'PointEvent join SoLogEvent using (SoLogEvent_Id)'
+       record = self.sdb.select('PointEvent_Id, EventTime, Proposal_Code, BlockVisit_Id', table,
+                                'NightInfo_Id=%s and PointEvent_Id>%s order by PointEvent_Id',
+                                (self.night_data.nid, self.pointevent_cursor))
+       pointevents = []
+       for r in record:
+           self.night_data.pointevents.append(r[1:])
+           pointevents.append((bvs.converteventtime(self.obsdate, r[1]), r[2], r[3]))
+           self.pointevent_cursor = max(self.pointevent_cursor, r[0])
+       self._pointevents.extend(pointevents)
+       return pointevents
+
+   def _add_files(self, record):
+       """Add the data files of the night among FileData records and return
+          their number
+       """
+       n = 0
+       for r in record:
+           self.file_cursor = max(self.file_cursor, r[0])
+           if r[0] in self._file_ids or file_night(r[1]) != self.obsdate: continue
+           self._file_ids.add(r[0])
+           self._headers[r[0]] = HEADER_POLLS
+           self.night_data.files.append(r[1:])
+           n += 1
+       return n
+
+   def _poll_files(self):
+       """Add the new data files of the night and the images of the files
+          with a FITS header
+
+          Returns
+          -------
+          files: int
+              number of new data files
+          images: list
+              new images
+
+       """
+       #FileData_Id grows with every file, so that only the end of the
+       #primary key is read
+       files = self._add_files(self.sdb.select(FILE_SELECT, FILE_TABLE, 'FileData_Id>%s order by FileData_Id',
+                                               (self.file_cursor,)))
+       images = []
+       if self._headers:
+          ids = tuple(sorted(self._headers.keys()))
+          logic = 'FileData_Id in ('+', '.join(['%s']*len(ids))+')'
+          for r in self.sdb.select(IMAGE_SELECT, IMAGE_TABLE, logic, ids):
+              del self._headers[r[0]]
+              #keep the images ordered by file name, as blockvisitstats does
+              bisect.insort(self.night_data.images, r[1:])
+              images.append(r[1:])
+          #the header of a file may be written after the file
+          for i in list(self._headers.keys()):
+              self._headers[i] -= 1
+              if self._headers[i] <= 0: del self._headers[i]
+       return files, images
+
+   def _poll_blocks(self):
+       """Read the block visits of the night again and return the proposal
+          codes of the visits which have been added or changed
+       """
+       blocks = list(self.sdb.select(BLOCK_SELECT, BLOCK_TABLE, 'NightInfo_Id=%s order by BlockVisit_Id',
+                                     (self.night_data.nid,)))
+       changed = set(blocks).symmetric_difference(self.night_data.blocks)
+       self.night_data.blocks = blocks
+       return set(b[2] for b in changed)
+
+   def _poll_faults(self):
+       """Read the faults of the night again and return whether they have
+          changed
+       """
+       faults = list(self.sdb.select(FAULT_SELECT, FAULT_TABLE, 'NightInfo_Id=%s and TimeLost > 0',
+                                     (self.night_data.nid,)))
+       changed = faults != list(self.night_data.faults)
+       self.night_data.faults = faults
+       return changed
+
+   def _poll_weather(self):
+       """Add the new weather records of the night and return their number"""
+       if self.els is None: return 0
+       etime = int(su.els_time(self.night_data.etime))
+       if self.weather_cursor >= etime: return 0
+       record = self.els.select(su.WEATHER_SELECT, su.WEATHER_TABLE, 'timestamp>%s and timestamp<%s order by timestamp',
+                                (self.weather_cursor, etime))
+       if not len(record): return 0
+       weather = su.decodeweather(record, su.els_time(self.night_data.stime))
+       self.night_data.weather = np.concatenate([self.night_data.weather, weather])
+       self.weather_cursor = max(self.weather_cursor, int(max(r[0] for r in record)))
+       return len(record)
+
+   def _first_affected(self, events, pointevents, images, codes):
+       """Return the index of the first pointing whose match may be changed
+          by the new records, or None if no pointing is affected
+       """
+       etime = self.night_data.etime
+       points = self._event_index.times((3,))
+       guiding = [e[1] for e in events if e[0] == 5]
+       pointings = set(p[0] for p in pointevents)
+       image_times = [(img[UTSTART]+UT_OFFSET, img) for img in images if img[UTSTART] is not None]
+       accepted = self._block_index.accepted_codes
+       for i, (start, end, state, match) in enumerate(self._pointings):
+           if i >= len(points) or points[i] != start or self._event_index.findnextpointing(start, etime) != end:
+              return i
+           if match is None or start in pointings or match.propcode in codes:
+              return i
+           #the start of guiding for accepted blocks
+           if match.bid is not None and match.propcode in accepted:
+              if [t for t in guiding if start < t and (match.guidestart is None or t < match.guidestart)]:
+                 return i
+           for t, img in image_times:
+               #the data of the pointing and the primary mode of its block
+               if start < t < end or (match.bid is not None and img[BLOCK_ID] == match.bid):
+                  return i
+               #the first image in the primary mode
+               if match.mode is not None and start < t:
+                  instr, primary_mode = match.mode
+                  if img[DETMODE if instr == 'SCAM' else OBSMODE] == primary_mode:
+                     return i
+       if len(points) > len(self._pointings):
+          return len(self._pointings)
+       return None
+
+   @tracing.traced('live_night.match')
+   def _match(self, first):
+       """Match the pointings from the given index onwards again"""
+       block_index = self._block_index
+       if first < len(self._pointings):
+          block_index.restore(self._pointings[first][2])
+       else:
+          block_index.restore(self._state)
+       del self._pointings[first:]
+
+       etime = self.night_data.etime
+       for start in self._event_index.times((3,))[first:]:
+           end = self._event_index.findnextpointing(start, etime)
+           state = block_index.state()
+           try:
+              match = bvs.match_pointing(self.sdb, start, end, self._event_index, self._image_index, block_index,
+                                         self._pointevent_index, self._reasons)
+           except IndexError:
+              #the pointing event has not been written yet
+              match = None
+           self._pointings.append([start, end, state, match])
+       self._state = block_index.state()
+
+   @tracing.traced('live_night.write')
+   def write(self):
+       """Write the page of the night"""
+       night, night_dict = build_night(self.els, self.night_data, self.block_list())
+       break_txt = '<h3> Night Breakdown</h3>'
+       break_txt += night_table(self.sdb, self.obsdate, night, night_dict)
+       write_night_page(self.obsdate, self.night_data, break_txt, self.dirname)
+
+   def update(self):
+       """Read the new records and rewrite the page if it has changed
+
+          Returns
+          -------
+          changed: boolean
+              whether the page has been rewritten
+
+       """
+       if self.night_data is None:
+          self.load()
+          changed = True
+       else:
+          changed = self.poll()
+       if changed: self.write()
+       return changed
+
+   def run(self, interval=60, end=None):
+       """Update the page every interval seconds until the end time
+
+          Parameters
+          ----------
+          interval: float
+              time between the updates in seconds
+          end: datetime
+              time (SAST) of the last update; an hour after morning
+              twilight by default, or noon after the night if the night
+              information cannot be read
+
+       """
+       default_end = end is None
+       if default_end:
+          end = day_start(self.obsdate) + datetime.timedelta(days=1)
+       while True:
+           start = time.time()
+           try:
+               self.update()
+           except Exception:
+               #the databases may be unavailable for a while
+               logger.exception('Update of the night page of %s failed', self.obsdate)
+           if default_end and self.night_data is not None:
+              end = self.night_data.etime + datetime.timedelta(hours=1)
+           if datetime.datetime.now() >= end: break
+           time.sleep(max(0, interval-(time.time()-start)))
+
+if __name__=='__main__':
+
+    # usage: live_night.py obsdate [interval in seconds]
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING'))
+    trace_file = tracing.from_environment()
+
+    sdbhost='sdb.salt'
+    sdbname='sdb'
+    user=os.environ['SDBUSER']
+    password=os.environ['SDBPASS']
+    sdb=mysql.mysql(sdbhost, sdbname, user, password, port=3306)
+
+    elshost='db.suth.saao.ac.za'
+    elsname='els'
+    elsuser=os.environ['ELSUSER']
+    elspassword=os.environ['ELSPASS']
+    els=mysql.mysql(elshost, elsname, elsuser, elspassword, port=3306)
+
+    obsdate = sys.argv[1]
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    LiveNight(obsdate, sdb, els).run(interval)
+
+    if trace_file:
+        tracing.tracer.export(trace_file)
+        sys.stderr.write(tracing.tracer.summary()+'\n')
@@ -8,20 +8,27 @@ date at SALT
 
 import os
 import sys
+import logging
 import pandas as pd
 import pandas.io.sql as psql
 import MySQLdb
 import matplotlib.pyplot as pl
 import numpy as np
 from datetime import datetime
+from StringIO import StringIO
 
-import saltefficiency.util.mysql
+import saltefficiency.util.mysql as mysql
 import saltefficiency.util.report_queries as rq
 import saltefficiency.util.sdb_utils as su
+import saltefficiency.util.tracing as tracing
+from saltefficiency.util.night_data import fetch_night, fetch_nights
 
 from create_night_table import create_night_table
 
-def night_summary_page(obsdate, sdb, els, dirname='./logs/'):
+logger = logging.getLogger(__name__)
+
+@tracing.traced('night_summary_page')
+def night_summary_page(obsdate, sdb, els, dirname='./logs/', night_data=None):
     """Create a summary for the given observing date
 
     Parameters
@@ -38,16 +45,31 @@ def night_summary_page(obsdate, sdb, els, dirname='./logs/'):
     els: ~mysql.mysql
        A connection to the els database
 
+    night_data: ~saltefficiency.util.night_data.NightData
+       Prefetched records of the night; if not given, they are fetched
+       for the night
+
 
     """
-    night_txt=''
-
-    # display the night information
-    nid = su.getnightinfo(sdb, obsdate)
-    logic = 'NightInfo_Id={}'.format(nid)
-    sa = sdb.select('Surname', 'NightInfo join Investigator on SA_Id=Investigator_Id', logic)[0][0]
-    so = sdb.select('Surname', 'NightInfo join SaltOperator on SO1_Id=SO_Id', logic)[0][0]
-    ct = sdb.select('Surname', 'NightInfo join Investigator on CTDuty_Id=Investigator_Id', logic)[0][0]
+    # get all the records for the night
+    if night_data is None:
+        night_data = fetch_night(sdb, els, obsdate)
+
+    # display the night break down
+    break_txt = '<h3> Night Breakdown</h3>'
+    break_txt += create_night_table(obsdate, sdb, els, night_data=night_data)
+    logger.debug('Night breakdown of %s: %s', obsdate, break_txt)
+
+    # add a list of accecpted blocks
+
+    #write the results to the output, followed by a list of proposals and
+    #the files for each proposal
+    with tracing.span('night_summary_page.write'):
+        write_night_page(obsdate, night_data, break_txt, dirname)
+
+def night_info(obsdate, night_data):
+    """Return the html of the staff and the statistics of a night"""
+    sa, so, ct = night_data.staff
     info_txt = """
 <h2> Night Summary for {0} </h2>
 <div>
@@ -56,8 +78,7 @@ def night_summary_page(obsdate, sdb, els, dirname='./logs/'):
    CT: {3} <br>
 </div>""".format(obsdate, sa, so, ct)
 
-    sel_times = 'ScienceTime, EngineeringTime, TimeLostToWeather, TimeLostToProblems'
-    night_times = sdb.select(sel_times, 'NightInfo', logic)[0]
+    night_times = [t or 0 for t in night_data.night_times]
     info_txt += """\n
 <div>
 <h3> Night Statistics </h3>
@@ -66,84 +87,146 @@ def night_summary_page(obsdate, sdb, els, dirname='./logs/'):
     Time Lost to Weather: {2:.2f} <br>
     Time Lost to Problems: {3:.2f} <br>
 </div>\n""".format(night_times[0]/3600.0, night_times[1]/3600.0, night_times[2]/3600.0, night_times[3]/3600.0,)
+    return info_txt
 
-    night_txt += info_txt
+def write_night_page(obsdate, night_data, break_txt, dirname='./logs/'):
+    """Write the page of a night
 
-    # display the night break down
-    break_txt = '<h3> Night Breakdown</h3>'
-    break_txt += create_night_table(obsdate, sdb, els)
-    print break_txt
-    night_txt += break_txt
+    The page is written to a temporary file, which then replaces the page,
+    so that a reader never sees a partially written page.
 
-    # add a list of accecpted blocks
+    Parameters
+    ----------
+    obsdate: str
+       Observing date in YYYYMMDD format
 
-    # add a list of proposals and files for each proposal
-    data_txt = data_breakdown(sdb, obsdate)
-    night_txt += data_txt
+    night_data: ~saltefficiency.util.night_data.NightData
+       Records of the night
 
-    #write the results to the output
-    write_night_report_to_file(obsdate, night_txt, dirname)
+    break_txt: str
+       Html of the night breakdown
+
+    dirname: str
+       Default directory to write results
 
-def data_breakdown(sdb, obsdate):
-    """Produce a list of the data associated with each proposal
-       observed that night
     """
-    data_txt = '<h3> Data Files</h3>'
+    filename = night_report_filename(obsdate, dirname)
+    tmpname = '{0}.{1}.tmp'.format(filename, os.getpid())
+    try:
+        with open(tmpname, 'w') as f:
+            f.write(night_report_header(obsdate))
+            f.write(night_info(obsdate, night_data))
+            f.write(break_txt)
+            write_data_breakdown(f, night_data.files)
+            f.write(night_report_footer())
+        os.rename(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname): os.remove(tmpname)
+
+def night_summary_pages(startdate, enddate, sdb, els, dirname='./logs/'):
+    """Create the summaries for all observing dates in a date range
+
+    The records for all nights are fetched with a few range queries before
+    the summaries are created.
 
-    data_txt += '<table border=1>\n'
-    table =  'FileData join ProposalCode using (ProposalCode_Id)'
-    logic = 'FileName like "%{}%"'.format(obsdate)
-    print logic
-    propcodes = sdb.select('Distinct(Proposal_Code)', table, logic)
-    for pid in propcodes:
-        pid = pid[0]
-        if not pid.count("CAL_") and not pid.count("ENG_") and not pid in ['JUNK', 'NONE']:
-           flogic = logic + ' and Proposal_Code = "{}"'.format(pid)
-           flogic += ' Order by FileName'
-           record = sdb.select('FileName, Proposal_Code, INSTRUME, Target_Name', table, flogic)
-           data_txt+= '<tr colspan=4><td><b>{}</b></td></tr>'.format(pid)
-           for r in record:
-               data_txt +='<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>'.format(r[0], r[1], r[2], r[3])
-               print r
+    Parameters
+    ----------
+    startdate: str
+       First observing date in YYYYMMDD format
 
-    data_txt += '</table>\n'
-    return data_txt
+    enddate: str
+       Last observing date in YYYYMMDD format
 
+    sdb: ~mysql.mysql
+       A connection to the sdb database
+
+    els: ~mysql.mysql
+       A connection to the els database
+
+    dirname: str
+       Default directory to write results
+
+    """
+    nights = fetch_nights(sdb, els, startdate, enddate)
+    for obsdate, night_data in nights.items():
+        night_summary_page(obsdate, sdb, els, dirname, night_data=night_data)
 
+def night_files(sdb, obsdate):
+    """Return the data files of a night as (FileName, Proposal_Code,
+       INSTRUME, Target_Name), ordered by proposal and file name
+    """
+    table =  'FileData join ProposalCode using (ProposalCode_Id)'
+    logic, params = su.night_files_logic(sdb, [obsdate])
+    return list(sdb.iter_select('FileName, Proposal_Code, INSTRUME, Target_Name', table,
+                                logic + ' order by Proposal_Code, FileName', params))
 
-def write_night_report_to_file(obsdate, txt, dirname='./logs/'):
-    """This function writes the text to a file and names the report accorting
-    to the date range specified
+@tracing.traced('data_breakdown')
+def write_data_breakdown(out, files):
+    """Write a table of the data files of each science proposal to a file
 
     Parameters
     ----------
-    obsdate: str
-       Observing date in YYYYMMDD format
+    out: file
+       File-like object to write the table to
 
-    txt: str
-       Report to right to file
+    files: list
+       Records of (FileName, Proposal_Code, INSTRUME, Target_Name)
 
-    dirname: str
-       Default directory to write results
     """
+    proposals = {}
+    for r in files:
+        pid = r[1]
+        if pid is None or pid.count("CAL_") or pid.count("ENG_") or pid in ['JUNK', 'NONE']:
+           continue
+        proposals.setdefault(pid, []).append(r)
+
+    out.write('<h3> Data Files</h3>')
+    out.write('<table border=1>\n')
+    for pid in sorted(proposals.keys()):
+        out.write('<tr colspan=4><td><b>{}</b></td></tr>'.format(pid))
+        for r in sorted(proposals[pid]):
+            out.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>'.format(r[0], r[1], r[2], r[3]))
+    out.write('</table>\n')
+
+def data_breakdown(sdb, obsdate, night_data=None):
+    """Produce a list of the data associated with each proposal
+       observed that night
 
-
-    header = """<html>
+       If prefetched records of the night are given, their data files
+       are used instead of querying the sdb.
+    """
+    if night_data is not None:
+       files = night_data.files
+    else:
+       files = night_files(sdb, obsdate)
+    out = StringIO()
+    write_data_breakdown(out, files)
+    return out.getvalue()
+
+def night_report_header(obsdate):
+    """Return the start of the html page of the night report"""
+    return """<html>
 <head><title>SALT Night Report for {0}</title></head>
 <body bgcolor="white" text="black" link="blue" vlink="blue">\n
     """.format(obsdate)
 
-    bottom="""\n<br><center> Updated: {0} </center>
+def night_report_footer():
+    """Return the end of the html page of the night report"""
+    return """\n<br><center> Updated: {0} </center>
               </body>
               </hmtl>""".format(datetime.now().strftime('%Y-%m-%d  %H:%M:%S'))
-    html_txt = header+txt + bottom
-    filename = 'night_report_{0}.html'.format(obsdate)
 
-    with open(dirname+filename, 'w') as f:
-        f.write(html_txt)
+def night_report_filename(obsdate, dirname='./logs/'):
+    """Return the path of the night report for an observing date"""
+    return dirname+'night_report_{0}.html'.format(obsdate)
 
 if __name__=='__main__':
 
+    # the log level is set by LOG_LEVEL, and the stages are traced to the
+    # file SALT_TRACE if it is set
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING'))
+    trace_file = tracing.from_environment()
+
     # open mysql connection to the sdb
     mysql_con = MySQLdb.connect(host='sdb.cape.saao.ac.za',
                 port=3306, user=os.environ['SDBUSER'],
@@ -153,6 +236,10 @@ if __name__=='__main__':
     sdbname='sdb'
     user=os.environ['SDBUSER']
     password=os.environ['SDBPASS']
+    # record the statistics of the sdb and els queries if requested
+    stats_file = os.environ.get('QUERY_STATS')
+    if stats_file:
+        mysql.query_stats = mysql.QueryStats(slow_query_time=float(os.environ.get('SLOW_QUERY_TIME', 1.0)))
     sdb=mysql.mysql(sdbhost, sdbname, user, password, port=3306)
 
     elshost='db.suth.saao.ac.za'
@@ -184,3 +271,10 @@ if __name__=='__main__':
     night_summary_page(obsdate, sdb, els)
 
     mysql_con.close()
+
+    if stats_file:
+        mysql.query_stats.dump(stats_file)
+
+    if trace_file:
+        tracing.tracer.export(trace_file)
+        sys.stderr.write(tracing.tracer.summary()+'\n')
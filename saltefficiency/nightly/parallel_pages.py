@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+
+Create the night summary pages for a range of observing dates in parallel.
+
+The records of the nights are fetched in batches in the main process and the
+pages are rendered by a pool of worker processes. Every worker opens its own
+database connections, which are only used for nights without prefetched
+records.
+
+"""
+
+import os
+import sys
+import time
+import logging
+import datetime
+import traceback
+from multiprocessing import Pool, cpu_count
+
+from saltefficiency.util.mysql import mysql
+from saltefficiency.util.night_data import fetch_nights
+
+from night_summary_page import night_summary_page
+
+logger = logging.getLogger(__name__)
+
+# database connections of a worker process
+_worker_sdb = None
+_worker_els = None
+
+
+def _init_worker(sdb_args, els_args):
+    """Open the database connections of a worker process"""
+    global _worker_sdb, _worker_els
+    _worker_sdb = mysql(*sdb_args, pool_size=1)
+    _worker_els = mysql(*els_args, pool_size=1)
+
+def _render_night(task):
+    """Create the summary page for a night in a worker process
+
+    Returns
+    -------
+    result: tuple
+       observing date, run time in seconds and the traceback of the error
+       (None if the page was created)
+    """
+    obsdate, night_data, dirname = task
+    start = time.time()
+    try:
+        night_summary_page(obsdate, _worker_sdb, _worker_els, dirname, night_data=night_data)
+    except Exception:
+        return obsdate, time.time()-start, traceback.format_exc()
+    return obsdate, time.time()-start, None
+
+def date_range(startdate, enddate):
+    """Return the observing dates from startdate to enddate (inclusive)
+       in YYYYMMDD format
+    """
+    date = datetime.datetime.strptime(startdate, '%Y%m%d')
+    end = datetime.datetime.strptime(enddate, '%Y%m%d')
+    dates = []
+    while date <= end:
+        dates.append(date.strftime('%Y%m%d'))
+        date += datetime.timedelta(days=1)
+    return dates
+
+def parallel_night_summary_pages(startdate, enddate, sdb_args, els_args, dirname='./logs/',
+                                 processes=None, prefetch=True, batch_days=31):
+    """Create the summaries for all observing dates in a date range with
+    a pool of worker processes
+
+    Parameters
+    ----------
+    startdate: str
+       First observing date in YYYYMMDD format
+
+    enddate: str
+       Last observing date in YYYYMMDD format
+
+    sdb_args: tuple
+       (host, dbname, user, passwd, port) of the sdb database
+
+    els_args: tuple
+       (host, dbname, user, passwd, port) of the els database
+
+    dirname: str
+       Default directory to write results
+
+    processes: int
+       Number of worker processes (the number of CPUs if None)
+
+    prefetch: bool
+       Fetch the records of the nights in the main process, in batches of
+       batch_days nights. Otherwise every worker queries the databases for
+       its nights.
+
+    batch_days: int
+       Number of nights fetched at once if prefetch is True
+
+    Returns
+    -------
+    summary: dict
+       'succeeded' lists the observing dates for which a page was created,
+       'failed' lists (observing date, traceback) pairs and 'time' gives the
+       run time of every rendered night in seconds
+
+    """
+    if processes is None: processes = cpu_count()
+    dates = date_range(startdate, enddate)
+
+    pool = Pool(processes, _init_worker, (sdb_args, els_args))
+    results = []
+    summary = {'succeeded': [], 'failed': [], 'time': {}}
+    try:
+        if prefetch:
+           sdb = mysql(*sdb_args)
+           els = mysql(*els_args)
+           # the workers render a batch while the next one is fetched
+           for i in range(0, len(dates), batch_days):
+               batch = dates[i:i+batch_days]
+               try:
+                  nights = fetch_nights(sdb, els, batch[0], batch[-1])
+               except Exception:
+                  #the pages of the other batches are still created
+                  error = traceback.format_exc()
+                  summary['failed'].extend((obsdate, error) for obsdate in batch)
+                  continue
+               for obsdate in batch:
+                   if obsdate in nights:
+                      results.append(pool.apply_async(_render_night, ((obsdate, nights[obsdate], dirname),)))
+                   else:
+                      summary['failed'].append((obsdate, 'There is no night information for {0}'.format(obsdate)))
+           sdb.close()
+           els.close()
+        else:
+           for obsdate in dates:
+               results.append(pool.apply_async(_render_night, ((obsdate, None, dirname),)))
+        pool.close()
+
+        for r in results:
+            obsdate, runtime, error = r.get()
+            summary['time'][obsdate] = runtime
+            if error is None:
+               summary['succeeded'].append(obsdate)
+            else:
+               summary['failed'].append((obsdate, error))
+    except:
+        pool.terminate()
+        raise
+    pool.join()
+
+    summary['failed'].sort()
+    logger.info('%d night pages created, %d failed', len(summary['succeeded']), len(summary['failed']))
+    for obsdate, error in summary['failed']:
+        logger.error('Failed to create the page for %s:\n%s', obsdate, error)
+    return summary
+
+
+if __name__=='__main__':
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+    sdb_args = ('sdb.salt', 'sdb', os.environ['SDBUSER'], os.environ['SDBPASS'], 3306)
+    els_args = ('db.suth.saao.ac.za', 'els', os.environ['ELSUSER'], os.environ['ELSPASS'], 3306)
+
+    startdate = sys.argv[1]
+    enddate = sys.argv[2]
+    processes = None
+    if len(sys.argv) > 3: processes = int(sys.argv[3])
+
+    summary = parallel_night_summary_pages(startdate, enddate, sdb_args, els_args, processes=processes)
+    if summary['failed']: sys.exit(1)
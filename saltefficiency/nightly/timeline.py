@@ -0,0 +1,85 @@
+"""
+Exact timeline of the status of a night.
+
+The status of the telescope (science, engineering, weather, ...) is recorded
+as a list of intervals, where intervals added later take precedence over
+earlier ones. The intervals are merged into non-overlapping segments with a
+sweep over the interval boundaries, and totals are computed to the second.
+"""
+import heapq
+
+
+class Timeline:
+   """A list of status intervals, merged by priority
+
+      All times are given in seconds (since noon of the observing date in
+      the case of the Night class). Later intervals have a higher priority
+      than earlier ones, unless a priority is given explicitly.
+
+   """
+
+   def __init__(self):
+       self.intervals = []
+       self._segments = None
+
+   def add(self, start, end, status, priority=None):
+       """Add an interval [start, end) with the given status"""
+       if end <= start: return
+       if priority is None: priority = len(self.intervals)
+       self.intervals.append((start, end, status, priority))
+       self._segments = None
+
+   def segments(self):
+       """Return the merged, non-overlapping segments
+
+          Returns
+          -------
+          segments: list
+              sorted list of (start, end, status), where adjacent segments
+              with the same status are joined
+       """
+       if self._segments is not None: return self._segments
+
+       intervals = sorted(self.intervals)
+       boundaries = sorted(set([i[0] for i in intervals] + [i[1] for i in intervals]))
+       segments = []
+       active = []
+       j = 0
+       for k in range(len(boundaries)-1):
+           t, t_next = boundaries[k], boundaries[k+1]
+           while j < len(intervals) and intervals[j][0] <= t:
+               start, end, status, priority = intervals[j]
+               heapq.heappush(active, (-priority, end, status))
+               j += 1
+           while active and active[0][1] <= t:
+               heapq.heappop(active)
+           if not active: continue
+           status = active[0][2]
+           if segments and segments[-1][1] == t and segments[-1][2] == status:
+              segments[-1] = (segments[-1][0], t_next, status)
+           else:
+              segments.append((t, t_next, status))
+
+       self._segments = segments
+       return segments
+
+   def clipped_segments(self, start, end):
+       """Return the merged segments clipped to the window [start, end)"""
+       clipped = []
+       for s, e, status in self.segments():
+           s, e = max(s, start), min(e, end)
+           if s < e: clipped.append((s, e, status))
+       return clipped
+
+   def total(self, statuses, start, end):
+       """Return the time within [start, end) which has one of the statuses
+
+          The status None stands for time not covered by any interval.
+       """
+       covered = 0
+       total = 0
+       for s, e, status in self.clipped_segments(start, end):
+           covered += e-s
+           if status in statuses: total += e-s
+       if None in statuses: total += max(end-start, 0)-covered
+       return total
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Render the full set of summary plots for a period.
+
+The data for the period are fetched once with report_queries.fetch_report and
+the matplotlib and Bokeh charts of summary_plots are rendered from the
+resulting report window by a pool of worker processes (matplotlib is not
+thread-safe). A manifest lists the rendered files.
+"""
+
+import os
+import sys
+import json
+import time
+import traceback
+from multiprocessing import Pool
+
+import MySQLdb
+from bokeh.embed import file_html
+from bokeh.resources import CDN
+
+import saltefficiency.util.report_queries as rq
+import summary_plots
+
+
+# matplotlib charts of summary_plots and their titles
+CHARTS = [('priority_breakdown', 'Priority Breakdown - {total_blocks} Blocks Total\n{first_night} - {last_night}'),
+          ('total_time_breakdown', 'Time Breakdown - {total_night_length} Total\n{first_night} - {last_night}'),
+          ('subsystem_breakdown', 'Problems Breakdown - {total_time} Total\n{first_night} - {last_night}'),
+          ('time_breakdown', 'Time Breakdown\n{first_night} - {last_night}')]
+
+# size arguments of the Bokeh twins of the charts
+BOKEH_SIZES = {'priority_breakdown': (600, 200),
+               'total_time_breakdown': (600, 200),
+               'subsystem_breakdown': (600, 200),
+               'time_breakdown': (800, 400, 100)}
+
+
+def _render(task):
+    """Render a chart in a worker process
+
+    Returns
+    -------
+    entry: dict
+        manifest entry of the chart
+    """
+    chart, kind, title, window, path = task
+    start = time.time()
+    entry = {'chart': chart, 'format': kind, 'path': path, 'error': None}
+    try:
+        if kind == 'bokeh':
+            f = getattr(summary_plots, chart + '_plot')
+            plot = f(window, window.date, window.interval, title, *BOKEH_SIZES[chart])
+            if plot is None:
+                entry['path'] = None
+            else:
+                with open(path, 'w') as out:
+                    out.write(file_html(plot, CDN, chart))
+        else:
+            f = getattr(summary_plots, chart)
+            f(window, window.date, window.interval, title, path, format=kind)
+    except Exception:
+        entry['path'] = None
+        entry['error'] = traceback.format_exc()
+    entry['seconds'] = time.time() - start
+    if entry['path'] is not None:
+        entry['bytes'] = os.path.getsize(entry['path'])
+    return entry
+
+def render_plot_set(connect, plot_date, interval, dirname='./logs/', formats=('png', 'bokeh'),
+                    processes=None, workers=3):
+    """Render all summary plots for a period
+
+    Parameters
+    ----------
+    connect: function
+        function returning a new database connection supported by Pandas
+    plot_date: date or string
+        date in YYYY-MM-DD format when the last night ends
+    interval: int
+        number of nights to plot
+    dirname: string
+        directory to write the plots to
+    formats: list
+        image formats of the matplotlib charts, and 'bokeh' for html files of
+        the Bokeh charts
+    processes: int
+        number of worker processes (the number of CPUs if None, and no pool
+        if 1)
+    workers: int
+        number of concurrent database queries
+
+    Returns
+    -------
+    manifest: list
+        an entry for every chart and format with the path of the file (None
+        if the chart could not be rendered), its size in bytes, the time
+        taken and the traceback of any error. The manifest is also written
+        to the file manifest_<first night>-<last night>.json in dirname.
+    """
+
+    report = rq.fetch_report(connect, plot_date, interval, workers=workers)
+    window = report['window']
+    # the window is sent to the workers without its (closed) connection
+    window.mysql_con = None
+
+    period = '{0}-{1}'.format(window.start_date.strftime('%Y%m%d'), window.end_date.strftime('%Y%m%d'))
+    tasks = []
+    for chart, title in CHARTS:
+        for kind in formats:
+            extension = 'html' if kind == 'bokeh' else kind
+            path = os.path.join(dirname, '{0}_{1}.{2}'.format(chart, period, extension))
+            tasks.append((chart, kind, title, window, path))
+
+    if processes == 1:
+        manifest = [_render(t) for t in tasks]
+    else:
+        pool = Pool(processes)
+        try:
+            manifest = pool.map(_render, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    with open(os.path.join(dirname, 'manifest_{0}.json'.format(period)), 'w') as f:
+        json.dump({'start_date': window.start_date.isoformat(),
+                   'end_date': window.end_date.isoformat(),
+                   'timings': report['timings'],
+                   'plots': manifest}, f, indent=2)
+    return manifest
+
+
+if __name__=='__main__':
+
+    def connect():
+        return MySQLdb.connect(host='sdb.cape.saao.ac.za',
+                port=3306, user=os.environ['SDBUSER'],
+                passwd=os.environ['SDBPASS'], db='sdb')
+
+    obsdate = sys.argv[1]
+    date = '{}-{}-{}'.format(obsdate[0:4], obsdate[4:6], obsdate[6:8])
+    interval = int(sys.argv[2])
+    dirname = sys.argv[3] if len(sys.argv) > 3 else './logs/'
+
+    processes = os.environ.get('PLOT_PROCESSES')
+    workers = int(os.environ.get('REPORT_WORKERS', 3))
+    manifest = render_plot_set(connect, date, interval, dirname,
+                               processes=int(processes) if processes else None, workers=workers)
+    for entry in manifest:
+        if entry['error'] is not None:
+            print 'Failed to render {0} ({1}):\n{2}'.format(entry['chart'], entry['format'], entry['error'])
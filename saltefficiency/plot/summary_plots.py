@@ -60,10 +60,13 @@ Specifying a date and a range in days to query in the past:
 import math
 import sys
 import getopt
-import matplotlib.pyplot as pl
+import matplotlib.cm as cm
 import saltefficiency.util.report_queries as rq
 import numpy as np
 import matplotlib.dates as mdates
+from io import BytesIO
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
@@ -181,7 +184,74 @@ def parse_commandline(argv):
     return date, interval
 
 
-def priority_breakdown(db_connection, plot_date, interval, title, out, format='png', dpi=100):
+# reuse one figure per chart type instead of creating a new figure for every
+# chart
+reuse_figures = False
+_figure_templates = {}
+
+def new_figure(kind, **kwargs):
+    """Return an empty Agg figure for a chart type.
+
+    The figure is not registered with pyplot, so that it is freed as soon as it
+    is no longer referenced. If reuse_figures is True, the figure of the chart
+    type is cleared and returned instead of creating a new one.
+
+    Parameters
+    ----------
+    kind: string
+        chart type
+    kwargs: dict
+        arguments for the matplotlib Figure
+    """
+
+    if reuse_figures and kind in _figure_templates:
+        fig = _figure_templates[kind]
+        fig.clf()
+        return fig
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    if reuse_figures:
+        _figure_templates[kind] = fig
+    return fig
+
+def save_figure(fig, out, format='png', dpi=100):
+    """Save a figure and release its content.
+
+    Parameters
+    ----------
+    fig: Figure
+        figure to save
+    out : string, file-like object or None
+        file path or file-like object to save the figure to; if None, the
+        figure is saved to an in-memory buffer
+    format: string
+        format of the image
+    dpi: int
+        dpi of the image
+
+    Returns
+    -------
+    BytesIO
+        the buffer containing the image if out is None, otherwise None
+    """
+
+    buf = None
+    try:
+        if out is None:
+            buf = BytesIO()
+            fig.canvas.print_figure(buf, format=format, dpi=dpi, facecolor=fig.get_facecolor())
+            buf.seek(0)
+        elif isinstance(out, basestring):
+            with open(out, 'wb') as f:
+                fig.canvas.print_figure(f, format=format, dpi=dpi, facecolor=fig.get_facecolor())
+        else:
+            fig.canvas.print_figure(out, format=format, dpi=dpi, facecolor=fig.get_facecolor())
+    finally:
+        fig.clf()
+    return buf
+
+
+def priority_breakdown(db_connection, plot_date, interval, title, out=None, format='png', dpi=100):
     """Output a pie chart for the breakdown of priorities.
 
      The breakdown is aggregated over all nights from the first to last night. The output target for the plot may either
@@ -194,8 +264,9 @@ def priority_breakdown(db_connection, plot_date, interval, title, out, format='p
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -203,21 +274,23 @@ def priority_breakdown(db_connection, plot_date, interval, title, out, format='p
      title: string
         plot title
      out : string or file-like object
-        output target where the plot is saved to
+        output target where the plot is saved to; if None, the plot is returned in
+        an in-memory buffer
      format: string
         format of the generated image (the default is 'png')
      dpi: int
         dpi of the generated image (the default is 100)
-    """
 
-    fig = pl.figure(facecolor='w', figsize=[6, 6])
-    ax = fig.add_subplot(111)
-    ax.set_aspect = 1
+     Returns
+     -------
+     BytesIO
+        the image if out is None, otherwise None
+    """
 
     # get data from database
     mysql_con = None
     try:
-        x = rq.weekly_priority_breakdown(db_connection, plot_date, interval)
+        x = rq.report_window(db_connection, plot_date, interval).weekly_priority_breakdown()
     finally:
         if mysql_con:
             mysql_con.close()
@@ -230,7 +303,7 @@ def priority_breakdown(db_connection, plot_date, interval, title, out, format='p
     # set colours for the priorities
     colours = ['b','c','g','m','r']
 
-    fig = pl.figure(facecolor='w', figsize=[6, 6])
+    fig = new_figure('priority_breakdown', facecolor='w', figsize=[6, 6])
     ax = fig.add_subplot(111)
     ax.set_aspect=1
 
@@ -252,10 +325,7 @@ def priority_breakdown(db_connection, plot_date, interval, title, out, format='p
                              total_blocks=int(x['No. Blocks'].sum()))
     ax.set_title(title_txt, fontsize=12)
 
-    if type(out) is str:
-        out = file(out, mode='w')
-    pl.savefig(out, format=format, dpi=dpi)
-    out.close()
+    return save_figure(fig, out, format=format, dpi=dpi)
 
 def priority_breakdown_plot(db_connection, plot_date, interval, title, plot_width, legend_width):
     """Generate a pie chart for the breakdown of priorities.
@@ -268,8 +338,9 @@ def priority_breakdown_plot(db_connection, plot_date, interval, title, plot_widt
 
     Parameters
     ----------
-    db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+    db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
     plot_date: date
         date for which the plot is created; this is the date when the last night ends
     interval: int
@@ -290,7 +361,7 @@ def priority_breakdown_plot(db_connection, plot_date, interval, title, plot_widt
     # get data from database
     mysql_con = None
     try:
-        x = rq.weekly_priority_breakdown(db_connection, plot_date, interval)
+        x = rq.report_window(db_connection, plot_date, interval).weekly_priority_breakdown()
     finally:
         if mysql_con:
             mysql_con.close()
@@ -323,7 +394,7 @@ def priority_breakdown_plot(db_connection, plot_date, interval, title, plot_widt
                      legend_width=legend_width,
                      text_color='white')
 
-def total_time_breakdown(db_connection, plot_date, interval, title, out, format='png', dpi=100):
+def total_time_breakdown(db_connection, plot_date, interval, title, out=None, format='png', dpi=100):
     """Output a pie chart for the breakdown of time.
 
      The time is summed up for all nights from the first to last night. The output target for the plot may either
@@ -336,8 +407,9 @@ def total_time_breakdown(db_connection, plot_date, interval, title, out, format=
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -345,19 +417,21 @@ def total_time_breakdown(db_connection, plot_date, interval, title, out, format=
      title: string
         plot title
      out : string or file-like object
-        output target where the plot is saved to
+        output target where the plot is saved to; if None, the plot is returned in
+        an in-memory buffer
      format: string
         format of the generated image (the default is 'png')
      dpi: int
         dpi of the generated image (the default is 100)
-    """
 
-    fig = pl.figure(facecolor='w', figsize=[6, 6])
-    ax = fig.add_subplot(111)
-    ax.set_aspect = 1
+     Returns
+     -------
+     BytesIO
+        the image if out is None, otherwise None
+    """
 
     # get data from database
-    x = rq.weekly_total_time_breakdown(db_connection, plot_date, interval)
+    x = rq.report_window(db_connection, plot_date, interval).weekly_total_time_breakdown()
 
     labels = ['Science - {}'.format(format_hh_mm(x['Science'][0])),
               'Engineering - {}'.format(format_hh_mm(x['Engineering'][0])),
@@ -372,6 +446,10 @@ def total_time_breakdown(db_connection, plot_date, interval, title, out, format=
 
     colours = ['b','c','g','r', '#aaaaaa']
 
+    fig = new_figure('total_time_breakdown', facecolor='w', figsize=[6, 6])
+    ax = fig.add_subplot(111)
+    ax.set_aspect = 1
+
     ax.pie(values,
            colors=colours,
            pctdistance=0.8,
@@ -390,10 +468,7 @@ def total_time_breakdown(db_connection, plot_date, interval, title, out, format=
                              total_night_length=x['NightLength'][0])
     ax.set_title(title_txt, fontsize=12)
 
-    if type(out) is str:
-        out = file(out, mode='w')
-    pl.savefig(out, format=format, dpi=dpi)
-    out.close()
+    return save_figure(fig, out, format=format, dpi=dpi)
 
 def total_time_breakdown_plot(db_connection, plot_date, interval, title, plot_width, legend_width):
     """Generate a pie chart for the breakdown of time.
@@ -406,8 +481,9 @@ def total_time_breakdown_plot(db_connection, plot_date, interval, title, plot_wi
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -426,7 +502,7 @@ def total_time_breakdown_plot(db_connection, plot_date, interval, title, plot_wi
     """
 
     # get data from database
-    x = rq.weekly_total_time_breakdown(db_connection, plot_date, interval)
+    x = rq.report_window(db_connection, plot_date, interval).weekly_total_time_breakdown()
 
     labels = ['Science - {}'.format(format_hh_mm(x['Science'][0])),
               'Engineering - {}'.format(format_hh_mm(x['Engineering'][0])),
@@ -469,7 +545,7 @@ def total_time_breakdown_plot(db_connection, plot_date, interval, title, plot_wi
                      legend_width=legend_width,
                      text_color='white')
 
-def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='png', dpi=100):
+def subsystem_breakdown(db_connection, plot_date, interval, title, out=None, format='png', dpi=100):
     """Output a pie chart for the breakdown of time lost due to problems.
 
      The breakdown is shown for all nights from the first to last night. The output target for the plot may either be
@@ -484,8 +560,9 @@ def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -493,22 +570,24 @@ def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='
      title: string
         plot title
      out : string or file-like object
-        output target where the plot is saved to
+        output target where the plot is saved to; if None, the plot is returned in
+        an in-memory buffer
      format: string
         format of the generated image (the default is 'png')
      dpi: int
         dpi of the generated image (the default is 100)
-    """
 
-    fig = pl.figure(facecolor='w', figsize=[6, 6])
-    ax = fig.add_subplot(111)
-    ax.set_aspect = 0.8
+     Returns
+     -------
+     BytesIO
+        the image if out is None, otherwise None
+    """
 
     # set the colours for all the subsystems:
     subsystems_list = ['BMS', 'Database', 'DOME', 'Network', 'TC', 'PMAS', 'SCAM', 'TCS', 'STRUCT',
                        'TPC', 'HRS', 'PFIS','Proposal', 'Operations',
                        'ELS', 'ESKOM']
-    cmap = pl.cm.jet
+    cmap = cm.jet
     colour_map = cmap(np.linspace(0.0, 1.0, len(subsystems_list)))
     col_dict = {}
 
@@ -518,8 +597,9 @@ def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='
     col_dict['TC'] = np.array([1., 0.475, 0.5, 1.])
 
     # get data from database
-    x = rq.weekly_subsystem_breakdown(db_connection, plot_date, interval)
-    y = rq.weekly_subsystem_breakdown_total(db_connection, plot_date, interval)
+    window = rq.report_window(db_connection, plot_date, interval)
+    x = window.weekly_subsystem_breakdown()
+    y = window.weekly_subsystem_breakdown_total()
 
     subsystem = list(x['SaltSubsystem'])
     time = [format_hh_mm(t) for t in list(x['Time'])]
@@ -529,6 +609,10 @@ def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='
 
     colours = [col_dict[i] for i in subsystem]
 
+    fig = new_figure('subsystem_breakdown', facecolor='w', figsize=[6, 6])
+    ax = fig.add_subplot(111)
+    ax.set_aspect = 0.8
+
     ax.pie(values,
            colors=colours,
            pctdistance=0.8,
@@ -547,10 +631,7 @@ def subsystem_breakdown(db_connection, plot_date, interval, title, out, format='
                              total_time=format_hh_mm(y['Time'][0]))
     ax.set_title(title_txt, fontsize=12)
 
-    if type(out) is str:
-        out = file(out, mode='w')
-    pl.savefig(out, format=format, dpi=dpi)
-    out.close()
+    return save_figure(fig, out, format=format, dpi=dpi)
 
 def subsystem_breakdown_plot(db_connection, plot_date, interval, title, plot_width, legend_width):
     """Generate a pie chart for the breakdown of time lost due to problems.
@@ -566,8 +647,9 @@ def subsystem_breakdown_plot(db_connection, plot_date, interval, title, plot_wid
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -585,15 +667,11 @@ def subsystem_breakdown_plot(db_connection, plot_date, interval, title, plot_wid
         Bokeh plot
     """
 
-    fig = pl.figure(facecolor='w', figsize=[6, 6])
-    ax = fig.add_subplot(111)
-    ax.set_aspect = 0.8
-
     # set the colours for all the subsystems:
     subsystems_list = ['BMS', 'Database', 'DOME', 'Network', 'TC', 'PMAS', 'SCAM', 'TCS', 'STRUCT',
                        'TPC', 'HRS', 'PFIS','Proposal', 'Operations',
                        'ELS', 'ESKOM']
-    cmap = pl.cm.jet
+    cmap = cm.jet
     colors_list = cmap(np.linspace(0.0, 1.0, len(subsystems_list)))
     color_dict = {}
     for i, s in enumerate(subsystems_list):
@@ -602,8 +680,9 @@ def subsystem_breakdown_plot(db_connection, plot_date, interval, title, plot_wid
     color_dict['TC'] = np.array([1., 0.475, 0.5, 1.])
 
     # get data from database
-    x = rq.weekly_subsystem_breakdown(db_connection, plot_date, interval)
-    y = rq.weekly_subsystem_breakdown_total(db_connection, plot_date, interval)
+    window = rq.report_window(db_connection, plot_date, interval)
+    x = window.weekly_subsystem_breakdown()
+    y = window.weekly_subsystem_breakdown_total()
 
     subsystem = list(x['SaltSubsystem'])
     time = [format_hh_mm(t) for t in list(x['Time'])]
@@ -647,7 +726,7 @@ def subsystem_breakdown_plot(db_connection, plot_date, interval, title, plot_wid
                      pie_slice_label='{0:.1f} %',
                      text_color='black')
 
-def time_breakdown(db_connection, plot_date, interval, title, out, format='png', dpi=100):
+def time_breakdown(db_connection, plot_date, interval, title, out=None, format='png', dpi=100):
     """Output a stacked bar plot of the time breakdown.
 
      The breakdown is shown for all nights from the first to last night. The output target for the plot may either be
@@ -661,8 +740,9 @@ def time_breakdown(db_connection, plot_date, interval, title, out, format='png',
 
      Parameters
      ----------
-     db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+     db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
      plot_date : date
         date for which the plot is created; this is the date when the last night ends
      interval: int
@@ -670,20 +750,26 @@ def time_breakdown(db_connection, plot_date, interval, title, out, format='png',
      title: string
         plot title
      out : string or file-like object
-        output target where the plot is saved to
+        output target where the plot is saved to; if None, the plot is returned in
+        an in-memory buffer
      format: string
         format of the generated image (the default is 'png')
      dpi: int
         dpi of the generated image (the default is 100)
+
+     Returns
+     -------
+     BytesIO
+        the image if out is None, otherwise None
     """
 
-    fig = pl.figure(figsize=(10,4), facecolor='w')
+    fig = new_figure('time_breakdown', figsize=(10,4), facecolor='w')
     ax = fig.add_subplot(111)
     width = 0.65
     ax.grid(which='major', axis='y')
 
     # get data from database
-    data = rq.weekly_time_breakdown(db_connection, plot_date, interval)
+    data = rq.report_window(db_connection, plot_date, interval).weekly_time_breakdown()
 
     # science time per day
     s = ax.bar(data['Date'],
@@ -755,12 +841,9 @@ def time_breakdown(db_connection, plot_date, interval, title, out, format='png',
     fig.autofmt_xdate(rotation=0, ha='left')
     fig.subplots_adjust(left=0.22, bottom=0.20, right=0.96, top=None,
                         wspace=None, hspace=None)
-    pl.autoscale()
+    ax.autoscale()
 
-    if type(out) is str:
-        out = file(out, mode='w')
-    pl.savefig(out, format=format, dpi=dpi)
-    out.close()
+    return save_figure(fig, out, format=format, dpi=dpi)
 
 
 def time_breakdown_plot(db_connection, plot_date, interval, title, plot_width, plot_height, legend_height):
@@ -777,8 +860,9 @@ def time_breakdown_plot(db_connection, plot_date, interval, title, plot_width, p
 
     Parameters
     ----------
-    db_connection: SQLAlchemy engine or database connection
-        Any database connection supported by Pandas can be used.
+    db_connection: SQLAlchemy engine, database connection or ReportWindow
+        Any database connection supported by Pandas can be used. A ReportWindow
+        for the plot date and interval can be passed to share its data between plots.
     plot_date : date
         date for which the plot is created; this is the date when the last night ends
     interval: int
@@ -797,7 +881,7 @@ def time_breakdown_plot(db_connection, plot_date, interval, title, plot_width, p
     """
 
     # get data from database
-    data = rq.weekly_time_breakdown(db_connection, plot_date, interval)
+    data = rq.report_window(db_connection, plot_date, interval).weekly_time_breakdown()
     dates = [d.strftime('%a, %Y-%m-%d') for d in data['Date'].values]
     keys = ('Science', 'Engineering', 'Weather', 'Problems', 'Other', 'Unallocated')
     values = OrderedDict()
@@ -216,23 +216,27 @@ if __name__=='__main__':
         col_dict[subsystems_list[i]] = colour_map[i]
 
 
-    # open mysql connection to the sdb
-    mysql_con = MySQLdb.connect(host='sdb.cape.saao.ac.za',
-                port=3306,user=os.environ['SDBUSER'],
+    # open mysql connections to the sdb
+    def connect():
+        return MySQLdb.connect(host='sdb.cape.saao.ac.za',
+                port=3306, user=os.environ['SDBUSER'],
                 passwd=os.environ['SDBPASS'], db='sdb')
 
     obsdate = sys.argv[1]
     date = '{}-{}-{}'.format(obsdate[0:4], obsdate[4:6], obsdate[6:8])
     interval = sys.argv[2]
 
-    # use the connection to get the required data: _d
-    dr_d = rq.date_range(mysql_con, date, interval=interval)
-    wpb_d = rq.weekly_priority_breakdown(mysql_con, date, interval=interval)
-    wtb_d = rq.weekly_time_breakdown(mysql_con, date, interval=interval)
-    wttb_d = rq.weekly_total_time_breakdown(mysql_con, date, interval=interval)
-    wsb_d = rq.weekly_subsystem_breakdown(mysql_con, date, interval=interval)
-    wsbt_d = rq.weekly_subsystem_breakdown_total(mysql_con, date, interval=interval)
-    wtb_d = rq.weekly_time_breakdown(mysql_con, date, interval=interval)
+    # run the queries concurrently to get the required data: _d
+    workers = int(os.environ.get('REPORT_WORKERS', 3))
+    report = rq.fetch_report(connect, date, interval=interval, workers=workers)
+    for name, t in sorted(report['timings'].items()):
+        sys.stderr.write('{0}: {1:.2f} s\n'.format(name, t))
+    dr_d = report['date_range']
+    wpb_d = report['weekly_priority_breakdown']
+    wtb_d = report['weekly_time_breakdown']
+    wttb_d = report['weekly_total_time_breakdown']
+    wsb_d = report['weekly_subsystem_breakdown']
+    wsbt_d = report['weekly_subsystem_breakdown_total']
 
     date_string = '{} - {}'.format(dr_d['StartDate'][0], dr_d['EndDate'][0])
 
@@ -241,6 +245,3 @@ if __name__=='__main__':
     weekly_total_time_breakdown_pie_chart(wttb_d, date_string,'')
     weekly_subsystem_breakdown_pie_chart(wsb_d, wsbt_d, col_dict, date_string,'')
     weekly_time_breakdown(wtb_d, date_string,'')
-
-    mysql_con.close()
-
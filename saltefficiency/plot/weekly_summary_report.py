@@ -197,8 +197,9 @@ def commandLine(argv):
 
 if __name__=='__main__':
 
-    # open mysql connection to the sdb
-    mysql_con = MySQLdb.connect(host='sdb.cape.saao.ac.za',
+    # open mysql connections to the sdb
+    def connect():
+        return MySQLdb.connect(host='sdb.cape.saao.ac.za',
                 port=3306, user=os.environ['SDBUSER'],
                 passwd=os.environ['SDBPASS'], db='sdb')
 
@@ -206,12 +207,16 @@ if __name__=='__main__':
     date = '{}-{}-{}'.format(obsdate[0:4], obsdate[4:6], obsdate[6:8])
     interval = sys.argv[2]
 
-    # use the connection to get the required data: _d
-    dr_d = rq.date_range(mysql_con, date, interval=interval)
-    wpb_d = rq.weekly_priority_breakdown(mysql_con, date, interval=interval)
-    wtb_d = rq.weekly_time_breakdown(mysql_con, date, interval=interval)
-    wttb_d = rq.weekly_total_time_breakdown(mysql_con, date, interval=interval)
-    wsb_d = rq.weekly_subsystem_breakdown(mysql_con, date, interval=interval)
+    # run the queries concurrently to get the required data: _d
+    workers = int(os.environ.get('REPORT_WORKERS', 3))
+    report = rq.fetch_report(connect, date, interval=interval, workers=workers)
+    for name, t in sorted(report['timings'].items()):
+        sys.stderr.write('{0}: {1:.2f} s\n'.format(name, t))
+    dr_d = report['date_range']
+    wpb_d = report['weekly_priority_breakdown']
+    wtb_d = report['weekly_time_breakdown']
+    wttb_d = report['weekly_total_time_breakdown']
+    wsb_d = report['weekly_subsystem_breakdown']
 
     # TESTING: save the dataframes
     dr_d.save('dr_d')
@@ -232,5 +237,3 @@ if __name__=='__main__':
 
     # write the report to file
     write_to_file(dr_d, dr_t + wpd_t + wttb_t + wsb_t)
-
-    mysql_con.close()
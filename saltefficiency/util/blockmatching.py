@@ -0,0 +1,262 @@
+"""
+Indexes for matching pointings to the images, events and blocks of a night.
+
+The helper functions in blockvisitstats scan the full image and event lists
+for every pointing. The classes in this module sort these lists once and then
+answer the same questions with bisection and dictionary lookups, so that
+matching a whole night takes near-linear time.
+"""
+import bisect
+import datetime
+
+from event_log import EventLog
+
+# offset between SAST (used by the event log) and UT (used by the FITS headers)
+UT_OFFSET = datetime.timedelta(seconds=2*3600.0)
+
+# columns of the image list returned by the blockvisitstats query
+PROPCODE, TARGET, EXPTIME, UTSTART, INSTRUME, OBSMODE, DETMODE, NEXPOSURES, BLOCK_ID = 1, 2, 3, 4, 5, 6, 7, 9, 10
+
+
+def isscienceproposal(propcode):
+    """Check whether a proposal code belongs to a science proposal"""
+    return propcode is not None and propcode != 'JUNK' and not propcode.count("CAL_") and not propcode.count("ENG_")
+
+
+class EventIndex:
+   """Sorted lookup of the SO event log by event type
+
+      Parameters
+      ----------
+      events: ~event_log.EventLog or list
+           event log of the night, or a list of [EventType_Id, datetime]
+           pairs
+
+   """
+
+   def __init__(self, events):
+       if not isinstance(events, EventLog):
+          events = EventLog.from_datetimes(events)
+       self.events = events
+       self._merged = {}
+
+   def times(self, event_types):
+       """Return the sorted times of all events with one of the given types"""
+       key = tuple(sorted(event_types))
+       if key not in self._merged:
+          self._merged[key] = [self.events.datetime(t) for t in self.events.event_times(key)]
+       return self._merged[key]
+
+   def next_event(self, event_types, t, default=None):
+       """Return the time of the first event of the given types after t"""
+       s = self.events.next_event(event_types, self.events.seconds(t))
+       if s is None: return default
+       return self.events.datetime(s)
+
+   def findnextpointing(self, starttime, etime=None):
+       """The next pointing occurs either when the next point to target
+          or track command happens
+       """
+       return self.next_event((3, 10), starttime, etime)
+
+   def findguidingstart(self, starttime):
+       """Determine when guiding starts from the next guiding command"""
+       return self.next_event((5,), starttime)
+
+
+class ImageIndex:
+   """Sorted lookup of the images taken during a night
+
+      The original order of the image list (by file name) is remembered, so
+      that every lookup returns the same image as a linear scan of the list.
+
+      Parameters
+      ----------
+      img_list: list
+           records of the FileData/FitsHeaderImage query in blockvisitstats
+
+   """
+
+   def __init__(self, img_list):
+       self.img_list = img_list
+
+       # science frames sorted by UT start time
+       science = [(img[UTSTART], i) for i, img in enumerate(img_list)
+                  if img[UTSTART] is not None and img[TARGET] not in ['ARC', 'FLAT']]
+       science.sort()
+       self._science_times = [s[0] for s in science]
+       self._science_index = [s[1] for s in science]
+
+       # instrument and mode information keyed by Block_Id
+       self._blocks = {}
+       for img in img_list:
+           b = self._blocks.setdefault(img[BLOCK_ID], ([], [], []))
+           b[0].append(img[INSTRUME])
+           b[1].append(img[OBSMODE])
+           b[2].append(img[DETMODE])
+
+       self._modes = {}
+
+   def finddata(self, starttime, endtime):
+       """Determine if any data were taken between start time and endtime"""
+       stime = starttime - UT_OFFSET
+       etime = endtime - UT_OFFSET
+       lo = bisect.bisect_right(self._science_times, stime)
+       hi = bisect.bisect_left(self._science_times, etime)
+       if lo >= hi:
+          return [None]*8
+       img = self.img_list[min(self._science_index[lo:hi])]
+       return img[PROPCODE], img[TARGET], img[BLOCK_ID], img[INSTRUME], img[OBSMODE], img[DETMODE], img[EXPTIME], img[NEXPOSURES]
+
+   def getprimarymode(self, bid):
+       """Determine the primary mode of the science frame for the block"""
+       instr, obsmode, detmode = self._blocks.get(bid, ([], [], []))
+
+       if 'RSS' in instr:
+          instr = 'RSS'
+       elif 'HRS' in instr:
+          instr = 'HRS'
+       else:
+          instr = 'SCAM'
+
+       if instr == 'RSS':
+          if 'SPECTROSCOPY' in obsmode:
+             primary_mode = 'SPECTROSCOPY'
+          elif 'FABRY-PEROT' in obsmode:
+             primary_mode = 'FABRY-PEROT'
+          else:
+             primary_mode = 'IMAGING'
+       elif instr == 'HRS':
+          primary_mode = obsmode[0]
+       else:
+          if 'SLOTMODE' in detmode:
+             primary_mode = 'SLOTMODE'
+          else:
+             primary_mode = 'NORMAL'
+
+       return instr, primary_mode
+
+   def _mode_index(self, column, mode):
+       """Return the UT start times of all images with the given mode,
+          together with the suffix minimum of their list positions
+       """
+       key = (column, mode)
+       if key not in self._modes:
+          frames = [(img[UTSTART], i) for i, img in enumerate(self.img_list)
+                    if img[UTSTART] is not None and img[column] == mode]
+          frames.sort()
+          suffix_min = [0]*len(frames)
+          current = len(self.img_list)
+          for j in range(len(frames)-1, -1, -1):
+              current = min(current, frames[j][1])
+              suffix_min[j] = current
+          self._modes[key] = ([f[0] for f in frames], suffix_min)
+       return self._modes[key]
+
+   def getfirstimage(self, starttime, instr, primary_mode):
+       """Determine the first image of the list that has that mode in use"""
+       if instr in ['RSS', 'HRS']:
+          column = OBSMODE
+       elif instr == 'SCAM':
+          column = DETMODE
+       else:
+          return None
+
+       times, suffix_min = self._mode_index(column, primary_mode)
+       i = bisect.bisect_right(times, starttime - UT_OFFSET)
+       if i >= len(times):
+          return None
+       return self.img_list[suffix_min[i]][UTSTART] + UT_OFFSET
+
+
+class BlockIndex:
+   """Lookup of the block visits of a night by Proposal_Code, Block_Id and
+      BlockVisit_Id
+
+      Block visits are consumed in the order of the original list when a
+      pointing is matched to an accepted proposal, mirroring
+      blockvisitstats.removepropcode.
+
+      Parameters
+      ----------
+      blocks: list
+           records of (BlockVisit_Id, Accepted, Proposal_Code, Block_Id)
+
+   """
+
+   def __init__(self, blocks):
+       self.blocks = list(blocks)
+       self.accepted_codes = set()
+       self.rejected_codes = set()
+       self._by_code = {}
+       self._removed = {}
+       self._position = {}
+       self._accepted_visit = {}
+       for b in self.blocks:
+           if b[1] == 1:
+              self.accepted_codes.add(b[2])
+              self._accepted_visit.setdefault(b[3], b[0])
+           else:
+              self.rejected_codes.add(b[2])
+           visits = self._by_code.setdefault(b[2], [])
+           self._position[b[0]] = (b[2], len(visits))
+           visits.append(b)
+
+   def remove_first(self, propcode):
+       """Mark the first remaining block visit of a proposal as used"""
+       if self._removed.get(propcode, 0) < len(self._by_code.get(propcode, [])):
+          self._removed[propcode] = self._removed.get(propcode, 0) + 1
+
+   def remaining(self, propcode):
+       """Return the block visits of a proposal which have not been used"""
+       return self._by_code.get(propcode, [])[self._removed.get(propcode, 0):]
+
+   def remaining_visit(self, bvid):
+       """Return the block visit with the given id if it has not been used"""
+       if bvid not in self._position: return None
+       propcode, i = self._position[bvid]
+       if i < self._removed.get(propcode, 0): return None
+       return self._by_code[propcode][i]
+
+   def state(self):
+       """Return the numbers of used block visits by proposal, so that the
+          matching can be resumed from this point with restore
+       """
+       return dict(self._removed)
+
+   def restore(self, state):
+       """Reset the used block visits to a state returned by state"""
+       self._removed = dict(state)
+
+   def getblockvisit(self, bid):
+       """Return the id of the first accepted visit of a block"""
+       return self._accepted_visit.get(bid)
+
+
+class PointEventIndex:
+   """Lookup of the block visits of the pointings of a night
+
+      Parameters
+      ----------
+      pointevents: list
+           records of (pointing time, Proposal_Code, BlockVisit_Id)
+
+   """
+
+   def __init__(self, pointevents):
+       self._visits = {}
+       for t, propcode, bvid in pointevents:
+           self._visits.setdefault(t, []).append((propcode, bvid))
+
+   def blockvisit(self, starttime, propcode=None):
+       """Return the block visit of the pointing at the given time
+
+          For science proposals only pointings for the proposal are
+          considered. An IndexError is raised if there is no such pointing.
+       """
+       visits = self._visits.get(starttime, [])
+       if isscienceproposal(propcode):
+          visits = [v for v in visits if v[0] == propcode]
+       if not visits:
+          raise IndexError('No block visit for the pointing at %s' % starttime)
+       return visits[0][1]
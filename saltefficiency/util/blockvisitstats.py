@@ -6,15 +6,23 @@ import sys
 import time 
 import datetime 
 import string
+import logging
 import numpy as np
 
 import mysql
+import sdb_utils as su
+import tracing
+from blockmatching import BlockIndex, EventIndex, ImageIndex, PointEventIndex, isscienceproposal
+from event_log import EventLog
+
+logger = logging.getLogger(__name__)
 
 def getnightinfo(sdb, obsdate):
-    return sdb.select('NightInfo_Id', 'NightInfo', 'Date=%s' % obsdate)[0][0]
+    return sdb.select('NightInfo_Id', 'NightInfo', 'Date=%s', (obsdate,))[0][0]
 
 
-def blockvisitstats(sdb, obsdate, update=True):
+@tracing.traced('blockvisitstats')
+def blockvisitstats(sdb, obsdate, update=True, prefetch=True, night_data=None):
    """Determine the block visit statistics for an observation date.  These 
       statistics include slew time, acquisition time, and total science 
       time for the block.   For rejected blocks, this includes the time
@@ -27,139 +35,246 @@ def blockvisitstats(sdb, obsdate, update=True):
            sdb is a connection to the science data base
       obsdate: string
            observation date of interest
+      update: boolean
+           write the statistics of the accepted blocks to the sdb
+      prefetch: boolean
+           load the block visits of all pointings and the rejection reasons
+           of all blocks for the night at once, rather than querying the
+           sdb for every pointing
+      night_data: ~night_data.NightData
+           prefetched records of the night, which are used instead of
+           querying the sdb (implies prefetch)
 
    """
  
-   #for a given obsdate get the night info
-   nid=getnightinfo(sdb, obsdate)
-
-   #get the times for the night
-   record=sdb.select('EveningTwilightEnd, MorningTwilightStart', 'NightInfo', 'NightInfo_Id=%i' % nid)
-   stime=record[0][0]
-   etime=record[0][1]
-   totaltime=(etime-stime).seconds
-   #From the sdb, get the SoLogEvent table
-   record=sdb.select('EventType_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%i' % nid)
-   event_list=[]
-   for i in range(len(record)):
-       r=record[i]
-       if r[1].seconds>43200:
-          t=datetime.datetime(int(obsdate[0:4]), int(obsdate[4:6]), int(obsdate[6:8]), 0, 0, 0)+r[1]
-       else:
-          t=datetime.datetime(int(obsdate[0:4]), int(obsdate[4:6]), int(obsdate[6:8]), 0, 0, 0)+datetime.timedelta(days=1)+r[1]
-       event_list.append([r[0], t])
-
-   #sort the list by the datetimes
-   event_list.sort(key=lambda e:e[1])
+   if night_data is not None:
+      nid=night_data.nid
+      stime=night_data.stime
+      etime=night_data.etime
+      record=night_data.events
+      prefetch=True
+   else:
+      #for a given obsdate get the night info
+      nid=getnightinfo(sdb, obsdate)
+
+      #get the times for the night
+      record=sdb.select('EveningTwilightEnd, MorningTwilightStart', 'NightInfo', 'NightInfo_Id=%s', (nid,))
+      stime=record[0][0]
+      etime=record[0][1]
+
+      #From the sdb, get the SoLogEvent table
+      record=sdb.select('EventType_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%s', (nid,))
+   #decode and sort the events
+   events=EventLog.from_records(record, obsdate)
 
    #get the list of accepted blocks
-   selcmd='BlockVisit_Id, Accepted, Proposal_Code, Block_Id'
+   selcmd='BlockVisit_Id, Accepted, Proposal_Code, Block_Id, BlockRejectedReason_Id'
    tabcmd='Block join BlockVisit using (Block_Id) join Proposal using (Proposal_Id) join ProposalCode using (ProposalCode_Id)'
-   blocks=sdb.select(selcmd, tabcmd, 'NightInfo_Id=%i' % nid)
+   if night_data is not None:
+      blocks=night_data.blocks
+   else:
+      blocks=sdb.select(selcmd, tabcmd, 'NightInfo_Id=%s', (nid,))
    blocks=list(blocks)
    #print blocks
 
-   #list of accepted blocks
-   pid_list=[]
-   rej_list=[]
-   for b in blocks: 
-       if b[1]==1: 
-          pid_list.append(b[2])
-       else:
-          rej_list.append(b[2])
-
-   #print pid_list
-   #print rej_list
-       
+   #the rejection reasons and the block visits of the pointings
+   if night_data is not None:
+      reasons=dict((b[0], b[4]) for b in blocks)
+      pointevents=PointEventIndex([(converteventtime(obsdate, r[0]), r[1], r[2]) for r in night_data.pointevents])
+   elif prefetch:
+      reasons=dict((b[0], b[4]) for b in blocks)
+      pointevents=get_pointevents(sdb, nid, obsdate)
+   else:
+      reasons=None
+      pointevents=None
+
+   #index the blocks by proposal code, block and block visit
+   block_index=BlockIndex(blocks)
+
    #get a list of all data from the night
    select_state='FileName, Proposal_Code, Target_Name, ExposureTime, UTSTART, h.INSTRUME, h.OBSMODE, h.DETMODE, h.CCDTYPE, NExposures, Block_Id'
    table_state='FileData  Join ProposalCode using (ProposalCode_Id) join FitsHeaderImage as h using (FileData_Id)'
-   logic_state="FileName like '%"+obsdate+"%' order by FileName"
-   img_list=sdb.select(select_state, table_state, logic_state)
+   if night_data is not None:
+      img_list=night_data.images
+   else:
+      logic_state, params_state=su.night_files_logic(sdb, [obsdate])
+      logic_state+=' order by FileName'
+      img_list=list(sdb.iter_select(select_state, table_state, logic_state, params_state))
 
-   #now create a list of all pointing commands
-   point_list=[]
-   for r in event_list:
-       if r[0]==3: point_list.append(r[1])
+   #sort the events and images once for the matching
+   event_index=EventIndex(events)
+   image_index=ImageIndex(img_list)
 
-   #for b in blocks: if b[1]==3: blocks.remove(b)
+   #now create a list of all pointing commands
+   point_list=event_index.times((3,))
 
    #now loop through that list and associate each pointing with a blocks
    block_list=[]
-   blocks_orig = list(blocks)
-   print blocks
+   blockvisit_stats={}
+   logger.debug('Blocks of %s: %s', obsdate, blocks)
    for point in point_list:
        starttime=point
-       endtime=findnextpointing(starttime, event_list, etime)
-       #now find any date sets that might be associated with this date and time
-       #and the data and times 
-       propcode, target, bid, instr, obsmode, detmode, exptime, nexposure = finddata(img_list, starttime, endtime)
-       bvid = get_blockvisitfrompointtime(sdb, starttime, propcode)
-       #print propcode, target, bid, instr, obsmode, detmode, exptime, nexposure
-       #print starttime, endtime, propcode, target
-       if propcode in pid_list and not (propcode in rej_list): 
-           blocks = removepropcode(blocks, propcode)
-           block_list.append([bvid, starttime, endtime, 0, propcode])
-       elif propcode in rej_list and not (propcode in pid_list):
-           status = getblockrejectreason(sdb, propcode, blocks)
-           block_list.append([bvid, starttime, endtime, status, propcode])
-       elif propcode in pid_list and propcode in rej_list:
-           #get the first block with the propcode
-           for b in blocks:
-               if b[0]==bvid:
-                  if b[1]==1:
-                     status=0
-                  else:
-                     status = getblockrejectreason(sdb, propcode, blocks)
-                  #print starttime, endtime, propcode, target, bid, status
-                  block_list.append([bvid, starttime, endtime, status, propcode])
-                  #blocks = removepropcode(blocks, propcode)
-                    
-  
-       #determine statistics associated with accepted block
-       if propcode in pid_list and bid is not None:
-           #print bid, propcode
-           #deal with accepted blocks
-           #determine total time
-           tottime=endtime-starttime
-           #determine the slew time
-           guidestart=findguidingstart(starttime, event_list)
-           slewtime=guidestart-starttime
-           #determine the science time
-           instr, primary_mode=getprimarymode(img_list, bid)
-           if instr=='HRS': continue
-
-           sciencestart=getfirstimage(img_list, starttime,  instr, primary_mode)
-           if sciencestart is None: continue
-           scitime=endtime-sciencestart
-
-           #determine the acquisition time
-           acqtime=sciencestart-guidestart
-
-           #determine the block visit
-           bvid=getblockvisit(blocks_orig, bid)
-           #print bvid
-           #print starttime, endtime, propcode, target, bid, bvid, slewtime, acqtime, scitime, tottime
-           #upload results to sdb 
-           #print propcode, bvid, slewtime, acqtime, scitime
-           if bvid is not None and update:
-               inscmd='TotalSlewTime=%i, TotalAcquisitionTime=%i, TotalScienceTime=%i' % (slewtime.seconds, acqtime.seconds, scitime.seconds)
-               sdb.update(inscmd, 'BlockVisit', 'BlockVisit_Id=%i' % bvid)
-
-       elif propcode is not None and bid is not None:
-           #deal with rejected block
-           pass
-       elif propcode is not None and bid is None:
-           #deal with commissioning blocks
-           pass
-       else:
-           #otherwise ignore
-           pass    
-       
+       endtime=event_index.findnextpointing(starttime, etime)
+       match=match_pointing(sdb, starttime, endtime, event_index, image_index, block_index, pointevents, reasons)
+       if match.block is not None:
+          block_list.append(match.block)
+       if match.stats is not None:
+          blockvisit_stats[match.stats[0]]=match.stats[1]
 
+   #upload results to sdb 
+   if update:
+      update_blockvisitstats(sdb, blockvisit_stats)
 
    return block_list
 
+class PointingMatch:
+   """The result of matching a pointing to the block visits of a night
+
+      Parameters
+      ----------
+      propcode: string
+           proposal code of the first science frame of the pointing
+      bid: int
+           Block_Id of the first science frame of the pointing
+
+   """
+
+   def __init__(self, propcode, bid):
+       self.propcode=propcode
+       self.bid=bid
+       self.block=None #[BlockVisit_Id, start time, end time, status, Proposal_Code]
+       self.stats=None #(BlockVisit_Id, (slew time, acquisition time, science time))
+       self.guidestart=None #start of guiding, if determined
+       self.mode=None #instrument and primary mode, if determined
+       self.sciencestart=None #start of the first science frame, if determined
+
+def match_pointing(sdb, starttime, endtime, event_index, image_index, block_index, pointevents=None, reasons=None):
+   """Match a pointing to a block visit and determine the statistics of
+      the visit
+
+      The first remaining block visit of the proposal is consumed from the
+      block index if the pointing belongs to an accepted proposal, so that
+      the pointings of a night must be matched in order.
+
+      Parameters
+      ----------
+      sdb: mysql-instance
+           sdb is a connection to the science data base
+      starttime: datetime
+           time of the pointing
+      endtime: datetime
+           time of the next pointing or the end of the night
+      event_index: ~blockmatching.EventIndex
+           events of the night
+      image_index: ~blockmatching.ImageIndex
+           images of the night
+      block_index: ~blockmatching.BlockIndex
+           block visits of the night
+      pointevents: ~blockmatching.PointEventIndex
+           block visits of the pointings; the sdb is queried if not given
+      reasons: dict
+           rejection reasons keyed by BlockVisit_Id; the sdb is queried if
+           not given
+
+      Returns
+      -------
+      match: PointingMatch
+           the block and the statistics of the pointing
+
+   """
+   #now find any date sets that might be associated with this date and time
+   #and the data and times 
+   propcode, target, bid, instr, obsmode, detmode, exptime, nexposure = image_index.finddata(starttime, endtime)
+   if pointevents is not None:
+      bvid = pointevents.blockvisit(starttime, propcode)
+   else:
+      bvid = get_blockvisitfrompointtime(sdb, starttime, propcode)
+   pid_list=block_index.accepted_codes
+   rej_list=block_index.rejected_codes
+   match=PointingMatch(propcode, bid)
+   if propcode in pid_list and not (propcode in rej_list): 
+       block_index.remove_first(propcode)
+       match.block=[bvid, starttime, endtime, 0, propcode]
+   elif propcode in rej_list and not (propcode in pid_list):
+       status = getblockrejectreason(sdb, propcode, block_index.remaining(propcode), reasons)
+       match.block=[bvid, starttime, endtime, status, propcode]
+   elif propcode in pid_list and propcode in rej_list:
+       #get the block visit for the pointing
+       b=block_index.remaining_visit(bvid)
+       if b is not None:
+          if b[1]==1:
+             status=0
+          else:
+             status = getblockrejectreason(sdb, propcode, block_index.remaining(propcode), reasons)
+          match.block=[bvid, starttime, endtime, status, propcode]
+
+   #determine statistics associated with accepted block; rejected and
+   #commissioning blocks are ignored, as are blocks which have not started
+   #guiding yet
+   if propcode in pid_list and bid is not None:
+       #determine the slew time
+       guidestart=event_index.findguidingstart(starttime)
+       match.guidestart=guidestart
+       if guidestart is None: return match
+       slewtime=guidestart-starttime
+       #determine the science time
+       instr, primary_mode=image_index.getprimarymode(bid)
+       match.mode=(instr, primary_mode)
+       if instr=='HRS': return match
+
+       sciencestart=image_index.getfirstimage(starttime, instr, primary_mode)
+       match.sciencestart=sciencestart
+       if sciencestart is None: return match
+       scitime=endtime-sciencestart
+
+       #determine the acquisition time
+       acqtime=sciencestart-guidestart
+
+       #determine the block visit and collect the results for the upload
+       #to the sdb
+       bvid=block_index.getblockvisit(bid)
+       if bvid is not None:
+           match.stats=(bvid, (slewtime.seconds, acqtime.seconds, scitime.seconds))
+
+   return match
+
+def converteventtime(obsdate, eventtime):
+    """Convert the time of an SO event to a date time
+
+       Events after noon belong to the observation date, all other
+       events to the following day.
+    """
+    t=datetime.datetime(int(obsdate[0:4]), int(obsdate[4:6]), int(obsdate[6:8]), 0, 0, 0)+eventtime
+    if eventtime.seconds<=43200:
+       t+=datetime.timedelta(days=1)
+    return t
+
+def update_blockvisitstats(sdb, blockvisit_stats):
+    """Write the statistics of all block visits to the sdb with a single
+       UPDATE statement
+
+       Parameters
+       ----------
+       sdb: mysql-instance
+           sdb is a connection to the science data base
+       blockvisit_stats: dict
+           (slew time, acquisition time, science time) in seconds keyed
+           by BlockVisit_Id
+
+    """
+    if not blockvisit_stats: return
+    bvids=sorted(blockvisit_stats.keys())
+    columns=['TotalSlewTime', 'TotalAcquisitionTime', 'TotalScienceTime']
+    inscmd=[]
+    params=[]
+    for i, c in enumerate(columns):
+        inscmd.append(c+'=CASE BlockVisit_Id '+' '.join(['WHEN %s THEN %s']*len(bvids))+' END')
+        for bvid in bvids:
+            params.extend([bvid, blockvisit_stats[bvid][i]])
+    logic='BlockVisit_Id in ('+', '.join(['%s']*len(bvids))+')'
+    params.extend(bvids)
+    sdb.update(', '.join(inscmd), 'BlockVisit', logic, tuple(params))
+
 def removepropcode(blocks, propcode):
     for b in blocks:
         if b[2]==propcode:
@@ -169,19 +284,46 @@ def removepropcode(blocks, propcode):
 
 def get_blockvisitfrompointtime(sdb, starttime, propcode=None):
     table = 'PointEvent join SoLogEvent using (SoLogEvent_Id)'
-    logic = 'EventTime="{}"'.format(starttime)
-    if propcode is not None and propcode!='JUNK' and not propcode.count("CAL_") and not propcode.count("ENG_"): 
-        logic += ' and Proposal_Code="{}"'.format(propcode)
-    print sdb.select('BlockVisit_Id', table, logic)
-    print starttime, propcode
-    return sdb.select('BlockVisit_Id', table, logic)[0][0]
+    logic = 'EventTime=%s'
+    params = (starttime,)
+    if isscienceproposal(propcode): 
+        logic += ' and Proposal_Code=%s'
+        params += (propcode,)
+    return sdb.select('BlockVisit_Id', table, logic, params)[0][0]
+
+def get_pointevents(sdb, nid, obsdate):
+    """Get the block visits of all pointings of a night
+
+       Parameters
+       ----------
+       sdb: mysql-instance
+           sdb is a connection to the science data base
+       nid: int
+           NightInfo_Id of the night
+       obsdate: string
+           observation date of interest
+
+       Returns
+       -------
+       pointevents: ~blockmatching.PointEventIndex
+           block visits keyed by pointing time
+
+    """
+    table = 'PointEvent join SoLogEvent using (SoLogEvent_Id)'
+    record = sdb.select('EventTime, Proposal_Code, BlockVisit_Id', table, 'NightInfo_Id=%s', (nid,))
+    return PointEventIndex([(converteventtime(obsdate, r[0]), r[1], r[2]) for r in record])
 
 
-def getblockrejectreason(sdb, propcode, blocks):
-    """Get the reason for the block rejection"""
+def getblockrejectreason(sdb, propcode, blocks, reasons=None):
+    """Get the reason for the block rejection
+
+       If a dict of rejection reasons keyed by BlockVisit_Id is given, it is
+       used instead of querying the sdb.
+    """
     for b in blocks:
         if propcode == b[2]: 
-           record = sdb.select('BlockRejectedReason_Id', 'BlockVisit', 'BlockVisit_Id=%i' % b[0])[0][0]
+           if reasons is not None: return reasons[b[0]]
+           record = sdb.select('BlockRejectedReason_Id', 'BlockVisit', 'BlockVisit_Id=%s', (b[0],))[0][0]
            return record
     return 0
 
@@ -0,0 +1,163 @@
+"""
+Columnar SO event log.
+
+The SoLogEvent table stores the time of an event as a time of day, so that
+events after midnight belong to the night of the previous day. EventLog
+keeps the events of a night as numpy arrays of event type and of seconds
+since noon of the observing date, with this wraparound applied to all events
+at once, and answers the questions of the pipelines (the next event of some
+types after a time, and the mirror alignments) with searchsorted instead of
+loops over the events.
+"""
+import datetime
+
+import numpy as np
+
+# event types used by the pipelines
+POINT, GUIDE, TRACK = 3, 5, 10
+
+# events after which a mirror alignment is taken to start
+MIRROR_ALIGNMENT_PRECURSORS = [4, 6, 13, 14]
+
+EVENT_DTYPE = [('type', np.int32), ('time', np.int64)]
+
+DAY = 86400
+NOON = 43200
+
+
+def day_start(obsdate):
+    """Return noon of an observing date (YYYYMMDD)"""
+    return datetime.datetime(int(obsdate[0:4]), int(obsdate[4:6]), int(obsdate[6:8]), 12, 0, 0)
+
+
+class EventLog:
+   """The events of a night sorted by time
+
+      Events with the same time keep their order.
+
+      Parameters
+      ----------
+      types: array
+           EventType_Id of the events
+      times: array
+           times of the events in seconds since noon of the observing date
+      day_start: datetime
+           noon of the observing date
+
+   """
+
+   def __init__(self, types, times, day_start):
+       events = np.zeros(len(types), dtype=EVENT_DTYPE)
+       events['type'] = types
+       events['time'] = times
+       self.events = events[np.argsort(events['time'], kind='mergesort')]
+       self.day_start = day_start
+       self._times = {}
+
+   @classmethod
+   def from_records(cls, records, obsdate):
+       """Create the log from SoLogEvent records of (EventType_Id, EventTime)
+
+          Times up to noon are taken to be on the day after the observing
+          date, as in blockvisitstats.converteventtime.
+       """
+       if not len(records):
+          return cls([], [], day_start(obsdate))
+       columns = list(zip(*records))
+       t = np.array(columns[1], dtype='timedelta64[s]').astype(np.int64)
+       t = t - NOON + DAY*(t % DAY <= NOON)
+       return cls(np.array(columns[0], dtype=np.int32), t, day_start(obsdate))
+
+   @classmethod
+   def from_datetimes(cls, event_list):
+       """Create the log from a list of [EventType_Id, datetime] pairs
+
+          The observing date is that of the first event.
+       """
+       if not len(event_list):
+          return cls([], [], datetime.datetime(1970, 1, 1, 12, 0, 0))
+       columns = list(zip(*event_list))
+       first = min(columns[1])
+       start = datetime.datetime(first.year, first.month, first.day, 12, 0, 0)
+       if first < start: start -= datetime.timedelta(days=1)
+       t = (np.array(columns[1], dtype='datetime64[s]') - np.datetime64(start, 's')).astype(np.int64)
+       return cls(np.array(columns[0], dtype=np.int32), t, start)
+
+   def __len__(self):
+       return len(self.events)
+
+   @property
+   def types(self):
+       return self.events['type']
+
+   @property
+   def times(self):
+       return self.events['time']
+
+   def seconds(self, t):
+       """Convert a date time to seconds since noon of the observing date"""
+       dt = t - self.day_start
+       return dt.days*DAY + dt.seconds
+
+   def datetime(self, seconds):
+       """Convert seconds since noon of the observing date to a date time"""
+       return self.day_start + datetime.timedelta(seconds=int(seconds))
+
+   def event_times(self, event_types):
+       """Return the sorted times of all events with one of the given types"""
+       key = tuple(sorted(event_types))
+       if key not in self._times:
+          self._times[key] = self.times[np.isin(self.types, key)]
+       return self._times[key]
+
+   def next_events(self, event_types, t, missing=-1):
+       """Return the times of the first events of the given types strictly
+          after each of the times t, or missing if there is no such event
+       """
+       times = self.event_times(event_types)
+       t = np.asarray(t, dtype=np.int64)
+       if not len(times):
+          return np.full(t.shape, missing, dtype=np.int64)
+       i = np.searchsorted(times, t, side='right')
+       return np.where(i < len(times), times[np.minimum(i, len(times)-1)], missing)
+
+   def next_event(self, event_types, t):
+       """Return the time of the first event of the given types after t, or
+          None
+       """
+       times = self.event_times(event_types)
+       i = np.searchsorted(times, t, side='right')
+       if i < len(times): return int(times[i])
+       return None
+
+   def mirror_alignments(self):
+       """Return the start and end times of the mirror alignments
+
+          A mirror alignment starts with the first track command after the
+          previous alignment, or with the event before it if that is one of
+          MIRROR_ALIGNMENT_PRECURSORS, and ends with the next point or guide
+          command. Alignments without an end are ignored.
+
+          Returns
+          -------
+          alignments: numpy.ndarray
+              array of shape (n, 2) of start and end times in seconds since
+              noon of the observing date
+
+       """
+       tracks = np.flatnonzero(self.types == TRACK)
+       ends = np.flatnonzero(np.isin(self.types, [POINT, GUIDE]))
+
+       #the track commands before the same end belong to one alignment, which
+       #starts with the first of them
+       end = np.searchsorted(ends, tracks, side='right')
+       first = np.concatenate([[True], end[1:] != end[:-1]]) if len(end) else np.zeros(0, dtype=bool)
+       closed = end < len(ends)
+       starts = tracks[first & closed]
+       stops = ends[end[first & closed]]
+
+       #use the time of a preceding event which starts the alignment
+       previous = np.maximum(starts-1, 0)
+       precursor = (starts > 0) & np.isin(self.types[previous], MIRROR_ALIGNMENT_PRECURSORS)
+       start_times = np.where(precursor, self.times[previous], self.times[starts])
+       return np.column_stack([start_times, self.times[stops]]).astype(np.int64)
@@ -0,0 +1,83 @@
+"""
+Local index of the data files taken in each night.
+
+The observing date of a data file is only contained in its file name, so that
+the files of a night can only be found in the sdb by scanning FileData with
+a leading-wildcard FileName pattern. This index maps observing dates to
+FileData_Id values instead. It is built incrementally: as FileData_Id grows
+with every new file, an update only reads the FileData rows added since the
+last update, which is a range scan of the primary key.
+"""
+import re
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (FileData_Id INTEGER PRIMARY KEY, ObsDate TEXT);
+CREATE INDEX IF NOT EXISTS files_obsdate ON files (ObsDate);
+'''
+
+
+def file_night(filename):
+    """Return the observation date (YYYYMMDD) contained in a file name, or
+       None
+    """
+    m = re.search(r'(\d{8})', filename)
+    if m is None: return None
+    return m.group(1)
+
+
+class FileIndex:
+   """Index of the FileData_Id values by observing date
+
+      Parameters
+      ----------
+      path: string
+           path of the SQLite database
+
+   """
+
+   def __init__(self, path):
+       self.path = path
+       # the index may be used by the threads fetching the data of a night
+       self.db = sqlite3.connect(path, check_same_thread=False)
+       self.db.executescript(SCHEMA)
+       self._lock = threading.RLock()
+
+   @property
+   def high_water_mark(self):
+       """The largest FileData_Id in the index"""
+       with self._lock:
+           return self.db.execute('SELECT MAX(FileData_Id) FROM files').fetchone()[0] or 0
+
+   def update(self, sdb, chunk_size=10000):
+       """Add the FileData rows which are not in the index yet"""
+       logic = 'FileData_Id > %s order by FileData_Id'
+       with self._lock:
+           rows = sdb.select_chunks('FileData_Id, FileName', 'FileData', logic, (self.high_water_mark,), size=chunk_size)
+           with self.db:
+               for chunk in rows:
+                   self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?)',
+                                       [(r[0], file_night(r[1])) for r in chunk])
+
+   def rebuild(self, sdb):
+       """Build the index from scratch, for example after files have been
+          renamed or reingested
+       """
+       with self._lock:
+           with self.db:
+               self.db.execute('DELETE FROM files')
+           self.update(sdb)
+
+   def file_ids(self, obsdates):
+       """Return the FileData_Id values of the files of the observing dates
+          (YYYYMMDD), keyed by FileData_Id
+       """
+       obsdates = list(obsdates)
+       if not obsdates: return {}
+       select = 'SELECT FileData_Id, ObsDate FROM files WHERE ObsDate IN ({}) ORDER BY FileData_Id'
+       with self._lock:
+           return dict(self.db.execute(select.format(', '.join(['?']*len(obsdates))), obsdates).fetchall())
+
+   def close(self):
+       self.db.close()
@@ -1,9 +1,319 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import Queue
+from contextlib import contextmanager
+
 import MySQLdb
+import MySQLdb.cursors
+
+# MySQL client errors raised when the server has dropped the connection
+CONNECTION_LOST_ERRORS = (2006, 2013)
+
+
+class PooledConnection:
+   """A database connection together with a cursor that is reused for all
+      statements executed on the connection
+
+      Parameters
+      ----------
+      connect: function
+           function returning a new MySQLdb connection
+
+   """
+
+   def __init__(self, connect):
+        self.connect = connect
+        self.db = None
+        self.cursor = None
+        self.last_used = 0
+        self.open()
+
+   def open(self):
+        """Open the connection, closing it first if necessary
+
+           The connection is in autocommit mode, so that every query sees
+           the rows committed before it (MySQLdb turns autocommit off, and a
+           long-lived connection would otherwise read the snapshot of its
+           first query under InnoDB's REPEATABLE READ).
+        """
+        self.close()
+        self.db = self.connect()
+        self.db.autocommit(True)
+        self.cursor = self.db.cursor()
+        self.last_used = time.time()
+
+   def close(self):
+        """Close the connection, ignoring any errors"""
+        try:
+            if self.cursor is not None: self.cursor.close()
+            if self.db is not None: self.db.close()
+        except MySQLdb.Error:
+            pass
+        self.db = None
+        self.cursor = None
+
+   def check(self):
+        """Make sure the connection is alive, reconnecting if it has been
+           dropped by the server
+        """
+        try:
+            self.db.ping()
+        except MySQLdb.OperationalError:
+            self.open()
+
+
+class ConnectionPool:
+   """A bounded pool of database connections
+
+      Connections are opened lazily, up to the size of the pool. A connection
+      which has been idle for longer than check_interval seconds is pinged
+      before it is handed out, and reopened if the server has dropped it.
+
+      Parameters
+      ----------
+      connect: function
+           function returning a new MySQLdb connection
+      size: int
+           maximum number of open connections
+      timeout: float
+           seconds to wait for a free connection (None waits forever)
+      check_interval: float
+           idle time in seconds after which a connection is checked
+
+   """
+
+   def __init__(self, connect, size=4, timeout=None, check_interval=60):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._idle = Queue.LifoQueue(size)
+        for i in range(size):
+            self._idle.put(None)
+
+   def acquire(self):
+        """Take a connection from the pool"""
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise MySQLdb.OperationalError('No database connection available in the pool')
+        try:
+            if conn is None:
+               conn = PooledConnection(self.connect)
+            elif time.time() - conn.last_used > self.check_interval:
+               conn.check()
+        except:
+            self._idle.put(None)
+            raise
+        return conn
+
+   def release(self, conn):
+        """Return a connection to the pool"""
+        if conn.db is None:
+           conn = None
+        else:
+           conn.last_used = time.time()
+        self._idle.put(conn)
+
+   def close(self):
+        """Close all idle connections"""
+        for i in range(self.size):
+            try:
+                conn = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            if conn is not None: conn.close()
+            self._idle.put(None)
+
+
+class Statement:
+   """A statement which is built once and executed with different parameters
+
+      Parameters
+      ----------
+      sdb: ~mysql.mysql
+           the database to execute the statement on
+      exec_command: string
+           SQL statement with %s placeholders for the parameters
+      fetch: boolean
+           whether the statement returns records
+      commit: boolean
+           whether the statement has to be committed
+
+   """
+
+   def __init__(self, sdb, exec_command, fetch=False, commit=False):
+        self.sdb = sdb
+        self.exec_command = exec_command
+        self.fetch = fetch
+        self.commit = commit
+
+   def execute(self, params=None):
+        """Execute the statement with the given parameters"""
+        return self.sdb._execute(self.exec_command, params, fetch=self.fetch, commit=self.commit)
+
+   def executemany(self, seq_params):
+        """Execute the statement once for every set of parameters"""
+        self.sdb.executemany(self.exec_command, seq_params)
+
+
+# this module without the extension, for skipping its frames in _call_site
+_THIS = os.path.splitext(os.path.abspath(__file__))[0]
+
+def _call_site():
+    """Return a tag module.function for the code calling the mysql methods"""
+    f = sys._getframe(1)
+    while f is not None and os.path.splitext(os.path.abspath(f.f_code.co_filename))[0] == _THIS:
+        f = f.f_back
+    if f is None: return None
+    module = os.path.splitext(os.path.basename(f.f_code.co_filename))[0]
+    return '{0}.{1}'.format(module, f.f_code.co_name)
+
+def _size(records):
+    """Estimate the number of bytes fetched for records"""
+    n = 0
+    for r in records:
+        for v in r:
+            if isinstance(v, basestring): n += len(v)
+            elif v is not None: n += 8
+    return n
+
+
+class QueryStats:
+   """Statistics of the statements executed by mysql instances
+
+      The number of calls, the time taken and the number of rows and bytes
+      fetched are aggregated by the call site (the function calling the
+      mysql method) and the kind of statement. Statements taking longer
+      than slow_query_time seconds are logged as warnings, together with
+      the EXPLAIN plan of select statements, and kept in slow_queries.
+
+      Parameters
+      ----------
+      slow_query_time: float
+           time in seconds above which a statement is logged (None to log
+           no statements)
+      explain: boolean
+           whether to get the EXPLAIN plan of slow select statements
+      max_slow_queries: int
+           maximum number of slow statements kept
+
+   """
+
+   def __init__(self, slow_query_time=1.0, explain=True, max_slow_queries=100):
+        self.slow_query_time = slow_query_time
+        self.explain = explain
+        self.max_slow_queries = max_slow_queries
+        self._lock = threading.Lock()
+        self.reset()
+
+   def reset(self):
+        """Remove all statistics"""
+        with self._lock:
+            self.calls = {}
+            self.slow_queries = []
+
+   def record(self, tag, kind, command, seconds, rows, nbytes):
+        """Add an executed statement to the statistics
+
+           Returns whether the statement counts as slow.
+        """
+        key = '{0} {1}'.format(tag, kind)
+        with self._lock:
+            c = self.calls.get(key)
+            if c is None:
+               c = self.calls[key] = {'tag': tag, 'kind': kind, 'statement': command, 'calls': 0,
+                                      'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'bytes': 0}
+            c['calls'] += 1
+            c['seconds'] += seconds
+            c['max_seconds'] = max(c['max_seconds'], seconds)
+            c['rows'] += rows
+            c['bytes'] += nbytes
+        return self.slow_query_time is not None and seconds > self.slow_query_time
+
+   def slow(self, tag, command, params, seconds, rows, plan=None):
+        """Log a slow statement"""
+        entry = {'tag': tag, 'statement': command, 'params': repr(params)[:1000], 'seconds': seconds,
+                 'rows': rows, 'plan': plan}
+        with self._lock:
+            self.slow_queries.append(entry)
+            del self.slow_queries[:-self.max_slow_queries]
+        msg = 'Slow query ({0:.2f} s, {1} rows) in {2}: {3} {4}'.format(seconds, rows, tag, command, entry['params'])
+        if plan is not None:
+           msg += '\n'+'\n'.join('\t'.join(str(v) for v in r) for r in plan)
+        logging.getLogger(__name__).warning(msg)
+
+   def as_dict(self):
+        """Return the statistics, sorted by the total time of the call sites"""
+        with self._lock:
+            calls = sorted(self.calls.values(), key=lambda c: -c['seconds'])
+            calls = [dict(c) for c in calls]
+            slow_queries = list(self.slow_queries)
+        total = {'calls': sum(c['calls'] for c in calls), 'seconds': sum(c['seconds'] for c in calls),
+                 'rows': sum(c['rows'] for c in calls), 'bytes': sum(c['bytes'] for c in calls)}
+        return {'total': total, 'calls': calls, 'slow_queries': slow_queries}
+
+   def dump(self, path):
+        """Write the statistics to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, default=str)
+
+
+# statistics used by all mysql instances without statistics of their own (a
+# QueryStats), if not None
+query_stats = None
+
+# archive recording or replaying the results of the queries of all mysql
+# instances (a query_archive.QueryArchive), if not None
+query_archive = None
+
+# pools shared by all instances connecting to the same database
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, dbname, user, passwd, port=None, size=4):
+    """Return the connection pool for a database, creating it if necessary"""
+    key = (host, dbname, user, port)
+    with _pools_lock:
+        if key not in _pools:
+           kwargs = dict(host=host, db=dbname, user=user, passwd=passwd)
+           if port is not None: kwargs['port'] = port
+           _pools[key] = ConnectionPool(lambda: MySQLdb.connect(**kwargs), size=size)
+        return _pools[key]
+
 
 class mysql:
-   """mysql is an interface to the sql library and specifically simplifies 
+   """mysql is an interface to the sql library and specifically simplifies
       the steps of returning objects from a call to a mysql database
 
+      Connections are taken from a pool shared by all instances for the same
+      database, so that creating many instances does not open many
+      connections. The connections are in autocommit mode, so that each
+      statement is committed immediately and every query sees the rows
+      committed before it, unless it is executed within a transaction (see
+      the transaction method).
+
+      Values should be passed as parameters rather than be formatted into
+      the logic strings. Use %s as the placeholder for a parameter (and %%
+      for a literal percent sign if parameters are given); the values are
+      escaped by MySQLdb. Statements which are executed many times can be
+      built once with the prepare_select and prepare_update methods.
+
+      Large results can be streamed from the server with iter_select and
+      select_chunks instead of being loaded completely by select.
+
+      If stats (or the module's query_stats) is set to a QueryStats, the
+      time taken and the rows fetched by every statement are recorded.
+
+      If the module's query_archive is set to a QueryArchive, the results
+      of the queries are recorded in it or, in replay mode, read from it
+      without connecting to the database.
+
       Parameters
       ----------
       host: string
@@ -14,11 +324,37 @@ class mysql:
            user for database
       passwd: string
            password of user for mysql database
+      pool_size: int
+           maximum number of connections to the database
+      stats: ~mysql.QueryStats
+           statistics of the executed statements
 
    """
-   
-   def __init__(self, host,dbname,user,passwd, port=None):
-        self.db = MySQLdb.connect(host=host,db=dbname,user=user,passwd=passwd, port=port)
+
+   def __init__(self, host,dbname,user,passwd, port=None, pool_size=4, stats=None):
+        self.pool = get_pool(host, dbname, user, passwd, port=port, size=pool_size)
+        self._local = threading.local()
+        self._stats = stats
+
+   @property
+   def stats(self):
+       """The statistics of the executed statements (or None)"""
+       if self._stats is not None: return self._stats
+       return query_stats
+
+   def _record(self, stats, kind, exec_command, params, seconds, rows, nbytes):
+       """Add an executed statement to the statistics, explaining it if it
+          is slow
+       """
+       tag = _call_site()
+       if not stats.record(tag, kind, exec_command, seconds, rows, nbytes): return
+       plan = None
+       if stats.explain and exec_command.lstrip().upper().startswith('SELECT'):
+          try:
+              plan = self._execute('EXPLAIN '+exec_command, params, fetch=True, record=False)
+          except MySQLdb.Error, e:
+              plan = [('EXPLAIN failed', str(e))]
+       stats.slow(tag, exec_command, params, seconds, rows, plan)
 
    @classmethod
    def fromuri(cls, uri):
@@ -30,52 +366,261 @@ class mysql:
        user = result[0]
        passwd=result[1]
        return cls(host, dbname, user=user, passwd=passwd)
-       
 
-   def select(self, selection, table, logic):
+   @contextmanager
+   def transaction(self):
+       """Context manager for executing several statements in a single
+          transaction
+
+          The statements are committed when the block is left and rolled
+          back if an exception is raised. Transactions may be nested, in
+          which case only the outermost one commits. When replaying from
+          the query archive there is nothing to commit.
+       """
+       if query_archive is not None and query_archive.replaying:
+          yield
+          return
+
+       conn = getattr(self._local, 'transaction', None)
+       if conn is not None:
+          yield
+          return
+
+       conn = self.pool.acquire()
+       self._local.transaction = conn
+       try:
+           conn.db.autocommit(False)
+           yield
+           conn.db.commit()
+       except:
+           try:
+               conn.db.rollback()
+           except MySQLdb.Error:
+               conn.close()
+           raise
+       finally:
+           self._local.transaction = None
+           try:
+               if conn.db is not None: conn.db.autocommit(True)
+           except MySQLdb.Error:
+               conn.close()
+           self.pool.release(conn)
+
+   def _execute(self, exec_command, params=None, fetch=False, commit=False, many=False, record=True):
+       """Execute a command on a pooled connection
+
+          Outside a transaction a dropped connection is reopened and a
+          command returning records is tried once more. Other commands are
+          not, as the server may have applied them before the connection
+          was lost. Unless record is False, the command
+          is added to the statistics and its result to the archive.
+       """
+       archive = query_archive if record else None
+       if query_archive is not None and query_archive.replaying:
+          #statements which don't return records are not replayed
+          if not fetch or archive is None: return None
+          return archive.replay(exec_command, params)
+
+       stats = self.stats if record else None
+       if stats is not None: start = time.time()
+       conn = getattr(self._local, 'transaction', None)
+       if conn is not None:
+          self._run(conn.cursor, exec_command, params, many)
+          result = conn.cursor.fetchall() if fetch else None
+          if stats is not None:
+             self._record_execute(stats, exec_command, params, many, time.time()-start, result, conn.cursor.rowcount)
+          if archive is not None and fetch: archive.record(exec_command, params, result)
+          return result
+
+       conn = self.pool.acquire()
+       try:
+           try:
+               self._run(conn.cursor, exec_command, params, many)
+           except MySQLdb.OperationalError, e:
+               if not fetch or e.args[0] not in CONNECTION_LOST_ERRORS: raise
+               conn.open()
+               self._run(conn.cursor, exec_command, params, many)
+           result = None
+           if fetch: result = conn.cursor.fetchall()
+           if commit: conn.db.commit()
+           rowcount = conn.cursor.rowcount
+       except MySQLdb.OperationalError:
+           conn.close()
+           raise
+       finally:
+           self.pool.release(conn)
+       if stats is not None:
+          self._record_execute(stats, exec_command, params, many, time.time()-start, result, rowcount)
+       if archive is not None and fetch: archive.record(exec_command, params, result)
+       return result
+
+   def _record_execute(self, stats, exec_command, params, many, seconds, result, rowcount):
+       """Add a statement executed by _execute to the statistics"""
+       if result is not None:
+          kind, rows, nbytes = 'select', len(result), _size(result)
+       else:
+          kind, rows, nbytes = 'executemany' if many else 'execute', max(rowcount, 0), 0
+       self._record(stats, kind, exec_command, params, seconds, rows, nbytes)
+
+   @staticmethod
+   def _run(cursor, exec_command, params, many):
+       if many:
+          cursor.executemany(exec_command, params)
+       else:
+          cursor.execute(exec_command, params)
+
+   @staticmethod
+   def _select_command(selection, table, logic):
+       exec_command    =""
+       exec_command   +="SELECT "+selection
+       exec_command   +=" FROM  "+table
+       if len(logic)>0:
+           exec_command   +=" WHERE  "+logic
+       return exec_command
+
+   @staticmethod
+   def _update_command(insertion, table, logic):
+       exec_command    =""
+       exec_command   +="UPDATE "+table
+       exec_command   +=" SET  "+insertion
+       if len(logic)>0:
+           exec_command   +=" WHERE  "+logic
+       return exec_command
+
+   def select(self, selection, table, logic, params=None):
        """Select a record from a table
 
        Parameters
        ----------
        selection: string
-           columns to return 
+           columns to return
        table: string
            table or group of tables to select from
        logic: string
            logic for selecting from table
+       params: tuple
+           values for the %s placeholders in the selection and logic
 
        Returns
         -------
        record: list
-           list of results 
+           list of results
+
 
-           
        """
 
-       #build the command
-       record=''
-       exec_command    =""
-       exec_command   +="SELECT "+selection
-       exec_command   +=" FROM  "+table
-       if len(logic)>0:
-           exec_command   +=" WHERE  "+logic
+       #build and execute the command
+       return self._execute(self._select_command(selection, table, logic), params, fetch=True)
 
-       #execute the command
-       cursor = self.db.cursor()
-       cursor.execute(exec_command)
-       record = cursor.fetchall()
-       cursor.close()
-
-       #clean the return record
-       if len(record)>0:
-           return record
-       else:
-           return record
 
-       return record
+   def iter_select(self, selection, table, logic, params=None):
+       """Select records from a table, streaming them from the server
+
+       The records are read with a server-side cursor, so that only one
+       chunk of records at a time is kept in memory. The connection used
+       for the query is busy until all records have been read (or the
+       iteration is abandoned), so no other query can be executed within
+       the same transaction while iterating.
+
+       Parameters
+       ----------
+       selection: string
+           columns to return
+       table: string
+           table or group of tables to select from
+       logic: string
+           logic for selecting from table
+       params: tuple
+           values for the %s placeholders in the selection and logic
+
+       Returns
+       -------
+       records: iterator
+           iterator over the records
+
+       """
+       for chunk in self.select_chunks(selection, table, logic, params):
+           for record in chunk:
+               yield record
+
+   def select_chunks(self, selection, table, logic, params=None, size=1000):
+       """Select records from a table, streaming them from the server in
+       chunks of a fixed size
+
+       See iter_select for the restrictions of streaming.
+
+       Parameters
+       ----------
+       selection: string
+           columns to return
+       table: string
+           table or group of tables to select from
+       logic: string
+           logic for selecting from table
+       params: tuple
+           values for the %s placeholders in the selection and logic
+       size: int
+           maximum number of records per chunk
+
+       Returns
+       -------
+       chunks: iterator
+           iterator over lists of records
+
+       """
+       exec_command = self._select_command(selection, table, logic)
+       archive = query_archive
+       if archive is not None and archive.replaying:
+          records = archive.replay(exec_command, params)
+          for i in range(0, len(records), size):
+              yield list(records[i:i+size])
+          return
 
+       stats = self.stats
+       if stats is not None:
+          rows = nbytes = 0
+       #the time spent by the server, not by the caller between chunks
+       seconds = 0.0
+       archived = [] if archive is not None else None
+       conn = getattr(self._local, 'transaction', None)
+       release = conn is None
+       if release: conn = self.pool.acquire()
+       cursor = None
+       start = time.time()
+       try:
+           try:
+               cursor = conn.db.cursor(MySQLdb.cursors.SSCursor)
+               cursor.execute(exec_command, params)
+           except MySQLdb.OperationalError, e:
+               if not release or e.args[0] not in CONNECTION_LOST_ERRORS: raise
+               conn.open()
+               cursor = conn.db.cursor(MySQLdb.cursors.SSCursor)
+               cursor.execute(exec_command, params)
+           while True:
+               chunk = cursor.fetchmany(size)
+               seconds += time.time()-start
+               start = None
+               if not chunk: break
+               if stats is not None:
+                  rows += len(chunk)
+                  nbytes += _size(chunk)
+               if archived is not None: archived.extend(chunk)
+               yield list(chunk)
+               start = time.time()
+           #only complete results are archived
+           if archive is not None: archive.record(exec_command, params, tuple(archived))
+       except MySQLdb.OperationalError:
+           if release: conn.close()
+           raise
+       finally:
+           if cursor is not None and conn.db is not None:
+              cursor.close()
+           if release: self.pool.release(conn)
+           if stats is not None:
+              if start is not None: seconds += time.time()-start
+              self._record(stats, 'select_chunks', exec_command, params, seconds, rows, nbytes)
 
-   def update(self, insertion, table, logic):
+   def update(self, insertion, table, logic, params=None):
        """Select a record from a table
 
        Parameters
@@ -86,21 +631,70 @@ class mysql:
            table or group of tables to select from
        logic: string
            logic for selecting from table
+       params: tuple
+           values for the %s placeholders in the insertion and logic
 
        """
 
-       #build the command
-       record=''
-       exec_command    =""
-       exec_command   +="UPDATE "+table
-       exec_command   +=" SET  "+insertion
-       if len(logic)>0:
-           exec_command   +=" WHERE  "+logic
+       #build and execute the command
+       self._execute(self._update_command(insertion, table, logic), params, commit=True)
 
-       #execute the command
-       cursor = self.db.cursor()
-       cursor.execute(exec_command)
-       cursor.execute("COMMIT")
+   def executemany(self, exec_command, seq_params):
+       """Execute a statement once for every set of parameters
+
+       All executions are committed together. For INSERT statements MySQLdb
+       sends all rows in a single multi-row statement.
+
+       Parameters
+       ----------
+       exec_command: string
+           SQL statement with %s placeholders
+       seq_params: list
+           list of parameter tuples
+
+       """
+       with self.transaction():
+           self._execute(exec_command, list(seq_params), many=True)
+
+   def prepare_select(self, selection, table, logic):
+       """Build a select statement for repeated execution
+
+       Parameters
+       ----------
+       selection: string
+           columns to return
+       table: string
+           table or group of tables to select from
+       logic: string
+           logic for selecting from table, with %s placeholders
+
+       Returns
+       -------
+       statement: ~mysql.Statement
+           statement to be executed with the parameters
+
+       """
+       return Statement(self, self._select_command(selection, table, logic), fetch=True)
+
+   def prepare_update(self, insertion, table, logic):
+       """Build an update statement for repeated execution
+
+       Parameters
+       ----------
+       insertion: string
+           values and columns to insert, with %s placeholders
+       table: string
+           table or group of tables to select from
+       logic: string
+           logic for selecting from table, with %s placeholders
+
+       Returns
+       -------
+       statement: ~mysql.Statement
+           statement to be executed with the parameters
+
+       """
+       return Statement(self, self._update_command(insertion, table, logic), commit=True)
 
 
    def insert(self, insertion, table):
@@ -113,25 +707,26 @@ class mysql:
        table: string
            table or group of tables to select from
 
-           
+
        """
 
        #build the command
        exec_command    =""
        exec_command   +="INSERT INTO "+table
        exec_command   +=" SET  "+insertion
- 
-    
+
+
        #execute the command
-       cursor = self.db.cursor()
        try:
-           cursor.execute(exec_command)
-           cursor.execute("COMMIT")
+           self._execute(exec_command, commit=True)
        except MySQLdb.IntegrityError,e:
            if str(e).count('Duplicate entry'): return
            raise MySQLdb.IntegrityError(e)
-           
+
        except Exception,e:
            raise Exception(str(e) + exec_command)
 
+   def close(self):
+       """Close the idle connections of the pool"""
+       self.pool.close()
 
@@ -0,0 +1,222 @@
+"""
+Data for the night summary pipeline, fetched for many nights at once.
+
+fetch_nights gets the NightInfo, SoLogEvent, PointEvent, BlockVisit, Fault,
+FileData/FitsHeaderImage and weather records for a range of nights with one
+query per table and partitions them in memory. The resulting NightData
+objects can be passed to night_summary_page, create_night_table and
+blockvisitstats, which then don't query the databases themselves.
+"""
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+import sdb_utils as su
+import tracing
+from file_index import file_night
+
+
+class NightData:
+   """The records of a single night
+
+      Parameters
+      ----------
+      obsdate: string
+           observation date in YYYYMMDD format
+      nid: int
+           NightInfo_Id
+      stime: datetime
+           evening twilight end
+      etime: datetime
+           morning twilight start
+
+   """
+
+   def __init__(self, obsdate, nid, stime, etime):
+       self.obsdate = obsdate
+       self.nid = nid
+       self.stime = stime
+       self.etime = etime
+       self.staff = (None, None, None) #SA, SO and CT surnames
+       self.night_times = None #science, engineering, weather and problem time
+       self.events = [] #(EventType_Id, EventTime)
+       self.pointevents = [] #(EventTime, Proposal_Code, BlockVisit_Id)
+       self.blocks = [] #(BlockVisit_Id, Accepted, Proposal_Code, Block_Id, BlockRejectedReason_Id)
+       self.images = [] #records of the blockvisitstats image query
+       self.files = [] #(FileName, Proposal_Code, INSTRUME, Target_Name)
+       self.faults = [] #(Fault_id, FaultStart, FaultEnd, TimeLost, SaltSubsystem)
+       self.weather = None #weather records as returned by get_weather_info
+
+
+def _in_list(n):
+    return '('+', '.join(['%s']*n)+')'
+
+def fetch_concurrently(tasks, workers=4):
+    """Call functions in a pool of threads and return their results
+
+       The functions are expected to spend their time waiting for database
+       servers, which can serve them in parallel.
+    """
+    def run(task):
+        with tracing.span('fetch.'+task.__name__):
+            return task()
+
+    if workers <= 1 or len(tasks) <= 1:
+       return [run(task) for task in tasks]
+    pool = ThreadPool(min(workers, len(tasks)))
+    try:
+        return pool.map(run, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def fetch_night_info(sdb, startdate, enddate):
+    """Fetch the night information and staff for a date range
+
+       Returns
+       -------
+       nights: OrderedDict
+           NightData objects without records keyed by observing date,
+           sorted by date
+
+    """
+    select = 'NightInfo_Id, Date, EveningTwilightEnd, MorningTwilightStart, ' \
+             'ScienceTime, EngineeringTime, TimeLostToWeather, TimeLostToProblems, ' \
+             'sa.Surname, so.Surname, ct.Surname'
+    table = 'NightInfo left join Investigator as sa on SA_Id=sa.Investigator_Id ' \
+            'left join SaltOperator as so on SO1_Id=so.SO_Id ' \
+            'left join Investigator as ct on CTDuty_Id=ct.Investigator_Id'
+    nights = OrderedDict()
+    for r in sdb.select(select, table, 'Date between %s and %s order by Date', (startdate, enddate)):
+        night = NightData(r[1].strftime('%Y%m%d'), r[0], r[2], r[3])
+        night.night_times = r[4:8]
+        night.staff = r[8:11]
+        nights[night.obsdate] = night
+    return nights
+
+@tracing.traced('fetch_nights')
+def fetch_nights(sdb, els, startdate, enddate, workers=4):
+    """Fetch the data for all nights in a date range
+
+       After the night information, the records of the sdb tables and of
+       the els are fetched concurrently by workers threads.
+
+       Parameters
+       ----------
+       sdb: ~mysql.mysql
+           A connection to the sdb database
+       els: ~mysql.mysql
+           A connection to the els database (None to skip the weather)
+       startdate: str
+           First observing date in YYYYMMDD format
+       enddate: str
+           Last observing date in YYYYMMDD format
+       workers: int
+           number of concurrent queries
+
+       Returns
+       -------
+       nights: OrderedDict
+           NightData objects keyed by observing date, sorted by date
+
+    """
+    with tracing.span('fetch.night_info'):
+        nights = fetch_night_info(sdb, startdate, enddate)
+    by_nid = dict((night.nid, night) for night in nights.values())
+    if not nights: return nights
+
+    nids = tuple(by_nid.keys())
+    logic = 'NightInfo_Id in '+_in_list(len(nids))
+    obsdates = list(nights.keys())
+    stime = min(n.stime for n in nights.values())
+    etime = max(n.etime for n in nights.values())
+
+    def fetch_events():
+        return sdb.select('NightInfo_Id, EventType_Id, EventTime', 'SoLogEvent', logic, nids)
+
+    def fetch_pointevents():
+        table = 'PointEvent join SoLogEvent using (SoLogEvent_Id)'
+        return sdb.select('NightInfo_Id, EventTime, Proposal_Code, BlockVisit_Id', table, logic, nids)
+
+    def fetch_blocks():
+        select = 'NightInfo_Id, BlockVisit_Id, Accepted, Proposal_Code, Block_Id, BlockRejectedReason_Id'
+        table = 'Block join BlockVisit using (Block_Id) join Proposal using (Proposal_Id) join ProposalCode using (ProposalCode_Id)'
+        return sdb.select(select, table, logic, nids)
+
+    def fetch_faults():
+        select = 'NightInfo_Id, Fault_id, FaultStart, FaultEnd, TimeLost, SaltSubsystem'
+        table = 'Fault join SaltSubsystem using (SaltSubsystem_Id)'
+        return sdb.select(select, table, logic+' and TimeLost > 0', nids)
+
+    def fetch_files():
+        file_logic, file_params = su.night_files_logic(sdb, obsdates)
+        file_logic += ' order by FileName'
+        select = 'FileName, Proposal_Code, Target_Name, ExposureTime, UTSTART, h.INSTRUME, h.OBSMODE, h.DETMODE, h.CCDTYPE, NExposures, Block_Id'
+        table = 'FileData  Join ProposalCode using (ProposalCode_Id) join FitsHeaderImage as h using (FileData_Id)'
+        images = list(sdb.iter_select(select, table, file_logic, file_params))
+        table = 'FileData join ProposalCode using (ProposalCode_Id)'
+        files = list(sdb.iter_select('FileName, Proposal_Code, INSTRUME, Target_Name', table, file_logic, file_params))
+        return images, files
+
+    def fetch_weather():
+        if els is None: return None
+        return su.get_weather_info(els, stime, etime)
+
+    #the sdb queries and the els query are independent of each other; the
+    #slowest ones are started first
+    weather, (images, files), events, pointevents, blocks, faults = \
+        fetch_concurrently([fetch_weather, fetch_files, fetch_events, fetch_pointevents, fetch_blocks, fetch_faults], workers)
+
+    for r in events:
+        by_nid[r[0]].events.append(r[1:])
+    for r in pointevents:
+        by_nid[r[0]].pointevents.append(r[1:])
+    for r in blocks:
+        by_nid[r[0]].blocks.append(r[1:])
+    for r in faults:
+        by_nid[r[0]].faults.append(r[1:])
+    for r in images:
+        d = file_night(r[0])
+        if d in nights: nights[d].images.append(r)
+    for r in files:
+        d = file_night(r[0])
+        if d in nights: nights[d].files.append(r)
+
+    #split the weather into nights
+    if weather is not None:
+       weather = weather[np.argsort(weather['time'], kind='mergesort')]
+       for night in nights.values():
+           offset = _total_seconds(night.stime-stime)
+           length = _total_seconds(night.etime-night.stime)
+           i = np.searchsorted(weather['time'], offset, side='right')
+           j = np.searchsorted(weather['time'], offset+length, side='left')
+           night.weather = weather[i:j].copy()
+           night.weather['time'] -= offset
+
+    return nights
+
+def fetch_night(sdb, els, obsdate, workers=4):
+    """Fetch the data for a single night
+
+       Parameters
+       ----------
+       sdb: ~mysql.mysql
+           A connection to the sdb database
+       els: ~mysql.mysql
+           A connection to the els database
+       obsdate: str
+           Observing date in YYYYMMDD format
+       workers: int
+           number of concurrent queries
+
+       Returns
+       -------
+       night: NightData
+           the data for the night
+
+    """
+    return fetch_nights(sdb, els, obsdate, obsdate, workers)[obsdate]
+
+def _total_seconds(dt):
+    return dt.days*86400+dt.seconds+dt.microseconds/1e6
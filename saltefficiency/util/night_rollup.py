@@ -0,0 +1,158 @@
+"""
+Local store of per-night aggregates for long-range reports.
+
+For every night the store keeps the time breakdown, the number of accepted
+science blocks and their observing time per priority, and the time lost per
+subsystem, in a SQLite database. Nights are fetched from the sdb once and
+refreshed while they may still be edited, so that the report windows of
+report_queries can be answered from the store without joining the sdb
+tables again.
+"""
+import time
+import sqlite3
+import datetime
+
+import pandas as pd
+
+import saltefficiency.util.report_queries as rq
+
+NIGHT_COLUMNS = ['TimeLostToWeather', 'TimeLostToProblems', 'EngineeringTime', 'ScienceTime', 'OtherTime', 'Night']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nights (Date TEXT PRIMARY KEY, TimeLostToWeather REAL, TimeLostToProblems REAL,
+                                   EngineeringTime REAL, ScienceTime REAL, OtherTime REAL, Night REAL);
+CREATE TABLE IF NOT EXISTS priorities (Date TEXT, Priority INTEGER, Blocks INTEGER, ObsTime REAL,
+                                       PRIMARY KEY (Date, Priority));
+CREATE TABLE IF NOT EXISTS subsystems (Date TEXT, SaltSubsystem TEXT, TimeLost REAL,
+                                       PRIMARY KEY (Date, SaltSubsystem));
+CREATE TABLE IF NOT EXISTS covered (Date TEXT PRIMARY KEY, Updated REAL);
+'''
+
+
+def _dates(start_date, end_date):
+    dates = []
+    d = start_date
+    while d <= end_date:
+        dates.append(d)
+        d += datetime.timedelta(days=1)
+    return dates
+
+
+class NightRollup:
+   """Store of per-night aggregates
+
+      Nights which ended less than recent_days ago may still be edited and
+      are fetched again if they have not been updated within recent_ttl
+      seconds. Older nights are only fetched again after they have been
+      invalidated or refreshed explicitly.
+
+      Parameters
+      ----------
+      path: string
+           path of the SQLite database
+      recent_days: int
+           number of days after which a night is no longer edited
+      recent_ttl: float
+           seconds after which recent nights are fetched again
+
+   """
+
+   def __init__(self, path, recent_days=3, recent_ttl=600):
+       self.path = path
+       self.recent_days = recent_days
+       self.recent_ttl = recent_ttl
+       self.db = sqlite3.connect(path)
+       self.db.executescript(SCHEMA)
+
+   def stale(self, start_date, end_date):
+       """Return the nights from start_date to end_date which have to be
+          fetched from the sdb
+       """
+       updated = dict(self.db.execute('SELECT Date, Updated FROM covered WHERE Date BETWEEN ? AND ?',
+                                      (start_date.isoformat(), end_date.isoformat())).fetchall())
+       recent = datetime.date.today()-datetime.timedelta(days=self.recent_days)
+       now = time.time()
+       stale = []
+       for d in _dates(start_date, end_date):
+           t = updated.get(d.isoformat())
+           if t is None or (d >= recent and t < now-self.recent_ttl):
+              stale.append(d)
+       return stale
+
+   def refresh(self, mysql_con, start_date, end_date):
+       """Fetch the nights from start_date to end_date from the sdb and
+          replace their aggregates
+       """
+       nights = rq.read_nights(mysql_con, start_date, end_date)
+       faults = rq.read_faults(mysql_con, start_date, end_date)
+       blocks = rq.read_blocks(mysql_con, start_date, end_date)
+
+       subsystems = faults.groupby(['Date', 'SaltSubsystem'], as_index=False)['TimeLost'].sum()
+       priorities = blocks.groupby(['Date', 'Priority'], as_index=False)[['Blocks', 'ObsTime']].sum()
+
+       bounds = (start_date.isoformat(), end_date.isoformat())
+       now = time.time()
+       with self.db:
+           for table in ['nights', 'priorities', 'subsystems', 'covered']:
+               self.db.execute('DELETE FROM {} WHERE Date BETWEEN ? AND ?'.format(table), bounds)
+           self.db.executemany('INSERT INTO nights VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               [(r[0].isoformat(),)+tuple(float(t) for t in r[1:])
+                                for r in nights[['Date']+NIGHT_COLUMNS].itertuples(index=False)])
+           self.db.executemany('INSERT INTO priorities VALUES (?, ?, ?, ?)',
+                               [(r[0].isoformat(), int(r[1]), int(r[2]), float(r[3]))
+                                for r in priorities[['Date', 'Priority', 'Blocks', 'ObsTime']].itertuples(index=False)])
+           self.db.executemany('INSERT INTO subsystems VALUES (?, ?, ?)',
+                               [(r[0].isoformat(), r[1], float(r[2]))
+                                for r in subsystems[['Date', 'SaltSubsystem', 'TimeLost']].itertuples(index=False)])
+           self.db.executemany('INSERT INTO covered VALUES (?, ?)',
+                               [(d.isoformat(), now) for d in _dates(start_date, end_date)])
+
+   def update(self, mysql_con, start_date, end_date):
+       """Fetch the stale nights from start_date to end_date
+
+          Every run of consecutive stale nights is fetched with a single set
+          of queries.
+       """
+       stale = self.stale(start_date, end_date)
+       while stale:
+           n = 1
+           while n < len(stale) and (stale[n]-stale[n-1]).days == 1:
+               n += 1
+           self.refresh(mysql_con, stale[0], stale[n-1])
+           stale = stale[n:]
+
+   def invalidate(self, night=None):
+       """Mark a night (a date), or all nights if none is given, to be
+          fetched again
+       """
+       with self.db:
+           if night is None:
+              self.db.execute('DELETE FROM covered')
+           else:
+              self.db.execute('DELETE FROM covered WHERE Date=?', (night.isoformat(),))
+
+   def _read(self, mysql_con, start_date, end_date, select):
+       self.update(mysql_con, start_date, end_date)
+       df = pd.read_sql_query(select, self.db, params=(start_date.isoformat(), end_date.isoformat()))
+       df['Date'] = pd.to_datetime(df['Date']).dt.date
+       return df
+
+   def nights(self, mysql_con, start_date, end_date):
+       """Return the night times as read by report_queries.read_nights"""
+       return self._read(mysql_con, start_date, end_date,
+                         'SELECT Date, {} FROM nights WHERE Date BETWEEN ? AND ? ORDER BY Date'.format(', '.join(NIGHT_COLUMNS)))
+
+   def faults(self, mysql_con, start_date, end_date):
+       """Return the time lost per night and subsystem"""
+       return self._read(mysql_con, start_date, end_date,
+                         'SELECT Date, SaltSubsystem, TimeLost FROM subsystems WHERE Date BETWEEN ? AND ? ORDER BY Date')
+
+   def blocks(self, mysql_con, start_date, end_date):
+       """Return the number of blocks and observing time per night and
+          priority
+       """
+       return self._read(mysql_con, start_date, end_date,
+                         'SELECT Date, Priority, Blocks, ObsTime FROM priorities WHERE Date BETWEEN ? AND ? ORDER BY Date')
+
+   def close(self):
+       self.db.close()
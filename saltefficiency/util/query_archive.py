@@ -0,0 +1,105 @@
+"""
+Archive of query results for replaying the queries of the pipelines offline.
+
+In record mode the results of all queries executed through mysql.mysql and
+report_queries are stored in the archive, an SQLite file with one
+compressed pickle per query. In replay mode the results are served from the
+archive without connecting to the databases, and statements which would
+modify the databases are skipped. For example, the queries of a night are
+recorded with
+
+    archive = QueryArchive('night_20160331.archive', 'record')
+    mysql.query_archive = archive
+    report_queries.query_archive = archive
+    night_summary_page('20160331', sdb, els)
+
+and replayed by opening the archive in 'replay' mode instead.
+
+Queries are keyed by their SQL with normalized white space and their
+parameters, so that the same calls have to be made for replaying. Stores
+which decide on their queries from local state (such as a FileIndex or
+WeatherCache) should be in the same state, or not used, for recording and
+replaying.
+"""
+import re
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queries (Query_Id TEXT PRIMARY KEY, Statement TEXT, Params TEXT, Result BLOB);
+'''
+
+MODES = ('record', 'replay')
+
+
+def normalize(sql):
+    """Return the SQL with white space collapsed and trimmed"""
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+def query_id(sql, params=None):
+    """Return the key of a query with parameters"""
+    return hashlib.sha1(normalize(sql)+'\0'+repr(params)).hexdigest()
+
+
+class QueryNotArchived(LookupError):
+   """Raised if a query to be replayed is not in the archive"""
+   pass
+
+
+class QueryArchive:
+   """Store of query results
+
+      Parameters
+      ----------
+      path: string
+           path of the SQLite file
+      mode: string
+           'record' to store the results of executed queries or 'replay' to
+           serve queries from the archive
+
+   """
+
+   def __init__(self, path, mode='replay'):
+       if mode not in MODES:
+          raise ValueError('The mode must be one of {0}'.format(', '.join(MODES)))
+       self.path = path
+       self.mode = mode
+       # the archive is used by the threads fetching the data of a night
+       self.db = sqlite3.connect(path, check_same_thread=False)
+       self.db.executescript(SCHEMA)
+       self._lock = threading.RLock()
+
+   @property
+   def replaying(self):
+       return self.mode == 'replay'
+
+   def record(self, sql, params, result):
+       """Store the result of a query"""
+       if self.replaying: return
+       blob = zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+       with self._lock:
+           with self.db:
+               self.db.execute('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)',
+                               (query_id(sql, params), normalize(sql), repr(params), sqlite3.Binary(blob)))
+
+   def replay(self, sql, params=None):
+       """Return the stored result of a query
+
+          A QueryNotArchived error is raised if the query has not been
+          recorded.
+       """
+       with self._lock:
+           row = self.db.execute('SELECT Result FROM queries WHERE Query_Id=?', (query_id(sql, params),)).fetchone()
+       if row is None:
+          raise QueryNotArchived('Query not in the archive: {0} {1!r}'.format(normalize(sql), params))
+       return pickle.loads(zlib.decompress(bytes(row[0])))
+
+   def __len__(self):
+       with self._lock:
+           return self.db.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+   def close(self):
+       self.db.close()
@@ -0,0 +1,130 @@
+"""
+Cache for the results of the report queries.
+
+Results are keyed by the query and the date range it covers. They are kept
+in memory with a least-recently-used bound and a time to live, which is
+longer for date ranges entirely in the past. An optional directory allows
+separate processes (such as cron jobs) to share the cached results. The
+database the results are read from is part of every key, so that the caches
+of different databases can share a directory.
+"""
+import os
+import copy
+import time
+import pickle
+import hashlib
+import datetime
+from collections import OrderedDict
+
+
+class QueryCache:
+   """A size-bounded cache of query results with a time to live
+
+      Every entry records the first and last night it covers, so that the
+      entries depending on a night can be invalidated when the night is
+      edited.
+
+      Parameters
+      ----------
+      maxsize: int
+           maximum number of results kept in memory
+      ttl: float
+           seconds for which results covering recent nights are valid
+      past_ttl: float
+           seconds for which results covering only nights that ended before
+           the current day are valid
+      directory: string
+           directory in which the results are shared between processes
+           (None to keep them in memory only)
+      database: string
+           identity of the database the results are read from, such as
+           'host/dbname'
+
+   """
+
+   def __init__(self, maxsize=128, ttl=600, past_ttl=7*86400, directory=None, database=None):
+       self.database = database
+       self.maxsize = maxsize
+       self.ttl = ttl
+       self.past_ttl = past_ttl
+       self.directory = directory
+       if directory is not None and not os.path.isdir(directory):
+          os.makedirs(directory)
+       self._entries = OrderedDict()
+       self.hits = 0
+       self.misses = 0
+
+   def _path(self, key):
+       return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()+'.pkl')
+
+   def _expiry(self, last_night):
+       """Return the expiry time of a result covering nights up to last_night"""
+       # nights are still edited on the day after they have ended
+       if last_night < datetime.date.today()-datetime.timedelta(days=1):
+          return time.time()+self.past_ttl
+       return time.time()+self.ttl
+
+   def get(self, key):
+       """Return a copy of the cached result for the key, or None"""
+       key = (self.database, key)
+       entry = self._entries.pop(key, None)
+       if self.directory is not None:
+          # the result may have been invalidated by another process
+          path = self._path(key)
+          if not os.path.exists(path):
+             entry = None
+          elif entry is None:
+             try:
+                 with open(path, 'rb') as f:
+                     entry = pickle.load(f)
+             except (IOError, EOFError, pickle.UnpicklingError):
+                 entry = None
+       if entry is None or entry[0] < time.time():
+          self.misses += 1
+          return None
+       self._store(key, entry)
+       self.hits += 1
+       return copy.deepcopy(entry[3])
+
+   def set(self, key, first_night, last_night, value):
+       """Cache the result for the key, which covers the nights from
+          first_night to last_night
+       """
+       key = (self.database, key)
+       entry = (self._expiry(last_night), first_night, last_night, copy.deepcopy(value))
+       self._store(key, entry)
+       if self.directory is not None:
+          path = self._path(key)
+          tmp = path+'.%d.tmp' % os.getpid()
+          with open(tmp, 'wb') as f:
+              pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+          os.rename(tmp, path)
+
+   def _store(self, key, entry):
+       self._entries[key] = entry
+       while len(self._entries) > self.maxsize:
+           self._entries.popitem(last=False)
+
+   def invalidate(self, night=None):
+       """Remove the results covering a night (a date), or all results if
+          no night is given
+       """
+       def covers(entry):
+           return night is None or entry[1] <= night <= entry[2]
+
+       for key in [k for k, e in self._entries.items() if covers(e)]:
+           del self._entries[key]
+       if self.directory is not None:
+          for name in os.listdir(self.directory):
+              if not name.endswith('.pkl'): continue
+              path = os.path.join(self.directory, name)
+              try:
+                  with open(path, 'rb') as f:
+                      entry = pickle.load(f)
+              except (IOError, EOFError, pickle.UnpicklingError):
+                  entry = None
+              if entry is None or covers(entry):
+                 try:
+                     os.remove(path)
+                 except OSError:
+                     pass
@@ -6,36 +6,152 @@ Created on Thu Mar 12 14:25:11 2015
 
 This script contains the queries to create the weekly report and the plots.
 
+The weekly breakdowns are derived from a ReportWindow, which fetches the raw
+NightInfo, Fault and BlockVisit rows of the report window once. The module
+level functions create a window for a single breakdown.
+
+The breakdowns are cached if query_cache is set to a QueryCache, for example
+with
+
+    rq.query_cache = QueryCache(directory='/tmp/report_cache', database='sdb.cape.saao.ac.za/sdb')
+
+The database is part of the cache keys, so that the cached breakdowns of the
+sdb and of another database (such as a test database) are kept apart. It has
+to be given whenever the cache directory is used for more than one database.
+
+Cached breakdowns including an edited night are removed with
+invalidate_night.
+
+Long windows can be read from a local store of per-night aggregates by
+setting night_rollup to a NightRollup.
+
+The results of the queries are recorded in or replayed from a QueryArchive
+if query_archive is set to one.
+
 """
 
 import pandas as pd
 import pandas.io.sql as psql
 import matplotlib.pyplot as pl
 import numpy as np
-from datetime import date
+import time
+import Queue
+from datetime import date, datetime, timedelta
+from functools import wraps
+from multiprocessing.pool import ThreadPool
 
+# cache for the breakdowns (a query_cache.QueryCache), used if not None
+query_cache = None
 
-def date_range(mysql_con, date, interval=7):
+# store of per-night aggregates (a night_rollup.NightRollup), from which the
+# report windows are read if not None
+night_rollup = None
+
+# archive recording or replaying the query results (a
+# query_archive.QueryArchive), if not None
+query_archive = None
+
+
+def _to_date(d):
     '''
-    returns the dates for NOW() and 7 days ago. This is used to writing the
-    report heading and building the filename
+    convert a date given as a date, datetime or YYYY-MM-DD string to a date
     '''
+    if isinstance(d, datetime):
+        return d.date()
+    if isinstance(d, date):
+        return d
+    return datetime.strptime(str(d), '%Y-%m-%d').date()
 
-    dr = pd.read_sql_query('''SELECT DATE_SUB(DATE('{}'), INTERVAL {} DAY) as StartDate,
-    DATE_SUB(DATE('{}'), INTERVAL 1 DAY) as  EndDate;
-    '''.format(date, interval, date), con=mysql_con)
+def _sec_to_time(t):
+    '''
+    convert seconds to a timedelta, as returned by SEC_TO_TIME
+    '''
+    return timedelta(seconds=int(t))
 
-    return dr
+def _cached(breakdown):
+    '''
+    cache the result of a ReportWindow breakdown in query_cache, keyed by the
+    breakdown name and the window (and the database of the cache)
+    '''
+    @wraps(breakdown)
+    def wrapper(self):
+        if query_cache is None:
+            return breakdown(self)
+        key = (breakdown.__name__, self.date, self.interval)
+        result = query_cache.get(key)
+        if result is None:
+            result = breakdown(self)
+            query_cache.set(key, self.start_date, self.end_date, result)
+        return result
+    return wrapper
+
+def invalidate_night(night):
+    '''
+    remove the cached breakdowns and the rolled up aggregates which include a
+    night, for example after the night has been edited
+    '''
+    if query_cache is not None:
+        query_cache.invalidate(_to_date(night))
+    if night_rollup is not None:
+        night_rollup.invalidate(_to_date(night))
 
 
-def weekly_priority_breakdown(mysql_con, date, interval=7):
+def read_sql_query(sql, con, **kwargs):
     '''
-    this function returns the priority breakdown in terms of no. of blocks
-    observed and total time spent per priority for the last week.
+    run a query with pd.read_sql_query, recording its result in or replaying
+    it from the query_archive
     '''
-
-    wpb = pd.read_sql_query('''SELECT Priority, COUNT(*) as "No. Blocks",
-    sum(ObsTime) as "Tsec"
+    if query_archive is None:
+        return pd.read_sql_query(sql, con=con, **kwargs)
+    key = (sql, sorted(kwargs.items()))
+    if query_archive.replaying:
+        return query_archive.replay(*key)
+    df = pd.read_sql_query(sql, con=con, **kwargs)
+    query_archive.record(key[0], key[1], df)
+    return df
+
+def _date_logic(start_date, end_date):
+    return "Date BETWEEN '{}' AND '{}'".format(start_date.strftime('%Y-%m-%d'),
+                                               end_date.strftime('%Y-%m-%d'))
+
+def read_nights(mysql_con, start_date, end_date):
+    '''
+    returns the NightInfo rows from start_date to end_date, with the times in
+    seconds and missing times set to 0
+    '''
+    nights = read_sql_query('''SELECT Date, EveningTwilightEnd, MorningTwilightStart,
+    TimeLostToWeather, TimeLostToProblems, EngineeringTime, ScienceTime, OtherTime
+    FROM NightInfo
+    WHERE {} ORDER BY Date;
+    '''.format(_date_logic(start_date, end_date)), con=mysql_con)
+    nights['Date'] = pd.to_datetime(nights['Date']).dt.date
+    for c in ['TimeLostToWeather', 'TimeLostToProblems', 'EngineeringTime', 'ScienceTime', 'OtherTime']:
+        nights[c] = nights[c].fillna(0).astype(float)
+    night = pd.to_datetime(nights['MorningTwilightStart']) - pd.to_datetime(nights['EveningTwilightEnd'])
+    #whole seconds, as total_seconds adds rounding noise
+    nights['Night'] = (night.dt.days*86400 + night.dt.seconds).astype(float)
+    return nights
+
+def read_faults(mysql_con, start_date, end_date):
+    '''
+    returns the Fault rows from start_date to end_date with the time lost
+    '''
+    faults = read_sql_query('''SELECT Date, SaltSubsystem, TimeLost
+    FROM Fault JOIN NightInfo USING (NightInfo_Id)
+    JOIN SaltSubsystem USING (SaltSubsystem_Id)
+    WHERE Fault.Deleted=0 AND TimeLost IS NOT NULL
+    AND {};
+    '''.format(_date_logic(start_date, end_date)), con=mysql_con)
+    faults['Date'] = pd.to_datetime(faults['Date']).dt.date
+    faults['TimeLost'] = faults['TimeLost'].astype(float)
+    return faults
+
+def read_blocks(mysql_con, start_date, end_date):
+    '''
+    returns the accepted science BlockVisit rows from start_date to end_date
+    with the priority and observing time
+    '''
+    blocks = read_sql_query('''SELECT Date, Priority, ObsTime
     FROM Block
     JOIN BlockVisit USING (Block_Id)
     JOIN BlockVisitStatus USING (BlockVisitStatus_Id)
@@ -43,25 +159,299 @@ def weekly_priority_breakdown(mysql_con, date, interval=7):
     JOIN Proposal ON (Block.Proposal_Id=Proposal.Proposal_Id)
     JOIN ProposalGeneralInfo ON (Proposal.ProposalCode_Id=ProposalGeneralInfo.ProposalCode_Id)
     JOIN ProposalType USING (ProposalType_Id)
-    WHERE Date BETWEEN DATE_SUB(DATE('{}'), INTERVAL {} DAY)
-    AND DATE_SUB(DATE('{}'), INTERVAL 1 DAY)
+    WHERE {}
     AND ProposalType.ProposalType NOT IN ('Commissioning', 'Engineering')
-    AND BlockVisitStatus.BlockVisitStatus='Accepted' GROUP BY Priority;
-    '''.format(date, interval, date), mysql_con)
+    AND BlockVisitStatus.BlockVisitStatus='Accepted';
+    '''.format(_date_logic(start_date, end_date)), con=mysql_con)
+    blocks['Date'] = pd.to_datetime(blocks['Date']).dt.date
+    blocks['Blocks'] = 1
+    blocks['ObsTime'] = blocks['ObsTime'].astype(float)
+    return blocks[['Date', 'Priority', 'Blocks', 'ObsTime']]
+
+
+
+class ReportWindow:
+    '''
+    the raw rows for the nights of a report, from which all the weekly
+    breakdowns are derived.
+
+    The window covers the nights from date - interval days to the day before
+    date. Each of the NightInfo, Fault and accepted BlockVisit rows are
+    queried once, when a breakdown first needs them. The queries only use
+    plain SQL, so that any database connection supported by Pandas can be
+    used.
+
+    Parameters
+    ----------
+    mysql_con: SQLAlchemy engine or database connection
+        connection to the sdb
+    date: date or string
+        date in YYYY-MM-DD format when the last night ends
+    interval: int
+        number of nights in the window
+    '''
+
+    def __init__(self, mysql_con, date, interval=7):
+        self.mysql_con = mysql_con
+        self.date = _to_date(date)
+        self.interval = int(interval)
+        self.start_date = self.date - timedelta(days=self.interval)
+        self.end_date = self.date - timedelta(days=1)
+        self._nights = None
+        self._faults = None
+        self._blocks = None
+
+    @property
+    def nights(self):
+        '''
+        NightInfo rows of the window, with the times in seconds and missing
+        times set to 0
+        '''
+        if self._nights is None:
+            if night_rollup is not None:
+                self._nights = night_rollup.nights(self.mysql_con, self.start_date, self.end_date)
+            else:
+                self._nights = read_nights(self.mysql_con, self.start_date, self.end_date)
+        return self._nights
+
+    @property
+    def faults(self):
+        '''
+        Fault rows of the window with the time lost
+        '''
+        if self._faults is None:
+            if night_rollup is not None:
+                self._faults = night_rollup.faults(self.mysql_con, self.start_date, self.end_date)
+            else:
+                self._faults = read_faults(self.mysql_con, self.start_date, self.end_date)
+        return self._faults
+
+    @property
+    def blocks(self):
+        '''
+        accepted science BlockVisit rows of the window with the priority,
+        number of blocks and observing time
+        '''
+        if self._blocks is None:
+            if night_rollup is not None:
+                self._blocks = night_rollup.blocks(self.mysql_con, self.start_date, self.end_date)
+            else:
+                self._blocks = read_blocks(self.mysql_con, self.start_date, self.end_date)
+        return self._blocks
+
+    def _unallocated(self, nights):
+        return nights['Night'] - nights['TimeLostToWeather'] - nights['TimeLostToProblems'] \
+               - nights['EngineeringTime'] - nights['ScienceTime'] - nights['OtherTime']
+
+    def date_range(self):
+        '''
+        returns the first and last night of the window
+        '''
+        return pd.DataFrame({'StartDate': [datetime.combine(self.start_date, datetime.min.time())],
+                             'EndDate': [datetime.combine(self.end_date, datetime.min.time())]},
+                            columns=['StartDate', 'EndDate'])
+
+    @_cached
+    def weekly_priority_breakdown(self):
+        '''
+        returns the number of blocks observed and the total time spent per
+        priority
+        '''
+        blocks = self.blocks
+        wpb = pd.DataFrame({'Priority': blocks['Priority'],
+                            'No. Blocks': blocks['Blocks'],
+                            'Tsec': blocks['ObsTime']})
+        wpb = wpb.groupby('Priority', as_index=False).sum()
+        return wpb[['Priority', 'No. Blocks', 'Tsec']]
+
+    @_cached
+    def weekly_time_breakdown(self):
+        '''
+        returns the time breakdown per night, both as times and in hours
+        '''
+        nights = self.nights
+        unallocated = self._unallocated(nights)
+        wtb = pd.DataFrame({'Date': nights['Date']})
+        for c in ['TimeLostToWeather', 'TimeLostToProblems', 'EngineeringTime', 'ScienceTime', 'OtherTime']:
+            wtb[c] = nights[c].map(_sec_to_time)
+        wtb['UnallocatedTime'] = unallocated.map(_sec_to_time)
+        wtb['NightLength'] = nights['Night'].map(_sec_to_time)
+        for c, n in [('Weather', 'TimeLostToWeather'), ('Problems', 'TimeLostToProblems'),
+                     ('Engineering', 'EngineeringTime'), ('Science', 'ScienceTime'),
+                     ('Other', 'OtherTime')]:
+            wtb[c] = nights[n] / 3600.
+        wtb['Unallocated'] = unallocated / 3600.
+        wtb['Night'] = nights['Night']
+        return wtb
+
+    @_cached
+    def weekly_total_time_breakdown(self):
+        '''
+        returns the total time breakdown in seconds, followed by the totals
+        as times
+        '''
+        nights = self.nights
+        totals = [('Weather', nights['TimeLostToWeather'].sum()),
+                  ('Problems', nights['TimeLostToProblems'].sum()),
+                  ('Engineering', nights['EngineeringTime'].sum()),
+                  ('Science', nights['ScienceTime'].sum()),
+                  ('Other', nights['OtherTime'].sum()),
+                  ('Unallocated', self._unallocated(nights).sum()),
+                  ('Total', nights['Night'].sum())]
+        dr = self.date_range()
+        columns = ['StartDate', 'EndDate'] + [c for c, _ in totals]
+        wttb = dr.copy()
+        for c, t in totals:
+            wttb[c] = [t]
+        for c, n in [('TimeLostToWeather', 'Weather'), ('TimeLostToProblems', 'Problems'),
+                     ('EngineeringTime', 'Engineering'), ('ScienceTime', 'Science'),
+                     ('NightLength', 'Total')]:
+            wttb[c] = [_sec_to_time(wttb[n][0])]
+            columns.append(c)
+        return wttb[columns]
+
+    @_cached
+    def weekly_subsystem_breakdown(self):
+        '''
+        returns the time lost to problems per subsystem
+        '''
+        wsb = self.faults.groupby('SaltSubsystem', as_index=False)['TimeLost'].sum()
+        wsb.columns = ['SaltSubsystem', 'Time']
+        wsb['TotalTime'] = wsb['Time'].map(_sec_to_time)
+        return wsb
+
+    @_cached
+    def weekly_subsystem_breakdown_total(self):
+        '''
+        returns the total time lost to problems
+        '''
+        faults = self.faults
+        if len(faults):
+            return pd.DataFrame({'SaltSubsystem': [faults['SaltSubsystem'].iloc[0]],
+                                 'Time': [faults['TimeLost'].sum()]},
+                                columns=['SaltSubsystem', 'Time'])
+        return pd.DataFrame({'SaltSubsystem': [None], 'Time': [None]},
+                            columns=['SaltSubsystem', 'Time'])
+
+
+def report_window(mysql_con, date, interval=7):
+    '''
+    returns a ReportWindow for the date and interval. If a ReportWindow is
+    passed instead of a connection, it is returned unchanged.
+    '''
+    if isinstance(mysql_con, ReportWindow):
+        if mysql_con.date != _to_date(date) or mysql_con.interval != int(interval):
+            raise ValueError('The report window does not cover the requested nights')
+        return mysql_con
+    return ReportWindow(mysql_con, date, interval)
+
+# breakdowns in the bundle returned by fetch_report
+REPORT_BREAKDOWNS = ['date_range', 'weekly_priority_breakdown', 'weekly_time_breakdown',
+                     'weekly_total_time_breakdown', 'weekly_subsystem_breakdown',
+                     'weekly_subsystem_breakdown_total']
+
+def fetch_report(connect, date, interval=7, workers=3):
+    '''
+    returns all the breakdowns of a report window in a single bundle.
+
+    The NightInfo, Fault and BlockVisit rows of the window are queried
+    concurrently by up to workers threads, each using its own connection
+    from connect. The time taken by every query and breakdown is recorded.
+
+    Parameters
+    ----------
+    connect: function
+        function returning a new database connection supported by Pandas
+    date: date or string
+        date in YYYY-MM-DD format when the last night ends
+    interval: int
+        number of nights in the window
+    workers: int
+        maximum number of concurrent queries
+
+    Returns
+    -------
+    bundle: dict
+        the breakdowns keyed by the names of the report_queries functions,
+        the ReportWindow as 'window' and the run times in seconds as
+        'timings'
+    '''
+    timings = {}
+    connections = Queue.Queue()
+    opened = []
+
+    def timed(name, f, *args):
+        start = time.time()
+        result = f(*args)
+        timings[name] = time.time() - start
+        return result
+
+    def query(name, read):
+        try:
+            con = connections.get_nowait()
+        except Queue.Empty:
+            con = connect()
+            opened.append(con)
+        try:
+            return timed(name, read, con, window.start_date, window.end_date)
+        finally:
+            connections.put(con)
+
+    window = ReportWindow(None, date, interval)
+    try:
+        if night_rollup is None:
+            reads = [('nights', read_nights), ('faults', read_faults), ('blocks', read_blocks)]
+            pool = ThreadPool(max(1, min(workers, len(reads))))
+            try:
+                rows = pool.map(lambda r: query(*r), reads)
+            finally:
+                pool.close()
+                pool.join()
+            window._nights, window._faults, window._blocks = rows
+        else:
+            # the rollup store is read from this thread only
+            window.mysql_con = connect()
+            opened.append(window.mysql_con)
+
+        bundle = {'window': window, 'timings': timings}
+        for name in REPORT_BREAKDOWNS:
+            bundle[name] = timed(name, getattr(window, name))
+    finally:
+        for con in opened:
+            con.close()
+    return bundle
+
+
+
+def date_range(mysql_con, date, interval=7):
+    '''
+    returns the dates for NOW() and 7 days ago. This is used to writing the
+    report heading and building the filename
+    '''
+
+    return report_window(mysql_con, date, interval).date_range()
+
+
+def weekly_priority_breakdown(mysql_con, date, interval=7):
+    '''
+    this function returns the priority breakdown in terms of no. of blocks
+    observed and total time spent per priority for the last week.
+    '''
+
+    return report_window(mysql_con, date, interval).weekly_priority_breakdown()
 
-    return wpb
 
 def lastnight_time_breakdown(mysql_con, date, interval=7):
     '''
     this function returns the time breakdown for last night's observations
     '''
 
-    ltb = pd.read_sql_query('''SELECT Date,
+    ltb = read_sql_query('''SELECT Date,
     IFNULL(SUM(TimeLostToWeather), 0) `Weather`,
     IFNULL(SUM(TimeLostToProblems), 0) `Problems`,
     IFNULL(SUM(EngineeringTime), 0) `Engineering`,
     IFNULL(SUM(ScienceTime), 0) `Science`,
-    IFNULL(SUM(OtherTime), 0), `Other`,
+    IFNULL(SUM(OtherTime), 0) `Other`,
     SUM(
         TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)
         - IFNULL(TimeLostToWeather, 0)
@@ -84,41 +474,8 @@ def weekly_time_breakdown(mysql_con, date, interval=7):
     this function returns the time breakdown for the past week'ss observations
     per night.
     '''
-    wtb = pd.read_sql_query('''SELECT Date,
-    IFNULL(SEC_TO_TIME(TimeLostToWeather), 0) `TimeLostToWeather`,
-    IFNULL(SEC_TO_TIME(TimeLostToProblems), 0) `TimeLostToProblems`,
-    IFNULL(SEC_TO_TIME(EngineeringTime), 0) `EngineeringTime`,
-    IFNULL(SEC_TO_TIME(ScienceTime), 0) `ScienceTime`,
-    IFNULL(SEC_TO_TIME(OtherTime), 0) `OtherTime`,
-    SEC_TO_TIME(
-        TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)
-        - IFNULL(TimeLostToWeather, 0)
-        - IFNULL(TimeLostToProblems, 0)
-        - IFNULL(EngineeringTime, 0)
-        - IFNULL(ScienceTime, 0)
-        - IFNULL(OtherTime, 0)
-    ) `UnallocatedTime`,
-    SEC_TO_TIME(TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)) as NightLength,
-    IFNULL(TimeLostToWeather / 3600, 0) `Weather`,
-    IFNULL(TimeLostToProblems/ 3600, 0) `Problems`,
-    IFNULL(EngineeringTime / 3600, 0) `Engineering`,
-    IFNULL(ScienceTime / 3600, 0) `Science`,
-    IFNULL(OtherTime / 3600, 0) `Other`,
-    (
-        TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)
-        - IFNULL(TimeLostToWeather, 0)
-        - IFNULL(TimeLostToProblems, 0)
-        - IFNULL(EngineeringTime, 0)
-        - IFNULL(ScienceTime, 0)
-        - IFNULL(OtherTime, 0)
-    ) / 3600 `Unallocated`,
-    TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart) as Night
-    FROM NightInfo
-    WHERE Date BETWEEN DATE_SUB(DATE('{}'), INTERVAL {} DAY)
-    AND DATE_SUB(DATE('{}'), INTERVAL 1 DAY);
-    '''.format(date, interval, date), con=mysql_con)
 
-    return wtb
+    return report_window(mysql_con, date, interval).weekly_time_breakdown()
 
 
 def weekly_total_time_breakdown(mysql_con, date, interval=7):
@@ -127,35 +484,15 @@ def weekly_total_time_breakdown(mysql_con, date, interval=7):
     observations.
     '''
 
-    wttb = pd.read_sql_query('''SELECT DATE_SUB(DATE(NOW()), INTERVAL 7 DAY) as StartDate,
-    DATE_SUB(DATE(NOW()), INTERVAL 1 DAY) as  EndDate,
-    IFNULL(SUM(TimeLostToWeather), 0) `Weather`,
-    IFNULL(SUM(TimeLostToProblems), 0) `Problems`,
-    IFNULL(SUM(EngineeringTime), 0) `Engineering`,
-    IFNULL(SUM(ScienceTime), 0) `Science`,
-    IFNULL(SUM(OtherTime), 0) `Other`,
-    SUM(
-        TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)
-        - IFNULL(TimeLostToWeather, 0)
-        - IFNULL(TimeLostToProblems, 0)
-        - IFNULL(EngineeringTime, 0)
-        - IFNULL(ScienceTime, 0)
-        - IFNULL(OtherTime, 0)
-    ) `Unallocated`,
-    SUM(TIMESTAMPDIFF(SECOND,  EveningTwilightEnd, MorningTwilightStart)) as Total
-    FROM NightInfo
-    WHERE Date BETWEEN DATE_SUB(DATE('{}'), INTERVAL {} DAY)
-    AND DATE_SUB(DATE('{}'), INTERVAL 1 DAY);
-    '''.format(date, interval, date), con=mysql_con)
+    return report_window(mysql_con, date, interval).weekly_total_time_breakdown()
 
-    return wttb
 
 def lastnight_subsystem_breakdown(mysql_con, date, interval=7):
     '''
     this function returns the subsystem time breakdown for problems last night
     '''
 
-    lsb = pd.read_sql_query('''SELECT SaltSubsystem,
+    lsb = read_sql_query('''SELECT SaltSubsystem,
     SEC_TO_TIME(SUM(TimeLost)) as "TimeLost",
     SUM(TimeLost) as "Time"
     FROM Fault JOIN NightInfo USING (NightInfo_Id) JOIN SaltSubsystem USING (SaltSubsystem_Id)
@@ -173,17 +510,8 @@ def weekly_subsystem_breakdown(mysql_con, date, interval=7):
     during the past week's observations.
     '''
 
+    return report_window(mysql_con, date, interval).weekly_subsystem_breakdown()
 
-    wsb = pd.read_sql_query('''SELECT SaltSubsystem,
-    SUM(TimeLost) as "Time"
-    FROM Fault JOIN NightInfo USING (NightInfo_Id)
-    JOIN SaltSubsystem USING (SaltSubsystem_Id)
-    WHERE Fault.Deleted=0 AND Timelost IS NOT NULL
-    AND Date BETWEEN DATE_SUB(DATE('{}'), INTERVAL {} DAY)
-    AND DATE_SUB(DATE('{}'), INTERVAL 1 DAY) GROUP BY SaltSubsystem;
-    '''.format(date, interval, date), con=mysql_con)
-
-    return wsb
 
 def weekly_subsystem_breakdown_total(mysql_con, date, interval=7):
     '''
@@ -191,14 +519,4 @@ def weekly_subsystem_breakdown_total(mysql_con, date, interval=7):
     during the past week's observations.
     '''
 
-    wsbt = pd.read_sql_query('''SELECT SaltSubsystem,
-    SUM(TimeLost) as "Time"
-    FROM Fault JOIN NightInfo USING (NightInfo_Id)
-    JOIN SaltSubsystem USING (SaltSubsystem_Id)
-    WHERE Fault.Deleted = 0 AND Timelost IS NOT NULL
-    AND Date BETWEEN DATE_SUB(DATE('{}'), INTERVAL {} DAY)
-    AND DATE_SUB(DATE('{}'), INTERVAL 1 DAY);
-    '''.format(date, interval, date), con=mysql_con)
-
-    return wsbt
-
+    return report_window(mysql_con, date, interval).weekly_subsystem_breakdown_total()
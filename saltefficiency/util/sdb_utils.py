@@ -6,6 +6,8 @@ import struct
 import datetime
 import time
 
+import tracing
+
 def getnightinfo(sdb, obsdate):
     """Get the NightInfo_Id for an observing date
 
@@ -19,64 +21,161 @@ def getnightinfo(sdb, obsdate):
 
     """
 
-    return sdb.select('NightInfo_Id', 'NightInfo', 'Date=%s' % obsdate)[0][0]
+    return sdb.select('NightInfo_Id', 'NightInfo', 'Date=%s', (obsdate,))[0][0]
+
+# local index of the data files of each night (a file_index.FileIndex) used
+# by night_files_logic
+file_index = None
+
+def night_files_logic(sdb, obsdates):
+    """Return the logic selecting the FileData rows of the data files taken
+    in the given nights
+
+    If the module's file_index is set, it is updated and the files are
+    selected by their FileData_Id. Otherwise they are selected by matching
+    their FileName, which requires a scan of the FileData table.
+
+    Parameters
+    ----------
+    sdb: ~mysql.mysql
+       A connection to the sdb database
+
+    obsdates: list
+       Observing dates in YYYYMMDD format
+
+    Returns
+    -------
+    logic: str
+       Logic for selecting from a table joined with FileData
+
+    params: tuple
+       Values for the %s placeholders in the logic
+
+    """
+    obsdates = list(obsdates)
+    if file_index is not None:
+       file_index.update(sdb)
+       ids = tuple(sorted(file_index.file_ids(obsdates).keys()))
+       if not ids: return '0=1', ()
+       return 'FileData_Id in ('+', '.join(['%s']*len(ids))+')', ids
+    if not obsdates: return '0=1', ()
+    return '('+' or '.join(['FileName like %s']*len(obsdates))+')', tuple('%'+d+'%' for d in obsdates)
+
+# fields of the weather records returned by get_weather_info
+WEATHER_FIELDS = ['time', 'air_pressure', 'dewpoint', 'rel_humidity', 'wind_mag_30m', 'wind_dir_30m',
+                  'wind_mag_10m', 'wind_dir_10m', 'rain_detected', 't02', 't05', 't10', 't15', 't20',
+                  't25', 't30']
+WEATHER_DTYPE = [(f, bool if f == 'rain_detected' else float) for f in WEATHER_FIELDS]
+
+# columns and table of the weather records in the els
+WEATHER_SELECT = 'timestamp, air_pressure, dewpoint, rel_humidity, wind_mag_30m, wind_dir_30m, wind_mag_10m, wind_dir_10m, temperatures, rain_detected'
+WEATHER_TABLE = 'bms_external_conditions'
+
+# offset between the els timestamps and Unix time
+ELS_OFFSET = 2082852000-7200
+
+# default store of weather records used by get_weather_info
+weather_cache = None
 
-def get_weather_info(els, stime, etime):
-   """Get the weather status from the start time to the endtime"""
+def els_time(t):
+   """Convert a date time (SAST) to the time format of the els"""
+   return time.mktime(t.timetuple())+ELS_OFFSET
+
+@tracing.traced('get_weather_info')
+def get_weather_info(els, stime, etime, chunk_size=10000, cache=None):
+   """Get the weather status from the start time to the endtime
+
+      The weather records are streamed from the els and decoded in chunks
+      of chunk_size records. If a weather cache is given (or set as the
+      module's weather_cache), the records missing from the cache are
+      fetched into it and the records are read from the cache.
+
+      Parameters
+      ----------
+      els: ~mysql.mysql
+         A connection to the els database
+      stime: datetime
+         Start time
+      etime: datetime
+         End time
+      chunk_size: int
+         Number of records to decode at a time
+      cache: ~weather_cache.WeatherCache
+         Local store of weather records
+
+      Returns
+      -------
+      weather: numpy.ndarray
+         Structured array with the fields listed in WEATHER_FIELDS. The
+         time is given in seconds since the start time, and the fields
+         t02 to t30 are the temperatures at the various heights.
+
+   """
 
    #convert times to ELS time format
-   stime=time.mktime(stime.timetuple())+2082852000-7200
-   etime=time.mktime(etime.timetuple())+2082852000-7200
+   stime=els_time(stime)
+   etime=els_time(etime)
+
+   #read from the local store if there is one
+   if cache is None: cache=weather_cache
+   if cache is not None:
+      cache.sync(els, int(stime), int(etime), chunk_size=chunk_size)
+      weather=cache.read(int(stime), int(etime))
+      weather['time']-=stime
+      return weather
 
    #now extact weather information from the els
-   sel_cmd='timestamp, air_pressure, dewpoint, rel_humidity, wind_mag_30m, wind_dir_30m, wind_mag_10m, wind_dir_10m, temperatures, rain_detected'
-   tab_cmd='bms_external_conditions'
-   log_cmd="timestamp>%i and timestamp<%i" % (stime, etime)
-   wea_rec=els.select(sel_cmd, tab_cmd, log_cmd)
-
-   time_list=np.zeros(len(wea_rec))
-   air_arr=np.zeros(len(wea_rec))
-   dew_arr=np.zeros(len(wea_rec))
-   hum_arr=np.zeros(len(wea_rec))
-   w30_arr=np.zeros(len(wea_rec))
-   w30d_arr=np.zeros(len(wea_rec))
-   w10_arr=np.zeros(len(wea_rec))
-   w10d_arr=np.zeros(len(wea_rec))
-   rain_list=[]
-   t02_arr=np.zeros(len(wea_rec))
-   t05_arr=np.zeros(len(wea_rec))
-   t10_arr=np.zeros(len(wea_rec))
-   t15_arr=np.zeros(len(wea_rec))
-   t20_arr=np.zeros(len(wea_rec))
-   t25_arr=np.zeros(len(wea_rec))
-   t30_arr=np.zeros(len(wea_rec))
-
-   for i in range(len(wea_rec)):
-       time_list[i]=wea_rec[i][0]-stime
-       air_arr[i]=wea_rec[i][1]
-       dew_arr[i]=wea_rec[i][2]
-       hum_arr[i]=wea_rec[i][3]
-       w30_arr[i]=wea_rec[i][4]
-       w30d_arr[i]=wea_rec[i][5]
-       w10_arr[i]=wea_rec[i][6]
-       w10d_arr[i]=wea_rec[i][7]
-       rain_list.append(wea_rec[i][9])
-       t_arr=converttemperature(wea_rec[i][8])
-       t02_arr[i]=t_arr[0]
-       t05_arr[i]=t_arr[1]
-       t10_arr[i]=t_arr[2]
-       t15_arr[i]=t_arr[3]
-       t20_arr[i]=t_arr[4]
-       t25_arr[i]=t_arr[5]
-       t30_arr[i]=t_arr[6]
-
-   return time_list, air_arr, dew_arr, hum_arr, w30_arr, w30d_arr, w10_arr, \
-          w10d_arr, rain_list, t02_arr, t05_arr, t10_arr, t15_arr, t20_arr, \
-          t25_arr, t30_arr
+   log_cmd="timestamp>%s and timestamp<%s"
+   chunks=[decodeweather([], stime)]
+   for wea_rec in els.select_chunks(WEATHER_SELECT, WEATHER_TABLE, log_cmd, (int(stime), int(etime)), size=chunk_size):
+       chunks.append(decodeweather(wea_rec, stime))
+
+   return np.concatenate(chunks)
+
+def decodeweather(wea_rec, stime):
+   """Decode weather records from the els into a structured array
+
+      The times are given in seconds since stime.
+   """
+   weather=np.zeros(len(wea_rec), dtype=WEATHER_DTYPE)
+   if len(wea_rec)==0: return weather
+
+   columns=zip(*wea_rec)
+   weather['time']=np.array(columns[0], dtype=float)-stime
+   for i, f in enumerate(WEATHER_FIELDS[1:8]):
+       weather[f]=np.array(columns[i+1], dtype=float)
+   weather['rain_detected']=convertflags(columns[9])
+   t_arr=converttemperatures(columns[8])
+   for i, f in enumerate(WEATHER_FIELDS[9:]):
+       weather[f]=t_arr[:,i]
+   return weather
+
+def convertflags(flags):
+    """Convert flags to a boolean array
+
+       BIT columns are returned by MySQLdb as byte strings, other columns
+       as numbers.
+    """
+    if len(flags) and isinstance(flags[0], str):
+       return np.array([f.strip('\x00')!='' for f in flags], dtype=bool)
+    return np.nan_to_num(np.array(flags, dtype=float))!=0
+
+def converttemperatures(tstructs, nelements=7):
+    """Convert temperature blobs to an array of temperatures
+
+       Each blob has a 4 byte header, followed by big-endian doubles. If
+       all blobs have the same length, they are decoded in one go.
+    """
+    if len(tstructs)==0: return np.zeros((0, nelements))
+    length=len(tstructs[0])
+    if all(len(t)==length for t in tstructs):
+       buf=np.frombuffer(''.join(tstructs), dtype=np.uint8).reshape(len(tstructs), length)
+       buf=np.ascontiguousarray(buf[:,4:4+8*nelements])
+       return buf.view('>f8').astype(float)
+    return np.array([converttemperature(t, nelements) for t in tstructs])
 
 def converttemperature(tstruct, nelements=7):
     t_arr=np.zeros(nelements)
     for i in range(nelements):
         t_arr[i]=float(struct.unpack('>d', tstruct[4+8*i:4+8*(i+1)])[0])
     return t_arr
-
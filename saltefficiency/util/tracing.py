@@ -0,0 +1,163 @@
+"""
+Tracing of the stages of the pipelines.
+
+A stage is traced by running it in a span,
+
+    with tracing.span('create_night_table.weather'):
+        ...
+
+or by decorating its function with traced. A span records the wall-clock
+time of the stage, the CPU time of the process and the growth of the peak
+resident memory of the process during the stage. Spans are only recorded if tracing has been
+enabled with enable, or with from_environment if the environment variable
+SALT_TRACE is set to the path of the trace file; otherwise span does
+nothing.
+
+The spans can be exported in the Chrome trace-event format, which can be
+viewed in chrome://tracing or Perfetto, and as a text summary.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+# environment variable with the path of the trace file
+TRACE_ENV = 'SALT_TRACE'
+
+# the active tracer (a Tracer), or None if tracing is disabled
+tracer = None
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0]+t[1]
+
+def _max_rss():
+    """Return the peak resident memory of the process in kilobytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': rss //= 1024
+    return rss
+
+
+class Tracer:
+   """Recorder of the spans of a process
+
+      The CPU time is that of the whole process, so that it includes the
+      work of other threads running at the same time. Python 2 has no
+      tracemalloc, so the memory of a span is the growth of the peak
+      resident memory of the process; it is 0 if the stage stays below the
+      peak of an earlier stage.
+
+   """
+
+   def __init__(self):
+       self.spans = []
+       self._lock = threading.Lock()
+       self._start = time.time()
+
+   @contextmanager
+   def span(self, name, **args):
+       """Record the execution of a block as a span
+
+          Additional keyword arguments are stored with the span.
+       """
+       start = time.time()
+       cpu = _cpu_time()
+       rss = _max_rss()
+       try:
+           yield
+       finally:
+           s = {'name': name, 'start': start, 'wall': time.time()-start, 'cpu': _cpu_time()-cpu,
+                'rss_growth_kb': _max_rss()-rss, 'pid': os.getpid(), 'tid': threading.current_thread().ident,
+                'args': args}
+           with self._lock:
+               self.spans.append(s)
+
+   def chrome_trace(self):
+       """Return the spans as a Chrome trace-event document"""
+       events = []
+       with self._lock:
+           spans = list(self.spans)
+       for s in spans:
+           args = dict(s['args'])
+           args.update({'cpu_ms': round(1000*s['cpu'], 3), 'rss_growth_kb': s['rss_growth_kb']})
+           events.append({'name': s['name'], 'cat': s['name'].split('.')[0], 'ph': 'X',
+                          'ts': int(1e6*(s['start']-self._start)), 'dur': int(1e6*s['wall']),
+                          'pid': s['pid'], 'tid': s['tid'], 'args': args})
+       events.sort(key=lambda e: (e['ts'], -e['dur']))
+       return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+   def summary(self):
+       """Return a table of the number of calls, the total wall-clock and CPU
+          time and the largest memory growth of the spans, by name
+       """
+       stages = OrderedDict()
+       with self._lock:
+           spans = sorted(self.spans, key=lambda s: s['start'])
+       for s in spans:
+           t = stages.setdefault(s['name'], [0, 0.0, 0.0, 0])
+           t[0] += 1
+           t[1] += s['wall']
+           t[2] += s['cpu']
+           t[3] = max(t[3], s['rss_growth_kb'])
+       lines = ['{0:40s} {1:>6s} {2:>10s} {3:>10s} {4:>15s}'.format('stage', 'calls', 'wall [s]', 'cpu [s]', 'rss growth [kB]')]
+       for name, (calls, wall, cpu, rss) in stages.items():
+           lines.append('{0:40s} {1:6d} {2:10.3f} {3:10.3f} {4:15d}'.format(name, calls, wall, cpu, rss))
+       return '\n'.join(lines)
+
+   def export(self, path):
+       """Write the Chrome trace to a file and the summary to the file with
+          the extension .txt added
+       """
+       with open(path, 'w') as f:
+           json.dump(self.chrome_trace(), f)
+       with open(path+'.txt', 'w') as f:
+           f.write(self.summary()+'\n')
+
+
+@contextmanager
+def _no_span():
+    yield
+
+def span(name, **args):
+    """Return a context manager recording a span if tracing is enabled"""
+    if tracer is None:
+       return _no_span()
+    return tracer.span(name, **args)
+
+def traced(name):
+    """Decorator recording the calls of a function as spans if tracing is
+       enabled
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enable():
+    """Enable tracing, returning the tracer"""
+    global tracer
+    if tracer is None:
+       tracer = Tracer()
+    return tracer
+
+def from_environment():
+    """Enable tracing if the environment variable SALT_TRACE is set
+
+       Returns
+       -------
+       path: string
+           path of the trace file, or None if tracing is not enabled
+
+    """
+    path = os.environ.get(TRACE_ENV)
+    if path: enable()
+    return path or None
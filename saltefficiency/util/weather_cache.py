@@ -0,0 +1,192 @@
+"""
+Local on-disk store of the ELS weather records.
+
+The records are kept in one numpy file per night, which is memory-mapped
+when read. An index file records the time ranges which have been fetched
+from the ELS, so that a sync only queries the rows which are not in the
+store yet. Several processes may add records to the same store.
+"""
+import os
+import json
+import time
+import fcntl
+import datetime
+from contextlib import contextmanager
+
+import numpy as np
+
+import sdb_utils as su
+
+# seconds within which new records may still be added to the ELS
+SETTLE_TIME = 300
+
+
+def night_of(timestamp):
+    """Return the observation date (YYYYMMDD) of an ELS timestamp
+
+       A night runs from noon to noon.
+    """
+    t = datetime.datetime.fromtimestamp(timestamp-su.ELS_OFFSET)-datetime.timedelta(hours=12)
+    return t.strftime('%Y%m%d')
+
+
+def nights_of(timestamps):
+    """Return the observation dates (YYYYMMDD) of an array of ELS timestamps
+
+       The timestamps are looked up between the starts of the nights, so
+       that night_of is only called for the first and last timestamp.
+    """
+    night = datetime.datetime.strptime(night_of(timestamps.min()), '%Y%m%d')
+    last = datetime.datetime.strptime(night_of(timestamps.max()), '%Y%m%d')
+    nights = []
+    starts = []
+    while night <= last:
+        nights.append(night.strftime('%Y%m%d'))
+        starts.append(su.els_time(night+datetime.timedelta(hours=12)))
+        night += datetime.timedelta(days=1)
+    return np.array(nights)[np.searchsorted(starts, timestamps, side='right')-1]
+
+
+class WeatherCache:
+   """Store of ELS weather records, partitioned by night
+
+      The records are stored as returned by sdb_utils.decodeweather, with
+      the time field holding the ELS timestamp.
+
+      Parameters
+      ----------
+      directory: string
+           directory containing the partitions and the index file
+
+   """
+
+   def __init__(self, directory):
+       self.directory = directory
+       if not os.path.isdir(directory):
+          os.makedirs(directory)
+       self._index_file = os.path.join(directory, 'index.json')
+       self._lock_file = os.path.join(directory, 'index.lock')
+       self.covered = []
+       self._load_index()
+
+   @property
+   def high_water_mark(self):
+       """The latest ELS timestamp up to which the store is complete"""
+       if not self.covered: return None
+       return self.covered[-1][1]
+
+   def _partition(self, night):
+       return os.path.join(self.directory, '%s.npy' % night)
+
+   def _load_index(self):
+       if os.path.exists(self._index_file):
+          with open(self._index_file) as f:
+              self.covered = [tuple(c) for c in json.load(f)['covered']]
+
+   @contextmanager
+   def _lock(self):
+       """Hold an exclusive lock on the store while adding records"""
+       with open(self._lock_file, 'a') as f:
+           fcntl.flock(f, fcntl.LOCK_EX)
+           try:
+               yield
+           finally:
+               fcntl.flock(f, fcntl.LOCK_UN)
+
+   def _save_index(self):
+       tmp = self._index_file+'.tmp'
+       with open(tmp, 'w') as f:
+           json.dump({'covered': self.covered, 'high_water_mark': self.high_water_mark}, f)
+       os.rename(tmp, self._index_file)
+
+   def missing(self, stime, etime):
+       """Return the parts of the time range (stime, etime] which are not in
+          the store
+       """
+       missing = []
+       start = stime
+       for lo, hi in self.covered:
+           if hi <= start: continue
+           if lo >= etime: break
+           if lo > start: missing.append((start, lo))
+           start = max(start, hi)
+       if start < etime: missing.append((start, etime))
+       return missing
+
+   def contains(self, stime, etime):
+       """Check whether the store has all records in (stime, etime]"""
+       return not self.missing(stime, etime)
+
+   def add(self, records, stime, etime):
+       """Add the records fetched for the time range (stime, etime]
+
+          The store is locked while the records are added, and the time
+          ranges added by other processes are merged.
+       """
+       with self._lock():
+           self._add(records, stime, etime)
+
+   def _add(self, records, stime, etime):
+       nights = {}
+       if len(records):
+          keys = nights_of(records['time'])
+          for night in np.unique(keys):
+              nights[night] = records[keys == night]
+       for night, new in nights.items():
+           path = self._partition(night)
+           if os.path.exists(path):
+              old = np.load(path)
+              new = np.concatenate([old, new])
+           new = new[np.argsort(new['time'], kind='mergesort')]
+           if len(new):
+              keep = np.concatenate([[True], np.diff(new['time']) > 0])
+              new = new[keep]
+           tmp = path+'.tmp.npy'
+           np.save(tmp, new)
+           os.rename(tmp, path)
+
+       # merge the time range into the covered ranges
+       self._load_index()
+       covered = sorted(self.covered+[(stime, etime)])
+       self.covered = []
+       for lo, hi in covered:
+           if self.covered and lo <= self.covered[-1][1]:
+              self.covered[-1] = (self.covered[-1][0], max(hi, self.covered[-1][1]))
+           else:
+              self.covered.append((lo, hi))
+       self._save_index()
+
+   def sync(self, els, stime, etime, chunk_size=10000):
+       """Fetch the records between two ELS timestamps which are not in the
+          store yet
+
+          Records close to the current time may still be missing from the
+          ELS, so only the range up to the latest fetched record is marked
+          as complete for them.
+       """
+       now = time.time()+su.ELS_OFFSET
+       log_cmd = 'timestamp>%s and timestamp<=%s'
+       for lo, hi in self.missing(stime, etime):
+           chunks = [su.decodeweather([], 0)]
+           for wea_rec in els.select_chunks(su.WEATHER_SELECT, su.WEATHER_TABLE, log_cmd, (int(lo), int(hi)), size=chunk_size):
+               chunks.append(su.decodeweather(wea_rec, 0))
+           records = np.concatenate(chunks)
+           if hi > now-SETTLE_TIME:
+              hi = records['time'].max() if len(records) else lo
+           if hi > lo:
+              self.add(records, lo, hi)
+
+   def read(self, stime, etime):
+       """Return the stored records with stime < timestamp < etime"""
+       chunks = [su.decodeweather([], 0)]
+       night = datetime.datetime.strptime(night_of(stime), '%Y%m%d')
+       last = datetime.datetime.strptime(night_of(etime), '%Y%m%d')
+       while night <= last:
+           path = self._partition(night.strftime('%Y%m%d'))
+           if os.path.exists(path):
+              records = np.load(path, mmap_mode='r')
+              i = np.searchsorted(records['time'], stime, side='right')
+              j = np.searchsorted(records['time'], etime, side='left')
+              chunks.append(np.array(records[i:j]))
+           night += datetime.timedelta(days=1)
+       return np.concatenate(chunks)
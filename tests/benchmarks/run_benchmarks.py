@@ -0,0 +1,387 @@
+"""
+Benchmarks of the hot paths of saltefficiency on synthetic databases.
+
+blockvisitstats, get_weather_info, create_night_table, the report_queries
+functions and the summary plots are timed on databases generated by
+synthetic_sdb, which range from a single night to ten years. Every benchmark
+runs in a process of its own, so that its peak memory can be measured.
+
+The results can be stored as a baseline, with which later runs are compared:
+
+    python -m tests.benchmarks.run_benchmarks --scales night,week,month --save-baseline
+    python -m tests.benchmarks.run_benchmarks --scales night,week,month
+
+The generated databases are kept in the data directory and reused.
+"""
+import os
+import sys
+import json
+import time
+import getopt
+import platform
+import resource
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+from multiprocessing import Process, Pipe
+
+import synthetic_sdb as ss
+
+# the last night of the generated databases
+LAST_NIGHT = datetime(2016, 3, 31)
+
+# default location of the baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# report_queries functions taking a connection, a date and an interval
+REPORT_FUNCTIONS = ['date_range', 'weekly_priority_breakdown', 'weekly_time_breakdown',
+                    'weekly_total_time_breakdown', 'weekly_subsystem_breakdown',
+                    'weekly_subsystem_breakdown_total', 'lastnight_time_breakdown',
+                    'lastnight_subsystem_breakdown']
+
+# report_queries functions reading the rows from a start to an end date
+READ_FUNCTIONS = ['read_nights', 'read_faults', 'read_blocks']
+
+
+class Context:
+    """The database of a scale and the nights to benchmark
+
+       Parameters
+       ----------
+       path: string
+           path of the synthetic database
+       nights: int
+           number of nights in the database
+       sample: int
+           maximum number of nights for the per-night benchmarks
+
+    """
+
+    def __init__(self, path, nights, sample):
+        self.path = path
+        self.nights = nights
+        self.first_night = LAST_NIGHT-timedelta(days=nights-1)
+        # the report date is the day on which the last night ends
+        self.date = (LAST_NIGHT+timedelta(days=1)).date()
+        self.now = LAST_NIGHT+timedelta(days=1, hours=10)
+        step = max(1, nights//sample)
+        self.obsdates = [(LAST_NIGHT-timedelta(days=i)).strftime('%Y%m%d') for i in range(0, nights, step)][:sample]
+
+    def sdb(self):
+        return ss.SyntheticSdb(self.path, self.now)
+
+    def connect(self):
+        return ss.PandasConnection(self.path, self.now)
+
+    def twilight(self, sdb, obsdate):
+        return sdb.select('EveningTwilightEnd, MorningTwilightStart', 'NightInfo', 'Date=%s', (obsdate,))[0]
+
+
+# Every benchmark is a function returning a setup function, which returns the
+# timed function, and the unit of the number of items it processes.
+
+def blockvisitstats_benchmark(ctx):
+    import saltefficiency.util.blockvisitstats as bvs
+    sdb = ctx.sdb()
+    def run():
+        for obsdate in ctx.obsdates:
+            bvs.blockvisitstats(sdb, obsdate, update=False)
+        return len(ctx.obsdates)
+    return run, 'nights'
+
+def get_weather_info_benchmark(ctx):
+    import saltefficiency.util.sdb_utils as su
+    els = ctx.sdb()
+    times = [ctx.twilight(els, obsdate) for obsdate in ctx.obsdates]
+    def run():
+        return sum(len(su.get_weather_info(els, stime, etime)) for stime, etime in times)
+    return run, 'records'
+
+def get_weather_info_period_benchmark(ctx):
+    import saltefficiency.util.sdb_utils as su
+    els = ctx.sdb()
+    stime = ctx.first_night
+    etime = LAST_NIGHT+timedelta(days=1, hours=12)
+    def run():
+        return len(su.get_weather_info(els, stime, etime))
+    return run, 'records'
+
+def create_night_table_benchmark(ctx):
+    from saltefficiency.nightly.create_night_table import create_night_table
+    sdb = ctx.sdb()
+    def run():
+        for obsdate in ctx.obsdates:
+            create_night_table(obsdate, sdb, sdb)
+        return len(ctx.obsdates)
+    return run, 'nights'
+
+def report_benchmark(name):
+    def benchmark(ctx):
+        import saltefficiency.util.report_queries as rq
+        con = ctx.connect()
+        f = getattr(rq, name)
+        def run():
+            f(con, ctx.date, ctx.nights)
+            return ctx.nights
+        return run, 'nights'
+    return benchmark
+
+def read_benchmark(name):
+    def benchmark(ctx):
+        import saltefficiency.util.report_queries as rq
+        con = ctx.connect()
+        f = getattr(rq, name)
+        def run():
+            f(con, ctx.first_night.date(), LAST_NIGHT.date())
+            return ctx.nights
+        return run, 'nights'
+    return benchmark
+
+def fetch_report_benchmark(ctx):
+    import saltefficiency.util.report_queries as rq
+    def run():
+        rq.fetch_report(ctx.connect, ctx.date, ctx.nights)
+        return ctx.nights
+    return run, 'nights'
+
+def plot_benchmark(chart, bokeh=False):
+    def benchmark(ctx):
+        import saltefficiency.util.report_queries as rq
+        import saltefficiency.plot.summary_plots as sp
+        from saltefficiency.plot.plot_set import CHARTS, BOKEH_SIZES
+        # the rows are fetched before timing, so that only the plotting is timed
+        window = rq.ReportWindow(ctx.connect(), ctx.date, ctx.nights)
+        window.nights, window.faults, window.blocks
+        title = dict(CHARTS)[chart]
+        if bokeh:
+            f = getattr(sp, chart+'_plot')
+            def run():
+                f(window, window.date, window.interval, title, *BOKEH_SIZES[chart])
+                return 1
+        else:
+            f = getattr(sp, chart)
+            def run():
+                f(window, window.date, window.interval, title).close()
+                return 1
+        return run, 'plots'
+    return benchmark
+
+
+BENCHMARKS = [('blockvisitstats', blockvisitstats_benchmark),
+              ('get_weather_info', get_weather_info_benchmark),
+              ('get_weather_info_period', get_weather_info_period_benchmark),
+              ('create_night_table', create_night_table_benchmark)] + \
+             [(name, report_benchmark(name)) for name in REPORT_FUNCTIONS] + \
+             [(name, read_benchmark(name)) for name in READ_FUNCTIONS] + \
+             [('fetch_report', fetch_report_benchmark)] + \
+             [(chart, plot_benchmark(chart)) for chart in
+              ['priority_breakdown', 'total_time_breakdown', 'subsystem_breakdown', 'time_breakdown']] + \
+             [(chart+'_plot', plot_benchmark(chart, bokeh=True)) for chart in
+              ['priority_breakdown', 'total_time_breakdown', 'subsystem_breakdown', 'time_breakdown']]
+
+
+def _max_rss():
+    """Return the peak resident memory of the process in kilobytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': rss //= 1024
+    return rss
+
+def _measure(benchmark, ctx, repeat, conn):
+    """Run a benchmark in a child process and send the result to the parent"""
+    result = {'error': None}
+    try:
+        # the output of the benchmarked code is not of interest
+        sys.stdout = open(os.devnull, 'w')
+        start_rss = _max_rss()
+        run, unit = benchmark(ctx)
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            units = run()
+            times.append(time.time()-start)
+        seconds = min(times)
+        result.update({'seconds': seconds, 'units': units, 'unit': unit,
+                       'throughput': units/seconds if seconds > 0 else None,
+                       'peak_rss_kb': _max_rss(), 'rss_growth_kb': _max_rss()-start_rss})
+    except Exception:
+        result['error'] = traceback.format_exc()
+    conn.send(result)
+    conn.close()
+
+def measure(benchmark, ctx, repeat=3):
+    """Run a benchmark in a process of its own
+
+       Returns
+       -------
+       result: dict
+           the best time in seconds, the number of units processed, the
+           throughput in units per second, the peak memory and its growth
+           during the benchmark in kilobytes, and the traceback of any error
+
+    """
+    parent, child = Pipe(duplex=False)
+    p = Process(target=_measure, args=(benchmark, ctx, repeat, child))
+    p.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': 'The benchmark process exited with code {0}'.format(p.exitcode)}
+    p.join()
+    return result
+
+def run_benchmarks(scales, directory, names=None, sample=7, repeat=3, seed=0, weather_step=60):
+    """Run the benchmarks for the given scales
+
+       Parameters
+       ----------
+       scales: list
+           names of the scales in synthetic_sdb.SCALES
+       directory: string
+           directory for the generated databases
+       names: list
+           names of the benchmarks to run (all if None)
+       sample: int
+           maximum number of nights for the per-night benchmarks
+       repeat: int
+           number of times each benchmark is run
+       seed: int
+           seed for the generated databases
+       weather_step: int
+           seconds between the generated weather records
+
+       Returns
+       -------
+       results: dict
+           results of measure keyed by scale and benchmark
+
+    """
+    nights = dict(ss.SCALES)
+    results = {}
+    for scale in scales:
+        start = time.time()
+        path = ss.database(directory, nights[scale], LAST_NIGHT.date(), seed, weather_step)
+        sys.stderr.write('{0}: database ready after {1:.1f} s\n'.format(scale, time.time()-start))
+        ctx = Context(path, nights[scale], sample)
+        results[scale] = {}
+        for name, benchmark in BENCHMARKS:
+            if names is not None and name not in names: continue
+            result = measure(benchmark, ctx, repeat)
+            results[scale][name] = result
+            if result['error'] is None:
+                sys.stderr.write('{0} {1}: {2:.3f} s, {3:.1f} {4}/s, {5} kB\n'.format(
+                    scale, name, result['seconds'], result['throughput'] or 0, result['unit'], result['peak_rss_kb']))
+            else:
+                sys.stderr.write('{0} {1}: failed\n{2}\n'.format(scale, name, result['error']))
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare results with a baseline
+
+       Returns
+       -------
+       rows: list
+           (scale, benchmark, time ratio, memory ratio, regression) for all
+           benchmarks in both the results and the baseline; a ratio larger
+           than 1 means that the benchmark has become slower or needs more
+           memory
+
+    """
+    rows = []
+    for scale in sorted(results):
+        for name, result in sorted(results[scale].items()):
+            base = baseline.get(scale, {}).get(name)
+            if base is None or base.get('error') or result.get('error'): continue
+            time_ratio = result['seconds']/base['seconds'] if base['seconds'] else None
+            memory_ratio = float(result['peak_rss_kb'])/base['peak_rss_kb'] if base['peak_rss_kb'] else None
+            regression = (time_ratio is not None and time_ratio > 1+tolerance) or \
+                         (memory_ratio is not None and memory_ratio > 1+tolerance)
+            rows.append((scale, name, time_ratio, memory_ratio, regression))
+    return rows
+
+def usage():
+    print __doc__
+    print 'Options:'
+    print '    -s --scales=night,week,month  scales to run ({0})'.format(', '.join(s[0] for s in ss.SCALES))
+    print '    -b --benchmarks=NAMES         comma separated names of the benchmarks to run'
+    print '    -d --data=DIR                 directory of the generated databases'
+    print '    -n --sample=7                 number of nights for the per-night benchmarks'
+    print '    -r --repeat=3                 number of runs of each benchmark'
+    print '    --baseline=FILE               baseline file ({0})'.format(BASELINE)
+    print '    --save-baseline               store the results as the baseline'
+    print '    --tolerance=0.2               relative slowdown counted as a regression'
+    print '    -o --output=FILE              write the results to a JSON file'
+
+
+if __name__=='__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hs:b:d:n:r:o:',
+                                   ['help', 'scales=', 'benchmarks=', 'data=', 'sample=', 'repeat=',
+                                    'baseline=', 'save-baseline', 'tolerance=', 'output='])
+    except getopt.GetoptError, e:
+        print str(e)
+        usage()
+        sys.exit(2)
+
+    scales = ['night', 'week', 'month']
+    names = None
+    directory = os.path.join(tempfile.gettempdir(), 'saltefficiency-benchmarks')
+    sample = 7
+    repeat = 3
+    baseline_file = BASELINE
+    save_baseline = False
+    tolerance = 0.2
+    output = None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+        elif opt in ('-s', '--scales'):
+            scales = arg.split(',')
+        elif opt in ('-b', '--benchmarks'):
+            names = arg.split(',')
+        elif opt in ('-d', '--data'):
+            directory = arg
+        elif opt in ('-n', '--sample'):
+            sample = int(arg)
+        elif opt in ('-r', '--repeat'):
+            repeat = int(arg)
+        elif opt == '--baseline':
+            baseline_file = arg
+        elif opt == '--save-baseline':
+            save_baseline = True
+        elif opt == '--tolerance':
+            tolerance = float(arg)
+        elif opt in ('-o', '--output'):
+            output = arg
+
+    results = run_benchmarks(scales, directory, names, sample, repeat)
+    report = {'created': datetime.now().isoformat(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'results': results}
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    regressions = False
+    if save_baseline:
+        # keep the baseline of the scales and benchmarks which have not been run
+        baseline = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                baseline = json.load(f)['results']
+        for scale in results:
+            baseline.setdefault(scale, {}).update(results[scale])
+        report['results'] = baseline
+        with open(baseline_file, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    elif os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)['results']
+        print '{0:8s} {1:36s} {2:>6s} {3:>6s}'.format('scale', 'benchmark', 'time', 'memory')
+        for scale, name, time_ratio, memory_ratio, regression in compare(results, baseline, tolerance):
+            print '{0:8s} {1:36s} {2:6.2f} {3:6.2f} {4}'.format(scale, name, time_ratio or 0, memory_ratio or 0,
+                                                              'REGRESSION' if regression else '')
+            regressions = regressions or regression
+
+    failed = any(r['error'] is not None for s in results.values() for r in s.values())
+    sys.exit(1 if regressions or failed else 0)
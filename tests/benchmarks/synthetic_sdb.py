@@ -0,0 +1,482 @@
+"""
+Synthetic SDB and ELS databases for benchmarking.
+
+generate fills an SQLite file with the SDB tables used by saltefficiency
+(NightInfo, SoLogEvent, PointEvent, Block, BlockVisit, FileData,
+FitsHeaderImage, Fault and the tables they are joined with) and the ELS
+table bms_external_conditions. The content is derived from a random number
+generator with a fixed seed, so that the same scale always yields the same
+database.
+
+SyntheticSdb is a stand-in for mysql.mysql on such a file, and
+PandasConnection a stand-in for a MySQLdb connection passed to Pandas.
+Both translate the MySQL idioms used by saltefficiency to SQLite.
+"""
+import os
+import re
+import random
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+# version of the generated content; databases of another version are rebuilt
+VERSION = 1
+
+# number of nights of the benchmark scales
+SCALES = [('night', 1), ('week', 7), ('month', 30), ('year', 365), ('decade', 3652)]
+
+# offset between the ELS timestamps and Unix time, as used in get_weather_info
+ELS_OFFSET = 2082852000-7200
+
+SCHEMA = '''
+CREATE TABLE Investigator (Investigator_Id INTEGER PRIMARY KEY, Surname TEXT);
+CREATE TABLE SaltOperator (SO_Id INTEGER PRIMARY KEY, Surname TEXT);
+CREATE TABLE NightInfo (NightInfo_Id INTEGER PRIMARY KEY, Date DATE, EveningTwilightEnd DATETIME,
+                        MorningTwilightStart DATETIME, TimeLostToWeather INTEGER, TimeLostToProblems INTEGER,
+                        EngineeringTime INTEGER, ScienceTime INTEGER, OtherTime INTEGER, SA_Id INTEGER,
+                        SO1_Id INTEGER, CTDuty_Id INTEGER);
+CREATE INDEX NightInfo_Date ON NightInfo (Date);
+CREATE TABLE SoLogEvent (SoLogEvent_Id INTEGER PRIMARY KEY, NightInfo_Id INTEGER, EventType_Id INTEGER,
+                         EventTime TIME);
+CREATE INDEX SoLogEvent_Night ON SoLogEvent (NightInfo_Id);
+CREATE TABLE PointEvent (PointEvent_Id INTEGER PRIMARY KEY, SoLogEvent_Id INTEGER, Proposal_Code TEXT,
+                         BlockVisit_Id INTEGER);
+CREATE INDEX PointEvent_SoLogEvent ON PointEvent (SoLogEvent_Id);
+CREATE TABLE ProposalType (ProposalType_Id INTEGER PRIMARY KEY, ProposalType TEXT);
+CREATE TABLE ProposalCode (ProposalCode_Id INTEGER PRIMARY KEY, Proposal_Code TEXT);
+CREATE TABLE ProposalGeneralInfo (ProposalCode_Id INTEGER PRIMARY KEY, ProposalType_Id INTEGER);
+CREATE TABLE Proposal (Proposal_Id INTEGER PRIMARY KEY, ProposalCode_Id INTEGER);
+CREATE TABLE Block (Block_Id INTEGER PRIMARY KEY, Proposal_Id INTEGER, Priority INTEGER, ObsTime INTEGER);
+CREATE TABLE BlockVisitStatus (BlockVisitStatus_Id INTEGER PRIMARY KEY, BlockVisitStatus TEXT);
+CREATE TABLE BlockVisit (BlockVisit_Id INTEGER PRIMARY KEY, Block_Id INTEGER, NightInfo_Id INTEGER,
+                         BlockVisitStatus_Id INTEGER, Accepted INTEGER, BlockRejectedReason_Id INTEGER,
+                         TotalSlewTime INTEGER, TotalAcquisitionTime INTEGER, TotalScienceTime INTEGER);
+CREATE INDEX BlockVisit_Night ON BlockVisit (NightInfo_Id);
+CREATE TABLE FileData (FileData_Id INTEGER PRIMARY KEY, FileName TEXT, ProposalCode_Id INTEGER,
+                       Target_Name TEXT, ExposureTime REAL, UTSTART DATETIME, INSTRUME TEXT,
+                       NExposures INTEGER, Block_Id INTEGER);
+CREATE TABLE FitsHeaderImage (FitsHeaderImage_Id INTEGER PRIMARY KEY, FileData_Id INTEGER, INSTRUME TEXT,
+                              OBSMODE TEXT, DETMODE TEXT, CCDTYPE TEXT);
+CREATE INDEX FitsHeaderImage_FileData ON FitsHeaderImage (FileData_Id);
+CREATE TABLE SaltSubsystem (SaltSubsystem_Id INTEGER PRIMARY KEY, SaltSubsystem TEXT);
+CREATE TABLE Fault (Fault_Id INTEGER PRIMARY KEY, NightInfo_Id INTEGER, SaltSubsystem_Id INTEGER,
+                    FaultStart DATETIME, FaultEnd DATETIME, TimeLost INTEGER, Deleted INTEGER);
+CREATE INDEX Fault_Night ON Fault (NightInfo_Id);
+CREATE TABLE bms_external_conditions (timestamp INTEGER PRIMARY KEY, air_pressure REAL, dewpoint REAL,
+                                      rel_humidity REAL, wind_mag_30m REAL, wind_dir_30m REAL,
+                                      wind_mag_10m REAL, wind_dir_10m REAL, temperatures BLOB,
+                                      rain_detected INTEGER);
+CREATE TABLE benchmark_info (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+SUBSYSTEMS = ['BMS', 'DOME', 'TC', 'PMAS', 'SCAM', 'TCS', 'STRUCT', 'TPC', 'HRS', 'PFIS', 'Proposal',
+              'Operations', 'ELS', 'ESKOM']
+
+SURNAMES = ['Buckley', 'Crawford', 'Hettlage', 'Kotze', 'Koeslag', 'Kniazev', 'Romero', 'Vaisanen']
+
+
+def _time_to_str(t):
+    """Format a timedelta as a MySQL TIME value"""
+    s = t.days*86400+t.seconds
+    return '{0:02d}:{1:02d}:{2:02d}'.format(s//3600, (s//60)%60, s%60)
+
+def _str_to_time(s):
+    """Convert a MySQL TIME value to a timedelta, as MySQLdb does"""
+    h, m, s = s.split(':')
+    return timedelta(hours=int(h), minutes=int(m), seconds=float(s))
+
+def _str_to_datetime(s):
+    return datetime.strptime(s[:19], '%Y-%m-%d %H:%M:%S')
+
+def _timestampdiff_second(t1, t2):
+    return int((_str_to_datetime(t2)-_str_to_datetime(t1)).total_seconds())
+
+def _sec_to_time(s):
+    if s is None: return None
+    return _time_to_str(timedelta(seconds=int(s)))
+
+sqlite3.register_adapter(timedelta, _time_to_str)
+sqlite3.register_converter('TIME', _str_to_time)
+sqlite3.register_converter('DATETIME', _str_to_datetime)
+sqlite3.register_converter('BLOB', str)
+
+
+def els_time(t):
+    """Convert a local date time to an ELS timestamp"""
+    return int(time.mktime(t.timetuple()))+ELS_OFFSET
+
+
+class Generator:
+    """Deterministic generator of the records of a range of nights
+
+       Parameters
+       ----------
+       db: sqlite3.Connection
+           database with the tables of SCHEMA
+       seed: int
+           seed of the random number generator
+       weather_step: int
+           seconds between weather records
+
+    """
+
+    def __init__(self, db, seed=0, weather_step=60):
+        self.db = db
+        self.rng = random.Random(seed)
+        self.weather_step = weather_step
+        self.proposals = {}
+        self.ids = {}
+
+    def next_id(self, table):
+        self.ids[table] = self.ids.get(table, 0)+1
+        return self.ids[table]
+
+    def fill_lookup_tables(self):
+        self.db.executemany('INSERT INTO Investigator VALUES (?, ?)', enumerate(SURNAMES, 1))
+        self.db.executemany('INSERT INTO SaltOperator VALUES (?, ?)', enumerate(SURNAMES, 1))
+        self.db.executemany('INSERT INTO ProposalType VALUES (?, ?)',
+                            [(1, 'Science'), (2, 'Engineering'), (3, 'Commissioning')])
+        self.db.executemany('INSERT INTO BlockVisitStatus VALUES (?, ?)', [(1, 'Accepted'), (2, 'Rejected')])
+        self.db.executemany('INSERT INTO SaltSubsystem VALUES (?, ?)', enumerate(SUBSYSTEMS, 1))
+
+    def proposal(self, night):
+        """Return the (Proposal_Code, ProposalCode_Id, Proposal_Id) of a
+           random proposal of the semester of the night
+        """
+        if 5 <= night.month <= 10:
+            semester = '{0}-1'.format(night.year)
+        else:
+            semester = '{0}-2'.format(night.year if night.month > 10 else night.year-1)
+        if self.rng.random() < 0.05:
+            code, ptype = '{0}-ENG_{1:03d}'.format(semester, self.rng.randint(1, 5)), 2
+        else:
+            code, ptype = '{0}-SCI-{1:03d}'.format(semester, self.rng.randint(1, 150)), 1
+        if code not in self.proposals:
+            pcid = self.next_id('ProposalCode')
+            pid = self.next_id('Proposal')
+            self.db.execute('INSERT INTO ProposalCode VALUES (?, ?)', (pcid, code))
+            self.db.execute('INSERT INTO ProposalGeneralInfo VALUES (?, ?)', (pcid, ptype))
+            self.db.execute('INSERT INTO Proposal VALUES (?, ?)', (pid, pcid))
+            self.proposals[code] = (pcid, pid)
+        return (code,)+self.proposals[code]
+
+    def event(self, nid, event_type, t):
+        soid = self.next_id('SoLogEvent')
+        self.db.execute('INSERT INTO SoLogEvent VALUES (?, ?, ?, ?)',
+                        (soid, nid, event_type, timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)))
+        return soid
+
+    def image(self, obsdate, pcid, bid, target, instrument, obsmode, detmode, t, exptime):
+        fid = self.next_id('FileData')
+        prefix = 'P' if instrument == 'RSS' else 'S'
+        filename = '{0}{1}{2:04d}.fits'.format(prefix, obsdate, fid % 10000)
+        ut = t-timedelta(hours=2)
+        self.db.execute('INSERT INTO FileData VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (fid, filename, pcid, target, exptime, ut, instrument, 1, bid))
+        self.db.execute('INSERT INTO FitsHeaderImage VALUES (?, ?, ?, ?, ?, ?)',
+                        (self.next_id('FitsHeaderImage'), fid, instrument, obsmode, detmode, 'OBJECT'))
+
+    def night(self, night):
+        """Add the records of the night starting on a date"""
+        rng = self.rng
+        obsdate = night.strftime('%Y%m%d')
+        nid = self.next_id('NightInfo')
+        stime = datetime(night.year, night.month, night.day, 19, 0)+timedelta(seconds=rng.randint(0, 3600))
+        etime = stime+timedelta(hours=rng.uniform(7, 10.5))
+        length = int((etime-stime).total_seconds())
+
+        science = 0
+        t = stime+timedelta(seconds=rng.randint(0, 600))
+        previous = None
+        while t < etime:
+            if rng.random() < 0.05:
+                # mirror alignment, which ends with the next pointing
+                self.event(nid, 4, t)
+                self.event(nid, 10, t+timedelta(seconds=60))
+                t += timedelta(seconds=rng.randint(1200, 2400))
+                continue
+
+            code, pcid, pid = self.proposal(night)
+            bid = self.next_id('Block')
+            duration = rng.randint(1200, 5400)
+            self.db.execute('INSERT INTO Block VALUES (?, ?, ?, ?)', (bid, pid, rng.randint(0, 4), duration))
+            accepted = rng.random() < 0.85
+            bvid = self.next_id('BlockVisit')
+            self.db.execute('INSERT INTO BlockVisit VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, NULL)',
+                            (bvid, bid, nid, 1 if accepted else 2, 1 if accepted else 0,
+                             0 if accepted else rng.randint(1, 6)))
+            soid = self.event(nid, 3, t)
+            self.db.execute('INSERT INTO PointEvent VALUES (?, ?, ?, ?)',
+                            (self.next_id('PointEvent'), soid, code, bvid))
+
+            # slew, acquisition with salticam and science exposures
+            guide = t+timedelta(seconds=rng.randint(120, 600))
+            self.event(nid, 5, guide)
+            self.image(obsdate, pcid, bid, 'target', 'SALTICAM', 'IMAGING', 'NORMAL', guide+timedelta(seconds=30), 10)
+            end = t+timedelta(seconds=duration)
+            s = guide+timedelta(seconds=rng.randint(120, 600))
+            obsmode = rng.choice(['SPECTROSCOPY', 'SPECTROSCOPY', 'IMAGING', 'FABRY-PEROT'])
+            while s < end:
+                exptime = rng.randint(300, 1200)
+                self.image(obsdate, pcid, bid, 'target', 'RSS', obsmode, 'NORMAL', s, exptime)
+                s += timedelta(seconds=exptime+30)
+            self.image(obsdate, pcid, bid, 'ARC', 'RSS', obsmode, 'NORMAL', end, 30)
+            if accepted: science += duration
+            previous = end
+            t = end+timedelta(seconds=rng.randint(0, 300))
+        if previous is not None:
+            self.event(nid, 6, previous)
+
+        # faults
+        problems = 0
+        while rng.random() < 0.15:
+            start = stime+timedelta(seconds=rng.randint(0, length))
+            lost = rng.randint(300, 3600)
+            problems += lost
+            self.db.execute('INSERT INTO Fault VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (self.next_id('Fault'), nid, rng.randint(1, len(SUBSYSTEMS)), start,
+                             start+timedelta(seconds=lost), lost, 1 if rng.random() < 0.05 else 0))
+
+        # weather, with a humid spell in some nights
+        wet = rng.random() < 0.2
+        spell = (rng.randint(0, length), rng.randint(0, length)) if wet else (0, 0)
+        weather = 0
+        records = []
+        for ts in range(els_time(stime), els_time(etime), self.weather_step):
+            dt = ts-els_time(stime)
+            humid = min(spell) <= dt <= max(spell)
+            if humid: weather += self.weather_step
+            temperatures = struct.pack('>i7d', 7, *[rng.gauss(12, 3) for i in range(7)])
+            records.append((ts, rng.gauss(790, 2), rng.gauss(0, 3), rng.uniform(86, 100) if humid else rng.uniform(10, 80),
+                            rng.uniform(0, 15), rng.uniform(0, 360), rng.uniform(0, 10), rng.uniform(0, 360),
+                            sqlite3.Binary(temperatures), 1 if humid and rng.random() < 0.1 else 0))
+        self.db.executemany('INSERT OR REPLACE INTO bms_external_conditions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+
+        problems = min(problems, length)
+        weather = min(weather, length-problems)
+        science = min(science, length-problems-weather)
+        engineering = rng.randint(0, length-problems-weather-science)
+        self.db.execute('INSERT INTO NightInfo VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (nid, night, stime, etime, weather, problems, engineering, science,
+                         None if rng.random() < 0.1 else 0, rng.randint(1, len(SURNAMES)),
+                         rng.randint(1, len(SURNAMES)), rng.randint(1, len(SURNAMES))))
+
+
+def generate(path, first_night, nights, seed=0, weather_step=60):
+    """Create an SQLite database with the records of a range of nights
+
+       Parameters
+       ----------
+       path: string
+           path of the database, which must not exist
+       first_night: date
+           first observing date
+       nights: int
+           number of nights
+       seed: int
+           seed of the random number generator
+       weather_step: int
+           seconds between weather records
+
+    """
+    db = sqlite3.connect(path)
+    try:
+        db.executescript(SCHEMA)
+        generator = Generator(db, seed, weather_step)
+        with db:
+            generator.fill_lookup_tables()
+            for i in range(nights):
+                generator.night(first_night+timedelta(days=i))
+            info = {'version': VERSION, 'first_night': first_night.isoformat(), 'nights': nights,
+                    'seed': seed, 'weather_step': weather_step}
+            db.executemany('INSERT INTO benchmark_info VALUES (?, ?)', [(k, str(v)) for k, v in info.items()])
+    finally:
+        db.close()
+
+def database(directory, nights, last_night=date(2016, 3, 31), seed=0, weather_step=60):
+    """Return the path of the database with the given number of nights up to
+       last_night, generating it if it doesn't exist yet
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = 'sdb_v{0}_{1}_{2}_{3}_{4}.sqlite'.format(VERSION, last_night.strftime('%Y%m%d'), nights, seed, weather_step)
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        tmp = path+'.tmp'
+        if os.path.exists(tmp): os.remove(tmp)
+        generate(tmp, last_night-timedelta(days=nights-1), nights, seed, weather_step)
+        os.rename(tmp, path)
+    return path
+
+
+# a YYYYMMDD observing date, which MySQL converts when comparing with a DATE
+_OBSDATE = re.compile(r'^\d{8}$')
+
+# MySQL functions and their SQLite replacements
+_TRANSLATIONS = [(re.compile(r'DATE_SUB\((.*?),\s*INTERVAL\s+(\d+)\s+DAY\)', re.I | re.S), r"DATE(\1, '-\2 day')"),
+                 (re.compile(r'TIMESTAMPDIFF\(\s*SECOND\s*,', re.I), 'TIMESTAMPDIFF_SECOND(')]
+
+
+def translate(sql, params=None):
+    """Translate a MySQL statement with %s placeholders to SQLite"""
+    for pattern, replacement in _TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    if params is not None:
+        sql = sql.replace('%s', '?').replace('%%', '%')
+        params = tuple('{0}-{1}-{2}'.format(p[0:4], p[4:6], p[6:8]) if isinstance(p, basestring) and _OBSDATE.match(p) else p
+                       for p in params)
+    return sql, params
+
+def connect(path, now=None):
+    """Open an SQLite connection with the MySQL functions used by
+       saltefficiency
+
+       now is the time returned by NOW() (the current time if None).
+    """
+    db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    db.text_factory = str
+    db.create_function('NOW', 0, lambda: (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'))
+    db.create_function('TIMESTAMPDIFF_SECOND', 2, _timestampdiff_second)
+    db.create_function('SEC_TO_TIME', 1, _sec_to_time)
+    return db
+
+
+class PandasCursor:
+    """Cursor translating the executed MySQL statements to SQLite"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=None):
+        sql, params = translate(sql, params)
+        if params is None:
+            return self.cursor.execute(sql)
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class PandasConnection:
+    """Stand-in for a MySQLdb connection to the sdb passed to Pandas
+
+       Parameters
+       ----------
+       path: string
+           path of the SQLite database
+       now: datetime
+           time returned by NOW()
+
+    """
+
+    def __init__(self, path, now=None):
+        self.db = connect(path, now)
+
+    def cursor(self):
+        return PandasCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+
+class SyntheticSdb:
+    """Stand-in for a mysql.mysql connection to the sdb or els
+
+       Every thread uses its own SQLite connection, as every statement of
+       mysql.mysql is executed on a connection of its pool.
+
+       Parameters
+       ----------
+       path: string
+           path of the SQLite database
+       now: datetime
+           time returned by NOW()
+
+    """
+
+    def __init__(self, path, now=None):
+        self.path = path
+        self.now = now
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = connect(self.path, self.now)
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def _execute(self, exec_command, params=None, fetch=False, commit=False):
+        sql, params = translate(exec_command, params if params is not None else ())
+        cursor = self.db.execute(sql, params)
+        record = cursor.fetchall() if fetch else None
+        if commit and not getattr(self._local, 'transaction', False): self.db.commit()
+        return record
+
+    @staticmethod
+    def _select_command(selection, table, logic):
+        command = 'SELECT '+selection+' FROM '+table
+        if len(logic) > 0: command += ' WHERE '+logic
+        return command
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._local, 'transaction', False):
+            yield
+            return
+        self._local.transaction = True
+        try:
+            with self.db:
+                yield
+        finally:
+            self._local.transaction = False
+
+    def select(self, selection, table, logic, params=None):
+        return self._execute(self._select_command(selection, table, logic), params, fetch=True)
+
+    def iter_select(self, selection, table, logic, params=None):
+        for chunk in self.select_chunks(selection, table, logic, params):
+            for record in chunk:
+                yield record
+
+    def select_chunks(self, selection, table, logic, params=None, size=1000):
+        sql, params = translate(self._select_command(selection, table, logic), params if params is not None else ())
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                chunk = cursor.fetchmany(size)
+                if not chunk: break
+                yield list(chunk)
+        finally:
+            cursor.close()
+
+    def update(self, insertion, table, logic, params=None):
+        command = 'UPDATE '+table+' SET '+insertion
+        if len(logic) > 0: command += ' WHERE '+logic
+        self._execute(command, params, commit=True)
+
+    def executemany(self, exec_command, seq_params):
+        with self.transaction():
+            for params in seq_params:
+                self._execute(exec_command, params)
+
+    def close(self):
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+        self._local = threading.local()
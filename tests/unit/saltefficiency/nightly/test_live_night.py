@@ -0,0 +1,176 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+import saltefficiency.util.blockvisitstats as bvs
+from saltefficiency.nightly.live_night import LiveNight
+
+from tests.benchmarks import synthetic_sdb
+
+OBSDATE = '20160331'
+
+# tables whose rows are written during the night
+NIGHT_TABLES = ['SoLogEvent', 'PointEvent', 'BlockVisit', 'FileData', 'FitsHeaderImage', 'bms_external_conditions']
+
+
+class LiveNightTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.full = os.path.join(cls.directory, 'full.sqlite')
+        shutil.copy(synthetic_sdb.database(cls.directory, 1, last_night=date(2016, 3, 31)), cls.full)
+        # all blocks belong to two proposals, so that the order in which the
+        # visits of a proposal are used matters
+        db = sqlite3.connect(cls.full)
+        with db:
+            db.execute('UPDATE Proposal SET ProposalCode_Id=1+ProposalCode_Id%2')
+            db.execute('UPDATE FileData SET ProposalCode_Id=1+ProposalCode_Id%2')
+            db.execute('UPDATE PointEvent SET Proposal_Code=(SELECT Proposal_Code FROM BlockVisit JOIN Block USING (Block_Id) '
+                       'JOIN Proposal USING (Proposal_Id) JOIN ProposalCode USING (ProposalCode_Id) '
+                       'WHERE BlockVisit.BlockVisit_Id=PointEvent.BlockVisit_Id)')
+        db.close()
+        sdb = synthetic_sdb.SyntheticSdb(cls.full)
+        try:
+            cls.expected = bvs.blockvisitstats(sdb, OBSDATE, update=False)
+            records = sdb.select('SoLogEvent_Id, EventTime, EventType_Id', 'SoLogEvent', '', ())
+            cls.events = [(r[0], bvs.converteventtime(OBSDATE, r[1])) for r in records]
+            cls.guide_events = [i for i, r in enumerate(records) if r[2] == 5]
+        finally:
+            sdb.close()
+        assert len(cls.expected) > 3
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        # a copy of the database with none of the rows written during the night
+        self.path = os.path.join(self.directory, 'live.sqlite')
+        shutil.copy(self.full, self.path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('ATTACH DATABASE ? AS full', (self.full,))
+        with self.db:
+            for table in NIGHT_TABLES:
+                self.db.execute('DELETE FROM main.{0}'.format(table))
+        self.sdb = synthetic_sdb.SyntheticSdb(self.path)
+        self.live = LiveNight(OBSDATE, self.sdb, self.sdb, dirname=self.directory+'/')
+
+    def tearDown(self):
+        self.sdb.close()
+        self.db.close()
+        os.remove(self.path)
+
+    def cut(self, fraction):
+        """Return the id and time of the last event in a fraction of the
+        events of the night"""
+        n = int(round(fraction*len(self.events)))
+        return self.events[n-1] if n else (0, datetime(2016, 3, 31, 12))
+
+    def add(self, fraction, headers=True, files=None):
+        """Copy the rows written up to a fraction of the events of the night,
+        and the data files up to another fraction"""
+        soid, t = self.cut(fraction)
+        ut = (self.cut(fraction if files is None else files)[1]-timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO main.SoLogEvent SELECT * FROM full.SoLogEvent WHERE SoLogEvent_Id<=?', (soid,))
+            self.db.execute('INSERT OR IGNORE INTO main.PointEvent SELECT * FROM full.PointEvent WHERE SoLogEvent_Id<=?', (soid,))
+            self.db.execute('INSERT OR REPLACE INTO main.BlockVisit SELECT * FROM full.BlockVisit '
+                            'WHERE BlockVisit_Id IN (SELECT BlockVisit_Id FROM main.PointEvent)')
+            self.db.execute('INSERT OR IGNORE INTO main.FileData SELECT * FROM full.FileData WHERE UTSTART<=?', (ut,))
+            if headers:
+                self.db.execute('INSERT OR IGNORE INTO main.FitsHeaderImage SELECT * FROM full.FitsHeaderImage '
+                                'WHERE FileData_Id IN (SELECT FileData_Id FROM main.FileData)')
+            self.db.execute('INSERT OR IGNORE INTO main.bms_external_conditions SELECT * FROM full.bms_external_conditions '
+                            'WHERE timestamp<=?', (synthetic_sdb.els_time(t),))
+
+    def reject_visit(self, which):
+        """Mark a block visit as rejected, as the SA may do before the visit
+        is accepted"""
+        with self.db:
+            bvids = [r[0] for r in self.db.execute('SELECT BlockVisit_Id FROM main.BlockVisit ORDER BY BlockVisit_Id')]
+            self.db.execute('UPDATE main.BlockVisit SET Accepted=0, BlockRejectedReason_Id=1 WHERE BlockVisit_Id=?',
+                            (bvids[which],))
+
+    def update(self):
+        """Update the live night and check that it matches a full matching
+        of the rows written so far"""
+        changed = self.live.update()
+        self.assertEqual(bvs.blockvisitstats(self.sdb, OBSDATE, update=False), self.live.block_list())
+        # the statistics of the block visits which would be uploaded
+        stats = {}
+        upload = bvs.update_blockvisitstats
+        bvs.update_blockvisitstats = lambda sdb, blockvisit_stats: stats.update(blockvisit_stats)
+        try:
+            bvs.blockvisitstats(self.sdb, OBSDATE)
+        finally:
+            bvs.update_blockvisitstats = upload
+        self.assertEqual(stats, dict(p[3].stats for p in self.live._pointings if p[3] is not None and p[3].stats))
+        return changed
+
+    def check_single_poll(self, cut):
+        self.add(cut)
+        self.assertTrue(self.update())
+        self.add(1)
+        self.assertTrue(self.update())
+        self.assertEqual(self.expected, self.live.block_list())
+
+    def test_poll_after_first_third_matches_full_night(self):
+        self.check_single_poll(1/3.0)
+
+    def test_poll_after_two_thirds_matches_full_night(self):
+        self.check_single_poll(2/3.0)
+
+    def test_several_polls_match_full_night(self):
+        self.add(0.25)
+        self.update()
+        for cut in [0.4, 0.6, 0.8]:
+            # the FITS headers are written after the files
+            self.add(cut, headers=False)
+            self.reject_visit(-1)
+            self.update()
+            self.add(cut)
+            self.update()
+        self.assertFalse(self.update())
+        self.add(1)
+        self.update()
+        self.assertEqual(self.expected, self.live.block_list())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'night_report_{0}.html'.format(OBSDATE))))
+
+    def test_edited_visit_is_matched_again(self):
+        self.add(0.6)
+        self.update()
+        self.reject_visit(1)
+        self.assertTrue(self.update())
+        self.add(1)
+        self.update()
+
+    def test_new_pointing_ends_the_previous_one(self):
+        # the data files are written before the events
+        self.add(0.5, files=1)
+        self.update()
+        self.add(0.7, files=1)
+        self.assertTrue(self.update())
+        self.add(1)
+        self.update()
+        self.assertEqual(self.expected, self.live.block_list())
+
+    def test_start_of_guiding_is_matched_again(self):
+        # the data files are written before the events, so that the poll
+        # only brings the start of guiding
+        n = self.guide_events[len(self.guide_events) // 2]
+        self.add(n/float(len(self.events)), files=1)
+        self.reject_visit(0)
+        self.update()
+        self.add((n+1)/float(len(self.events)), files=1)
+        self.assertTrue(self.update())
+        self.add(1)
+        self.update()
+        self.assertEqual(self.expected, self.live.block_list())
+
+    def test_run_ends_without_night_information(self):
+        live = LiveNight('20000101', self.sdb, self.sdb, dirname=self.directory+'/')
+        live.run(interval=0)
+        self.assertIsNone(live.night_data)
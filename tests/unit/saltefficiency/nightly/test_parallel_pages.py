@@ -0,0 +1,39 @@
+import unittest
+
+import saltefficiency.nightly.parallel_pages as pp
+
+
+class FakeConnection(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def fetch_nights(sdb, els, startdate, enddate):
+    if startdate == '20160305':
+        raise RuntimeError('Lost connection to the sdb')
+    # there is no night information for the 2nd
+    return dict((obsdate, obsdate) for obsdate in pp.date_range(startdate, enddate) if obsdate != '20160302')
+
+
+def night_summary_page(obsdate, sdb, els, dirname, night_data=None):
+    assert night_data == obsdate
+
+
+class ParallelPagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = pp.mysql, pp.fetch_nights, pp.night_summary_page
+        pp.mysql, pp.fetch_nights, pp.night_summary_page = FakeConnection, fetch_nights, night_summary_page
+
+    def tearDown(self):
+        pp.mysql, pp.fetch_nights, pp.night_summary_page = self.saved
+
+    def test_failed_batches_and_missing_nights_are_reported(self):
+        summary = pp.parallel_night_summary_pages('20160301', '20160308', (), (), processes=2, batch_days=2)
+        self.assertEqual(['20160301', '20160303', '20160304', '20160307', '20160308'], summary['succeeded'])
+        self.assertEqual(['20160302', '20160305', '20160306'], [f[0] for f in summary['failed']])
+        self.assertIn('no night information', summary['failed'][0][1])
+        self.assertIn('Lost connection', summary['failed'][1][1])
+        self.assertEqual(set(summary['succeeded']), set(summary['time']))
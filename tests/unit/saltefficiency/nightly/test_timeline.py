@@ -0,0 +1,39 @@
+import unittest
+
+from saltefficiency.nightly.timeline import Timeline
+
+
+class TimelineTestCase(unittest.TestCase):
+    def test_later_intervals_take_precedence(self):
+        timeline = Timeline()
+        timeline.add(0, 100, 3)
+        timeline.add(20, 50, 1)
+        timeline.add(40, 60, 4)
+        self.assertEqual([(0, 20, 3), (20, 40, 1), (40, 60, 4), (60, 100, 3)], timeline.segments())
+
+    def test_explicit_priority(self):
+        timeline = Timeline()
+        timeline.add(0, 100, 4, priority=10)
+        timeline.add(20, 50, 1, priority=0)
+        self.assertEqual([(0, 100, 4)], timeline.segments())
+
+    def test_adjacent_segments_with_same_status_are_joined(self):
+        timeline = Timeline()
+        timeline.add(0, 10, 1)
+        timeline.add(10, 30, 1)
+        timeline.add(40, 50, 1)
+        self.assertEqual([(0, 30, 1), (40, 50, 1)], timeline.segments())
+
+    def test_empty_intervals_are_ignored(self):
+        timeline = Timeline()
+        timeline.add(10, 10, 1)
+        timeline.add(20, 5, 1)
+        self.assertEqual([], timeline.segments())
+
+    def test_totals_are_clipped_to_the_window(self):
+        timeline = Timeline()
+        timeline.add(0, 100, 3)
+        timeline.add(20, 50, 2)
+        self.assertEqual(20, timeline.total([3], 10, 60))
+        self.assertEqual(30, timeline.total([2], 10, 60))
+        self.assertEqual(30 + 40, timeline.total([None, 2], 10, 140))
@@ -0,0 +1,54 @@
+import sqlite3
+import unittest
+from datetime import date
+
+from matplotlib import pyplot
+
+import saltefficiency.plot.summary_plots as sp
+from saltefficiency.util.report_queries import ReportWindow
+
+from tests.unit.saltefficiency.util.test_report_queries import SCHEMA
+
+CHARTS = ['priority_breakdown', 'total_time_breakdown', 'subsystem_breakdown', 'time_breakdown']
+
+
+class SummaryPlotsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.executescript(SCHEMA)
+        self.window = ReportWindow(self.con, '2015-03-04', 3)
+
+    def tearDown(self):
+        sp.reuse_figures = False
+        sp._figure_templates.clear()
+        self.con.close()
+
+    def plot(self, chart):
+        return getattr(sp, chart)(self.window, date(2015, 3, 4), 3, 'Title')
+
+    def test_charts_are_returned_as_png(self):
+        for chart in CHARTS:
+            buf = self.plot(chart)
+            self.assertEqual('\x89PNG', buf.read(4))
+        # the figures are not registered with pyplot
+        self.assertEqual([], pyplot.get_fignums())
+
+    def test_one_figure_is_reused_per_chart_type(self):
+        sp.reuse_figures = True
+        for chart in CHARTS:
+            self.plot(chart)
+        figures = dict(sp._figure_templates)
+        self.assertEqual(sorted(CHARTS), sorted(figures))
+        for chart in CHARTS:
+            self.assertEqual('\x89PNG', self.plot(chart).read(4))
+            self.assertIs(figures[chart], sp._figure_templates[chart])
+        self.assertEqual([], pyplot.get_fignums())
+
+    def test_figures_are_saved_to_file_objects(self):
+        fig = sp.new_figure('chart')
+        fig.add_subplot(111).plot([1, 2], [3, 4])
+        buf = sp.save_figure(fig, None)
+        self.assertEqual('\x89PNG', buf.read(4))
+        # the content of the figure is released
+        self.assertEqual([], fig.axes)
+        self.assertNotIn('chart', sp._figure_templates)
@@ -0,0 +1,66 @@
+"""
+Stand-in for a MySQLdb connection, for testing the mysql wrapper without a
+database server.
+"""
+
+
+class StubCursor(object):
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, command, params=None):
+        if self.db.errors: raise self.db.errors.pop(0)
+        self.db.executed.append((command, params, self.db.autocommit_mode))
+        self.rows = list(self.db.rows) if command.lstrip().upper().startswith('SELECT') else []
+        self.rowcount = len(self.rows)
+
+    def executemany(self, command, seq_params):
+        for params in seq_params:
+            self.execute(command, params)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return tuple(rows)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return tuple(rows)
+
+    def close(self):
+        pass
+
+
+class StubDb(object):
+    """Connection returning the same rows for every SELECT statement and
+    recording the executed statements together with the autocommit mode
+
+    The exceptions in errors are raised by the next statements instead of
+    executing them."""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+        self.autocommit_mode = False
+        self.commits = 0
+        self.rollbacks = 0
+        self.errors = []
+
+    def autocommit(self, on):
+        self.autocommit_mode = on
+
+    def cursor(self, cursorclass=None):
+        return StubCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
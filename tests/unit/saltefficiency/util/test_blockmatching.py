@@ -0,0 +1,90 @@
+import datetime
+import unittest
+
+from saltefficiency.util.blockmatching import BlockIndex, EventIndex, ImageIndex
+
+
+def t(hour, minute=0):
+    """Return a datetime on the night of 2015-03-10 (SAST)."""
+    if hour < 12:
+        return datetime.datetime(2015, 3, 11, hour, minute)
+    return datetime.datetime(2015, 3, 10, hour, minute)
+
+
+def img(name, propcode, target, utstart, instr, obsmode, detmode, bid):
+    return (name, propcode, target, 100.0, utstart, instr, obsmode, detmode, 'OBJECT', 1, bid)
+
+
+class EventIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = EventIndex([[3, t(20)], [5, t(20, 5)], [10, t(20, 30)], [3, t(21)], [5, t(21, 10)]])
+
+    def test_next_pointing_includes_track_commands(self):
+        self.assertEqual(t(20, 30), self.events.findnextpointing(t(20)))
+        self.assertEqual(t(21), self.events.findnextpointing(t(20, 30)))
+
+    def test_next_pointing_defaults_to_end_of_night(self):
+        self.assertEqual(t(5), self.events.findnextpointing(t(21), t(5)))
+
+    def test_guiding_start_is_strictly_after_start_time(self):
+        self.assertEqual(t(21, 10), self.events.findguidingstart(t(20, 5)))
+        self.assertIsNone(self.events.findguidingstart(t(21, 10)))
+
+
+class ImageIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        # times are UT, i.e. two hours behind the event log
+        self.images = ImageIndex([
+            img('P201503100001.fits', 'CAL_FLAT', 'FLAT', t(18, 10), 'RSS', 'IMAGING', 'NORMAL', None),
+            img('P201503100002.fits', '2015-1-SCI-001', 'NGC 1', t(18, 20), 'RSS', 'IMAGING', 'NORMAL', 7),
+            img('P201503100003.fits', '2015-1-SCI-001', 'NGC 1', t(18, 25), 'RSS', 'SPECTROSCOPY', 'NORMAL', 7),
+            img('S201503100001.fits', '2015-1-SCI-002', 'M 4', t(18, 15), 'SCAM', 'IMAGING', 'SLOTMODE', 8),
+            img('S201503100002.fits', '2015-1-SCI-002', 'M 4', None, 'SCAM', 'IMAGING', 'NORMAL', 8),
+        ])
+
+    def test_finddata_returns_first_image_in_list_order(self):
+        data = self.images.finddata(t(20), t(21))
+        self.assertEqual('2015-1-SCI-001', data[0])
+        self.assertEqual(7, data[2])
+
+    def test_finddata_ignores_calibrations(self):
+        data = self.images.finddata(t(20), t(20, 12))
+        self.assertEqual([None]*8, data)
+
+    def test_primary_mode(self):
+        self.assertEqual(('RSS', 'SPECTROSCOPY'), self.images.getprimarymode(7))
+        self.assertEqual(('SCAM', 'SLOTMODE'), self.images.getprimarymode(8))
+
+    def test_first_image_is_converted_back_to_local_time(self):
+        self.assertEqual(t(20, 25), self.images.getfirstimage(t(20), 'RSS', 'SPECTROSCOPY'))
+        self.assertEqual(t(20, 15), self.images.getfirstimage(t(20), 'SCAM', 'SLOTMODE'))
+        self.assertIsNone(self.images.getfirstimage(t(20, 30), 'RSS', 'SPECTROSCOPY'))
+
+
+class BlockIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.blocks = BlockIndex([(11, 1, 'A', 1), (12, 0, 'A', 1), (13, 1, 'A', 2), (14, 0, 'B', 3)])
+
+    def test_codes_are_split_by_acceptance(self):
+        self.assertEqual(set(['A']), self.blocks.accepted_codes)
+        self.assertEqual(set(['A', 'B']), self.blocks.rejected_codes)
+
+    def test_visits_are_consumed_in_order(self):
+        self.blocks.remove_first('A')
+        self.assertEqual([(12, 0, 'A', 1), (13, 1, 'A', 2)], self.blocks.remaining('A'))
+        self.assertIsNone(self.blocks.remaining_visit(11))
+        self.assertEqual((13, 1, 'A', 2), self.blocks.remaining_visit(13))
+
+    def test_accepted_visit_of_block(self):
+        self.assertEqual(11, self.blocks.getblockvisit(1))
+        self.assertEqual(13, self.blocks.getblockvisit(2))
+        self.assertIsNone(self.blocks.getblockvisit(3))
+
+    def test_matching_can_be_resumed_from_a_state(self):
+        self.blocks.remove_first('A')
+        state = self.blocks.state()
+        self.blocks.remove_first('A')
+        self.blocks.remove_first('B')
+        self.blocks.restore(state)
+        self.assertEqual([(12, 0, 'A', 1), (13, 1, 'A', 2)], self.blocks.remaining('A'))
+        self.assertEqual([(14, 0, 'B', 3)], self.blocks.remaining('B'))
@@ -0,0 +1,40 @@
+import datetime
+import unittest
+
+from saltefficiency.util.event_log import EventLog
+
+
+def tod(hour, minute=0):
+    """Return a SoLogEvent time of day."""
+    return datetime.timedelta(hours=hour, minutes=minute)
+
+
+def since_noon(hour, minute=0):
+    """Return the seconds since noon of the observing date of a time of
+    day in the night."""
+    if hour < 12:
+        hour += 24
+    return (hour-12)*3600 + minute*60
+
+
+class EventLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log = EventLog.from_records([(3, tod(1)), (3, tod(20)), (5, tod(20, 5)), (10, tod(23)),
+                                          (13, tod(23, 10)), (10, tod(23, 20)), (3, tod(23, 30))], '20150310')
+
+    def test_events_after_midnight_belong_to_the_next_day(self):
+        self.assertEqual([since_noon(20), since_noon(23, 30), since_noon(1)], list(self.log.event_times((3,))))
+        self.assertEqual(datetime.datetime(2015, 3, 11, 1), self.log.datetime(since_noon(1)))
+
+    def test_next_event(self):
+        self.assertEqual(since_noon(23, 30), self.log.next_event((3,), since_noon(20)))
+        self.assertIsNone(self.log.next_event((5,), since_noon(20, 5)))
+        self.assertEqual([since_noon(20, 5), -1],
+                         list(self.log.next_events((5,), [since_noon(20), since_noon(21)])))
+
+    def test_mirror_alignment_starts_with_the_first_track_command(self):
+        self.assertEqual([[since_noon(23), since_noon(23, 30)]], self.log.mirror_alignments().tolist())
+
+    def test_mirror_alignment_starts_with_a_preceding_event(self):
+        log = EventLog.from_records([(13, tod(21)), (10, tod(21, 5)), (5, tod(21, 20)), (10, tod(22))], '20150310')
+        self.assertEqual([[since_noon(21), since_noon(21, 20)]], log.mirror_alignments().tolist())
@@ -0,0 +1,43 @@
+import unittest
+
+from saltefficiency.util.file_index import FileIndex, file_night
+
+
+class FileDataTable:
+    """The FileData table of an sdb, queried with select_chunks"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def select_chunks(self, selection, table, logic, params=None, size=1000):
+        self.queries.append(params)
+        rows = [r for r in self.rows if r[0] > params[0]]
+        for i in range(0, len(rows), size):
+            yield rows[i:i+size]
+
+
+class FileIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sdb = FileDataTable([(1, 'P201503010001.fits'), (2, 'S201503010001.fits'),
+                                  (3, 'P201503020001.fits'), (4, 'bxgpP201503020002.fits')])
+        self.index = FileIndex(':memory:')
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_file_night_is_taken_from_the_file_name(self):
+        self.assertEqual('20150302', file_night('mbxgpP201503020002.fits'))
+        self.assertIsNone(file_night('junk.fits'))
+
+    def test_files_are_indexed_by_night(self):
+        self.index.update(self.sdb, chunk_size=3)
+        self.assertEqual([1, 2], sorted(self.index.file_ids(['20150301'])))
+        self.assertEqual([1, 2, 3, 4], sorted(self.index.file_ids(['20150301', '20150302'])))
+        self.assertEqual({}, self.index.file_ids(['20150303']))
+
+    def test_update_only_reads_new_files(self):
+        self.index.update(self.sdb)
+        self.sdb.rows.append((5, 'P201503030001.fits'))
+        self.index.update(self.sdb)
+        self.assertEqual([(0,), (4,)], self.sdb.queries)
+        self.assertEqual([5], list(self.index.file_ids(['20150303'])))
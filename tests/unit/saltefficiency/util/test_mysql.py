@@ -0,0 +1,65 @@
+import time
+import unittest
+
+import MySQLdb
+
+import saltefficiency.util.mysql as mysql
+
+from tests.unit.saltefficiency.util.mysql_stub import StubDb
+
+
+class AutocommitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = StubDb(rows=[(1,)])
+        self.sdb = mysql.mysql('localhost', 'sdb', 'user', 'password')
+        self.sdb.pool = mysql.ConnectionPool(lambda: self.db)
+
+    def test_queries_see_committed_rows(self):
+        self.sdb.select('SoLogEvent_Id', 'SoLogEvent', 'SoLogEvent_Id>%s', (0,))
+        list(self.sdb.iter_select('SoLogEvent_Id', 'SoLogEvent', 'SoLogEvent_Id>%s', (1,)))
+        self.assertEqual([True, True], [e[2] for e in self.db.executed])
+
+    def test_transactions_turn_autocommit_off(self):
+        with self.sdb.transaction():
+            self.sdb.update('TotalSlewTime=%s', 'BlockVisit', 'BlockVisit_Id=%s', (10, 1))
+        self.sdb.select('TotalSlewTime', 'BlockVisit', 'BlockVisit_Id=%s', (1,))
+        self.assertEqual([False, True], [e[2] for e in self.db.executed])
+        self.assertEqual(1, self.db.commits)
+
+
+class SelectChunksStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = StubDb(rows=[(1,), (2,), (3,)])
+        self.stats = mysql.QueryStats(slow_query_time=0.05)
+        self.sdb = mysql.mysql('localhost', 'sdb', 'user', 'password', stats=self.stats)
+        self.sdb.pool = mysql.ConnectionPool(lambda: self.db)
+
+    def test_processing_of_the_chunks_is_not_timed(self):
+        for chunk in self.sdb.select_chunks('SoLogEvent_Id', 'SoLogEvent', '', size=1):
+            time.sleep(0.03)
+        d = self.stats.as_dict()
+        self.assertEqual(3, d['total']['rows'])
+        self.assertLess(d['total']['seconds'], 0.05)
+        self.assertEqual([], d['slow_queries'])
+        # no EXPLAIN plan is requested
+        self.assertEqual(1, len(self.db.executed))
+
+
+class ConnectionLostTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = StubDb(rows=[(1,)])
+        self.sdb = mysql.mysql('localhost', 'sdb', 'user', 'password')
+        self.sdb.pool = mysql.ConnectionPool(lambda: self.db)
+
+    def test_queries_are_tried_again(self):
+        self.db.errors.append(MySQLdb.OperationalError(2006, 'MySQL server has gone away'))
+        self.assertEqual(((1,),), self.sdb.select('SoLogEvent_Id', 'SoLogEvent', 'SoLogEvent_Id=%s', (1,)))
+        self.assertEqual(1, len(self.db.executed))
+
+    def test_writes_are_not_tried_again(self):
+        # the server may have applied the insert before the connection was lost
+        self.db.errors.append(MySQLdb.OperationalError(2013, 'Lost connection to MySQL server during query'))
+        with self.assertRaisesRegexp(Exception, 'Lost connection'):
+            self.sdb.insert('BlockVisit_Id=1', 'BlockVisit')
+        self.assertEqual([], self.db.executed)
+        self.assertEqual(0, self.db.commits)
@@ -0,0 +1,51 @@
+import sqlite3
+import unittest
+from datetime import date
+
+import saltefficiency.util.report_queries as rq
+from saltefficiency.util.night_rollup import NightRollup
+
+from tests.unit.saltefficiency.util.test_report_queries import SCHEMA
+
+
+class NightRollupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.executescript(SCHEMA)
+        self.rollup = NightRollup(':memory:')
+
+    def tearDown(self):
+        rq.night_rollup = None
+        self.rollup.close()
+
+    def test_breakdowns_match_the_sdb(self):
+        expected = rq.ReportWindow(self.con, '2015-03-04', 3)
+        rq.night_rollup = self.rollup
+        rolled_up = rq.ReportWindow(self.con, '2015-03-04', 3)
+        self.assertEqual(list(expected.weekly_total_time_breakdown()['Unallocated']),
+                         list(rolled_up.weekly_total_time_breakdown()['Unallocated']))
+        self.assertEqual(list(expected.weekly_priority_breakdown()['No. Blocks']),
+                         list(rolled_up.weekly_priority_breakdown()['No. Blocks']))
+        self.assertEqual(list(expected.weekly_subsystem_breakdown()['Time']),
+                         list(rolled_up.weekly_subsystem_breakdown()['Time']))
+
+    def test_old_nights_are_only_fetched_once(self):
+        self.rollup.update(self.con, date(2015, 3, 1), date(2015, 3, 3))
+        self.assertEqual([], self.rollup.stale(date(2015, 3, 1), date(2015, 3, 3)))
+        self.assertEqual([date(2015, 3, 4)], self.rollup.stale(date(2015, 3, 1), date(2015, 3, 4)))
+        self.rollup.invalidate(date(2015, 3, 2))
+        self.assertEqual([date(2015, 3, 2)], self.rollup.stale(date(2015, 3, 1), date(2015, 3, 3)))
+
+    def test_runs_of_stale_nights_are_fetched(self):
+        self.rollup.update(self.con, date(2015, 3, 1), date(2015, 3, 6))
+        self.rollup.invalidate(date(2015, 3, 2))
+        self.rollup.invalidate(date(2015, 3, 4))
+        self.rollup.invalidate(date(2015, 3, 5))
+        refreshed = []
+        refresh = self.rollup.refresh
+        self.rollup.refresh = lambda con, start_date, end_date: refreshed.append((start_date, end_date))
+        try:
+            self.rollup.update(self.con, date(2015, 3, 1), date(2015, 3, 6))
+        finally:
+            self.rollup.refresh = refresh
+        self.assertEqual([(date(2015, 3, 2), date(2015, 3, 2)), (date(2015, 3, 4), date(2015, 3, 5))], refreshed)
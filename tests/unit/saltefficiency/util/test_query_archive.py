@@ -0,0 +1,85 @@
+import sqlite3
+import unittest
+from datetime import datetime, timedelta
+
+import saltefficiency.util.mysql as mysql
+import saltefficiency.util.report_queries as rq
+from saltefficiency.util.query_archive import QueryArchive, QueryNotArchived, query_id
+
+from tests.unit.saltefficiency.util.mysql_stub import StubDb
+
+
+def no_connection():
+    raise AssertionError('The database is queried in replay mode')
+
+
+class QueryArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.archive = QueryArchive(':memory:', 'record')
+
+    def tearDown(self):
+        self.archive.close()
+
+    def test_queries_are_keyed_by_normalized_sql_and_params(self):
+        self.assertEqual(query_id('SELECT a\n  FROM t WHERE b=%s;', (1,)), query_id('SELECT a FROM t WHERE b=%s', (1,)))
+        self.assertNotEqual(query_id('SELECT a FROM t WHERE b=%s', (1,)), query_id('SELECT a FROM t WHERE b=%s', (2,)))
+
+    def test_recorded_results_are_replayed(self):
+        result = ((1, datetime(2016, 3, 31, 19, 0), timedelta(hours=20)),)
+        self.archive.record('SELECT EventType_Id, EventTime FROM SoLogEvent WHERE NightInfo_Id=%s', (7,), result)
+        self.archive.mode = 'replay'
+        self.assertEqual(result, self.archive.replay('SELECT EventType_Id, EventTime  FROM SoLogEvent WHERE NightInfo_Id=%s', (7,)))
+        with self.assertRaises(QueryNotArchived):
+            self.archive.replay('SELECT EventType_Id, EventTime FROM SoLogEvent WHERE NightInfo_Id=%s', (8,))
+
+
+class RecordReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.archive = QueryArchive(':memory:', 'record')
+        mysql.query_archive = self.archive
+        rq.query_archive = self.archive
+        self.db = StubDb(rows=[(i, datetime(2016, 3, 31, 19, i)) for i in range(5)])
+        self.sdb = mysql.mysql('localhost', 'sdb', 'user', 'password')
+        self.sdb.pool = mysql.ConnectionPool(lambda: self.db)
+
+    def tearDown(self):
+        mysql.query_archive = None
+        rq.query_archive = None
+        self.archive.close()
+
+    def replay(self):
+        """Switch to replay mode without a database"""
+        self.archive.mode = 'replay'
+        self.sdb.pool = mysql.ConnectionPool(no_connection)
+
+    def test_select_is_replayed(self):
+        recorded = self.sdb.select('SoLogEvent_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%s', (7,))
+        self.replay()
+        self.assertEqual(recorded, self.sdb.select('SoLogEvent_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%s', (7,)))
+
+    def test_select_chunks_is_replayed(self):
+        recorded = list(self.sdb.select_chunks('SoLogEvent_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%s', (7,), size=2))
+        self.replay()
+        self.assertEqual(recorded, list(self.sdb.select_chunks('SoLogEvent_Id, EventTime', 'SoLogEvent', 'NightInfo_Id=%s',
+                                                               (7,), size=2)))
+
+    def test_partly_consumed_chunks_are_not_archived(self):
+        for chunk in self.sdb.select_chunks('SoLogEvent_Id', 'SoLogEvent', 'NightInfo_Id=%s', (7,), size=2):
+            break
+        self.replay()
+        with self.assertRaises(QueryNotArchived):
+            list(self.sdb.select_chunks('SoLogEvent_Id', 'SoLogEvent', 'NightInfo_Id=%s', (7,), size=2))
+
+    def test_read_sql_query_is_replayed(self):
+        con = sqlite3.connect(':memory:')
+        con.executescript('''CREATE TABLE NightInfo (Date TEXT, ScienceTime INTEGER);
+                             INSERT INTO NightInfo VALUES ('2016-03-30', 20000), ('2016-03-31', 25000);''')
+        sql = 'SELECT Date, ScienceTime FROM NightInfo WHERE Date>=?'
+        recorded = rq.read_sql_query(sql, con, params=('2016-03-31',))
+        con.close()
+        self.replay()
+        replayed = rq.read_sql_query(sql, None, params=('2016-03-31',))
+        self.assertEqual(recorded.values.tolist(), replayed.values.tolist())
+        self.assertEqual(list(recorded.columns), list(replayed.columns))
+        with self.assertRaises(QueryNotArchived):
+            rq.read_sql_query(sql, None, params=('2016-03-30',))
@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from saltefficiency.util.query_cache import QueryCache
+
+
+class QueryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_least_recently_used_results_are_evicted(self):
+        cache = QueryCache(maxsize=2)
+        cache.set('a', date(2015, 3, 1), date(2015, 3, 7), 1)
+        cache.set('b', date(2015, 3, 1), date(2015, 3, 7), 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', date(2015, 3, 1), date(2015, 3, 7), 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_recent_results_expire_before_past_results(self):
+        cache = QueryCache(ttl=-1, past_ttl=3600)
+        cache.set('past', date(2015, 3, 1), date(2015, 3, 7), 1)
+        cache.set('recent', date(2015, 3, 1), date.today(), 2)
+        self.assertEqual(1, cache.get('past'))
+        self.assertIsNone(cache.get('recent'))
+
+    def test_results_are_copied(self):
+        cache = QueryCache()
+        value = [1, 2]
+        cache.set('a', date(2015, 3, 1), date(2015, 3, 7), value)
+        value.append(3)
+        cache.get('a').append(4)
+        self.assertEqual([1, 2], cache.get('a'))
+
+    def test_results_are_shared_and_invalidated_on_disk(self):
+        cache = QueryCache(directory=self.directory)
+        cache.set('week1', date(2015, 3, 1), date(2015, 3, 7), 1)
+        cache.set('week2', date(2015, 3, 8), date(2015, 3, 14), 2)
+        other = QueryCache(directory=self.directory)
+        self.assertEqual(1, other.get('week1'))
+        other.invalidate(date(2015, 3, 10))
+        self.assertIsNone(cache.get('week2'))
+        self.assertIsNone(QueryCache(directory=self.directory).get('week2'))
+        self.assertEqual(1, QueryCache(directory=self.directory).get('week1'))
+
+    def test_results_of_other_databases_are_not_returned(self):
+        cache = QueryCache(directory=self.directory, database='sdb.cape.saao.ac.za/sdb')
+        cache.set('week1', date(2015, 3, 1), date(2015, 3, 7), 1)
+        other = QueryCache(directory=self.directory, database='localhost/sdb_test')
+        self.assertIsNone(other.get('week1'))
+        other.set('week1', date(2015, 3, 1), date(2015, 3, 7), 2)
+        self.assertEqual(1, QueryCache(directory=self.directory, database='sdb.cape.saao.ac.za/sdb').get('week1'))
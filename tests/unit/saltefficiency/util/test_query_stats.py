@@ -0,0 +1,25 @@
+import unittest
+
+from saltefficiency.util.mysql import QueryStats
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def test_statements_are_aggregated_by_call_site(self):
+        stats = QueryStats(slow_query_time=None)
+        stats.record('blockvisitstats.get_pointevents', 'select', 'SELECT 1', 0.5, 10, 100)
+        stats.record('blockvisitstats.get_pointevents', 'select', 'SELECT 1', 1.5, 5, 50)
+        stats.record('night_data.fetch_events', 'select', 'SELECT 2', 0.1, 1, 8)
+        d = stats.as_dict()
+        self.assertEqual(3, d['total']['calls'])
+        self.assertEqual('blockvisitstats.get_pointevents', d['calls'][0]['tag'])
+        self.assertEqual(2, d['calls'][0]['calls'])
+        self.assertEqual(15, d['calls'][0]['rows'])
+        self.assertEqual(1.5, d['calls'][0]['max_seconds'])
+
+    def test_slow_statements_are_kept(self):
+        stats = QueryStats(slow_query_time=1.0, max_slow_queries=2)
+        self.assertFalse(stats.record('a.f', 'select', 'SELECT 1', 0.5, 1, 8))
+        self.assertTrue(stats.record('a.f', 'select', 'SELECT 1', 2.0, 1, 8))
+        for i in range(3):
+            stats.slow('a.f', 'SELECT %s', (i,), 2.0, 1, plan=[(1, 'SIMPLE')])
+        self.assertEqual(["(1,)", "(2,)"], [q['params'] for q in stats.as_dict()['slow_queries']])
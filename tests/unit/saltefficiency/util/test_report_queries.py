@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import timedelta
+
+from saltefficiency.util.report_queries import REPORT_BREAKDOWNS, ReportWindow, fetch_report, report_window
+
+
+SCHEMA = '''
+CREATE TABLE NightInfo (NightInfo_Id INTEGER, Date TEXT, EveningTwilightEnd TEXT, MorningTwilightStart TEXT,
+                        TimeLostToWeather INTEGER, TimeLostToProblems INTEGER, EngineeringTime INTEGER,
+                        ScienceTime INTEGER, OtherTime INTEGER);
+CREATE TABLE SaltSubsystem (SaltSubsystem_Id INTEGER, SaltSubsystem TEXT);
+CREATE TABLE Fault (Fault_Id INTEGER, NightInfo_Id INTEGER, SaltSubsystem_Id INTEGER, TimeLost INTEGER,
+                    Deleted INTEGER);
+CREATE TABLE ProposalType (ProposalType_Id INTEGER, ProposalType TEXT);
+CREATE TABLE ProposalGeneralInfo (ProposalCode_Id INTEGER, ProposalType_Id INTEGER);
+CREATE TABLE Proposal (Proposal_Id INTEGER, ProposalCode_Id INTEGER);
+CREATE TABLE Block (Block_Id INTEGER, Proposal_Id INTEGER, Priority INTEGER, ObsTime INTEGER);
+CREATE TABLE BlockVisitStatus (BlockVisitStatus_Id INTEGER, BlockVisitStatus TEXT);
+CREATE TABLE BlockVisit (BlockVisit_Id INTEGER, Block_Id INTEGER, NightInfo_Id INTEGER,
+                         BlockVisitStatus_Id INTEGER);
+
+INSERT INTO NightInfo VALUES (1, '2015-03-01', '2015-03-01 20:00:00', '2015-03-02 05:00:00', 3600, 1800, 0, 18000, NULL);
+INSERT INTO NightInfo VALUES (2, '2015-03-02', '2015-03-02 20:00:00', '2015-03-03 05:00:00', NULL, 0, 7200, 21600, 0);
+INSERT INTO NightInfo VALUES (3, '2015-03-03', '2015-03-03 20:00:00', '2015-03-04 05:00:00', 0, 0, 0, 32400, 0);
+INSERT INTO SaltSubsystem VALUES (1, 'DOME'), (2, 'TCS');
+INSERT INTO Fault VALUES (1, 1, 1, 1200, 0), (2, 1, 2, 600, 0), (3, 2, 1, 300, 1), (4, 3, 2, 900, 0);
+INSERT INTO ProposalType VALUES (1, 'Science'), (2, 'Engineering');
+INSERT INTO ProposalGeneralInfo VALUES (1, 1), (2, 2);
+INSERT INTO Proposal VALUES (1, 1), (2, 2);
+INSERT INTO Block VALUES (1, 1, 1, 1000), (2, 1, 2, 2000), (3, 2, 1, 4000), (4, 1, 2, 500);
+INSERT INTO BlockVisitStatus VALUES (1, 'Accepted'), (2, 'Rejected');
+INSERT INTO BlockVisit VALUES (1, 1, 1, 1), (2, 2, 2, 1), (3, 3, 2, 1), (4, 4, 2, 1), (5, 2, 2, 2), (6, 1, 3, 1);
+'''
+
+
+class ReportWindowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.executescript(SCHEMA)
+        # the nights of 2015-03-01 and 2015-03-02
+        self.window = ReportWindow(self.con, '2015-03-03', interval=2)
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_time_breakdown_per_night(self):
+        wtb = self.window.weekly_time_breakdown()
+        self.assertEqual(2, len(wtb))
+        self.assertEqual([1.0, 0.0], list(wtb['Weather']))
+        self.assertEqual([5.0, 6.0], list(wtb['Science']))
+        self.assertEqual([32400, 32400], list(wtb['Night']))
+        self.assertAlmostEqual(9.0 - 1.0 - 0.5 - 5.0, wtb['Unallocated'][0])
+        self.assertEqual(timedelta(hours=6), wtb['ScienceTime'][1])
+
+    def test_total_time_breakdown(self):
+        wttb = self.window.weekly_total_time_breakdown()
+        self.assertEqual(3600, wttb['Weather'][0])
+        self.assertEqual(7200, wttb['Engineering'][0])
+        self.assertEqual(64800, wttb['Total'][0])
+        self.assertEqual(timedelta(hours=18), wttb['NightLength'][0])
+
+    def test_priority_breakdown_counts_accepted_science_blocks(self):
+        wpb = self.window.weekly_priority_breakdown()
+        self.assertEqual([1, 2], list(wpb['Priority']))
+        self.assertEqual([1, 2], list(wpb['No. Blocks']))
+        self.assertEqual([1000, 2500], list(wpb['Tsec']))
+
+    def test_subsystem_breakdown_ignores_deleted_faults(self):
+        wsb = self.window.weekly_subsystem_breakdown()
+        self.assertEqual(['DOME', 'TCS'], list(wsb['SaltSubsystem']))
+        self.assertEqual([1200, 600], list(wsb['Time']))
+        self.assertEqual(1800, self.window.weekly_subsystem_breakdown_total()['Time'][0])
+
+    def test_report_window_reuses_matching_window(self):
+        self.assertIs(self.window, report_window(self.window, '2015-03-03', 2))
+        with self.assertRaises(ValueError):
+            report_window(self.window, '2015-03-04', 2)
+
+    def test_fetch_report_bundles_all_breakdowns(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            con = sqlite3.connect(path)
+            con.executescript(SCHEMA)
+            con.close()
+            report = fetch_report(lambda: sqlite3.connect(path, check_same_thread=False), '2015-03-03', 2)
+            for name in REPORT_BREAKDOWNS:
+                self.assertIn(name, report['timings'])
+            for name in ['nights', 'faults', 'blocks']:
+                self.assertIn(name, report['timings'])
+            self.assertEqual(list(self.window.weekly_time_breakdown()['Night']),
+                             list(report['weekly_time_breakdown']['Night']))
+        finally:
+            os.remove(path)
@@ -0,0 +1,43 @@
+import unittest
+
+import saltefficiency.util.tracing as tracing
+
+
+class TracingTestCase(unittest.TestCase):
+    def tearDown(self):
+        tracing.tracer = None
+
+    def test_spans_are_only_recorded_if_enabled(self):
+        with tracing.span('stage'):
+            pass
+        self.assertIsNone(tracing.tracer)
+        tracing.enable()
+        with tracing.span('stage', obsdate='20160331'):
+            pass
+        self.assertEqual(['stage'], [s['name'] for s in tracing.tracer.spans])
+
+    def test_chrome_trace_has_complete_events(self):
+        tracer = tracing.enable()
+
+        @tracing.traced('outer')
+        def outer():
+            with tracing.span('inner'):
+                pass
+
+        outer()
+        events = tracer.chrome_trace()['traceEvents']
+        self.assertEqual(['outer', 'inner'], [e['name'] for e in events])
+        self.assertTrue(all(e['ph'] == 'X' for e in events))
+        self.assertLessEqual(events[1]['dur'], events[0]['dur'])
+        self.assertIn('inner', tracer.summary())
+
+    def test_memory_growth_is_recorded_per_span(self):
+        tracer = tracing.enable()
+        with tracing.span('allocating'):
+            data = 'x' * (64 << 20)
+        del data
+        with tracing.span('not_allocating'):
+            pass
+        growth = [s['rss_growth_kb'] for s in tracer.spans]
+        self.assertGreater(growth[0], 32 << 10)
+        self.assertLess(growth[1], 1 << 10)
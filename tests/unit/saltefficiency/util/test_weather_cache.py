@@ -0,0 +1,71 @@
+import datetime
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from saltefficiency.util.sdb_utils import decodeweather, els_time
+from saltefficiency.util.weather_cache import WeatherCache, night_of, nights_of
+
+
+class FakeEls(object):
+    def __init__(self, timestamps):
+        self.queries = []
+        temperatures = '\x00' * 4 + struct.pack('>7d', 1, 2, 3, 4, 5, 6, 7)
+        self.records = [(t, 800.0, 2.0, 50.0, 5.0, 90.0, 4.0, 80.0, temperatures, 0) for t in timestamps]
+
+    def select_chunks(self, selection, table, logic, params=None, size=1000):
+        self.queries.append(params)
+        records = [r for r in self.records if params[0] < r[0] <= params[1]]
+        for i in range(0, len(records), size):
+            yield records[i:i + size]
+
+
+class WeatherCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = WeatherCache(self.directory)
+        self.start = int(els_time(datetime.datetime(2015, 3, 10, 20, 0, 0)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_ranges(self):
+        self.cache.add(decodeweather([], 0), 100, 200)
+        self.cache.add(decodeweather([], 0), 300, 400)
+        self.assertEqual([(50, 100), (200, 300), (400, 500)], self.cache.missing(50, 500))
+        self.assertTrue(self.cache.contains(120, 180))
+
+    def test_adjacent_ranges_are_merged(self):
+        self.cache.add(decodeweather([], 0), 100, 200)
+        self.cache.add(decodeweather([], 0), 200, 300)
+        self.assertEqual([(100, 300)], self.cache.covered)
+        self.assertEqual(300, WeatherCache(self.directory).high_water_mark)
+
+    def test_night_of_wraps_at_noon(self):
+        self.assertEqual('20150310', night_of(self.start))
+        self.assertEqual('20150310', night_of(self.start + 10 * 3600))
+        self.assertEqual('20150311', night_of(self.start + 17 * 3600))
+
+    def test_nights_of_matches_night_of(self):
+        timestamps = np.arange(self.start-13*3600, self.start+60*3600, 1800)
+        self.assertEqual([night_of(t) for t in timestamps], list(nights_of(timestamps)))
+
+    def test_ranges_added_by_other_processes_are_kept(self):
+        other = WeatherCache(self.directory)
+        self.cache.add(decodeweather([], 0), 100, 200)
+        other.add(decodeweather([], 0), 300, 400)
+        self.assertEqual([(100, 200), (300, 400)], WeatherCache(self.directory).covered)
+
+    def test_sync_only_fetches_new_records(self):
+        els = FakeEls(range(self.start, self.start + 8 * 3600, 600))
+        self.cache.sync(els, self.start, self.start + 4 * 3600)
+        self.cache.sync(els, self.start, self.start + 8 * 3600)
+        self.assertEqual([(self.start, self.start + 4 * 3600), (self.start + 4 * 3600, self.start + 8 * 3600)],
+                         els.queries)
+
+        records = self.cache.read(self.start, self.start + 8 * 3600)
+        self.assertEqual(range(self.start + 600, self.start + 8 * 3600, 600), list(records['time']))
+        self.assertEqual(7.0, records['t30'][0])